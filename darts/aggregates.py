@@ -0,0 +1,160 @@
+"""Players statistics maintained incrementally.
+
+The game updates the counters in `models.PlayerStats` and
+`models.PlayerSegmentStats` by deltas at every throw and undo, in the same
+transaction of the throw. The "rebuild_stats" command recomputes them from
+the throws history.
+"""
+
+import sqlite3
+
+from django.db import connection
+from django.db.models import F, Max
+
+from darts import models
+from darts import archive
+
+# the counters of PlayerStats changed by deltas
+COUNTERS = ('darts', 'points', 'visits', 'first9_darts', 'first9_points',
+    'checkout_attempts', 'checkouts', 'doubles',
+    'scores_100', 'scores_140', 'scores_180')
+
+# the number of rounds counted in the "first 9 darts" stats
+FIRST_VISITS = 3
+
+def is_finish(score, rules):
+    """Return True if the score can be finished with a single dart."""
+    return score in rules.finishes
+
+def round_points(score_start, scores, score_end):
+    """Return the points scored in a round (0 if bust)."""
+    if score_end is not None:
+        return score_start - score_end
+    else:
+        return sum(scores)
+
+def throw_deltas(code, score, score_start, prev_scores, score_end, visit,
+        rules):
+    """Return the changes to the counters made by a throw.
+
+    `prev_scores` are the scores of the throws before in the round,
+    `score_end` is the score at the end of the round after the throw (`None`
+    if the round is still open), `visit` is the number of rounds played by
+    the player before in the leg. The `rules` of the match tell the darts
+    that can finish the leg: the "doubles" counted are the finishing darts
+    hit when on a finish, whatever the out rule.
+
+    Return a dict counter -> delta.
+    """
+    p0 = sum(prev_scores)
+    p1 = round_points(score_start, list(prev_scores) + [score], score_end)
+
+    rv = dict.fromkeys(COUNTERS, 0)
+    rv['darts'] = 1
+    rv['points'] = p1 - p0
+    if not prev_scores:
+        rv['visits'] = 1
+    if visit < FIRST_VISITS:
+        rv['first9_darts'] = 1
+        rv['first9_points'] = p1 - p0
+
+    left = score_start - p0
+    if is_finish(left, rules):
+        rv['checkout_attempts'] = 1
+        if code in rules.finishing:
+            rv['doubles'] = 1
+            if score == left:
+                rv['checkouts'] = 1
+
+    rv['scores_100'] = (p1 >= 100) - (p0 >= 100)
+    rv['scores_140'] = (p1 >= 140) - (p0 >= 140)
+    rv['scores_180'] = (p1 == 180) - (p0 == 180)
+    return rv
+
+def throw_played(player_id, code, deltas, finish=None):
+    """Add the deltas of a throw to the player counters.
+
+    `finish` is the score finished if the throw has won a leg. Cost a query
+    per counters table if the database can upsert.
+    """
+    if not _can_upsert():
+        _update(player_id, code, deltas, 1)
+        if finish:
+            (models.PlayerStats.objects
+                .filter(player=player_id, highest_finish__lt=finish)
+                .update(highest_finish=finish))
+        return
+
+    table = models.PlayerStats._meta.db_table
+    cols = [ models.PlayerStats._meta.get_field(k).column for k in COUNTERS ]
+    sets = [ '%s = %s.%s + excluded.%s' % (c, table, c, c) for c in cols ]
+    sets.append('highest_finish = CASE '
+        'WHEN excluded.highest_finish > %s.highest_finish '
+        'THEN excluded.highest_finish ELSE %s.highest_finish END'
+        % (table, table))
+
+    cur = connection.cursor()
+    cur.execute("""
+        INSERT INTO %s (player_id, %s, highest_finish)
+        VALUES (%s)
+        ON CONFLICT (player_id) DO UPDATE SET %s
+        """ % (table, ', '.join(cols), ', '.join(['%s'] * (len(cols) + 2)),
+            ', '.join(sets)),
+        [player_id] + [ deltas[k] for k in COUNTERS ] + [finish or 0])
+
+    table = models.PlayerSegmentStats._meta.db_table
+    cur.execute("""
+        INSERT INTO %s (player_id, code, hits) VALUES (%%s, %%s, 1)
+        ON CONFLICT (player_id, code) DO UPDATE SET hits = %s.hits + 1
+        """ % (table, table),
+        [player_id, code])
+
+def throw_undone(player_id, code, deltas, won=False):
+    """Remove the deltas of a throw from the player counters.
+
+    Call it after the throw has been removed from the database: if the throw
+    had won a leg the highest finish is looked up again.
+    """
+    if won:
+        _update(player_id, code, deltas, -1,
+            highest_finish=highest_finish(player_id))
+    else:
+        _update(player_id, code, deltas, -1)
+
+def highest_finish(player_id):
+    """Return the highest score finished by a player in the history."""
+    rv = (models.Round.objects
+        .filter(player=player_id, score_end=0)
+        .aggregate(n=Max('score_start'))['n'] or 0)
+
+    # the archived legs won: the finish is the start of their last round
+    for mid, leg_id, rules, rounds in archive.archived_legs(
+            models.Leg.objects.filter(winner=player_id)):
+        if rounds and rounds[-1][3] == 0:
+            rv = max(rv, rounds[-1][2])
+    return rv
+
+def _can_upsert():
+    """Return True if the database supports INSERT ... ON CONFLICT."""
+    if connection.vendor == 'sqlite':
+        return sqlite3.sqlite_version_info >= (3, 24)
+    elif connection.vendor == 'postgresql':
+        connection.cursor()     # the version is read from the connection
+        return connection.pg_version >= 90500
+    else:
+        return False
+
+def _update(player_id, code, deltas, sign, **values):
+    changes = dict((k, F(k) + sign * v) for k, v in deltas.iteritems() if v)
+    changes.update(values)
+    if not (models.PlayerStats.objects
+            .filter(player=player_id).update(**changes)):
+        # the first throw of the player
+        values.update((k, sign * v) for k, v in deltas.iteritems())
+        models.PlayerStats.objects.create(player_id=player_id, **values)
+
+    if not (models.PlayerSegmentStats.objects
+            .filter(player=player_id, code=code)
+            .update(hits=F('hits') + sign)):
+        models.PlayerSegmentStats.objects.create(
+            player_id=player_id, code=code, hits=sign)
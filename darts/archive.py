@@ -0,0 +1,207 @@
+"""Archival of the finished matches.
+
+The throws of a finished match can't change anymore: archiving a match packs
+the darts of every leg in a blob stored in the leg row and deletes its rounds
+and throws rows. Every dart takes a byte: the index of its code in `CODES`
+(so new codes must only be appended), with the `ROUND_END` bit set on the
+last dart of every round.
+
+Everything else is replayed from the darts by the rules of the match: who
+threw, the scores of the rounds and of the throws, the busts. The match
+state, the statistics and the export rehydrate the archived legs
+transparently; to change an archived match again restore its rows first.
+"""
+
+from django.db import transaction
+from django.db.models import F
+
+from darts import models
+from darts import rules as game_rules
+from darts.codes import GameError, CODES
+
+# the bit marking the last dart of a round
+ROUND_END = 0x80
+
+_CODES_INDEX = dict((c.code, i) for i, c in enumerate(CODES))
+assert len(CODES) <= ROUND_END
+
+# the matches to read at time, not to exceed the SQLite parameters limit
+_BATCH_SIZE = 500
+
+
+def pack(rounds):
+    """Return the packed darts of the rounds of a leg.
+
+    `rounds` is a list of `RoundState`. Raise `GameError` if the rounds can't
+    be packed.
+    """
+    return pack_codes([ (r.number, [ t.code for t in r.throws ],
+            r.score_end is not None)
+        for r in rounds ])
+
+def pack_codes(rounds):
+    """Return the packed darts of a leg from the codes of its rounds.
+
+    `rounds` is a list of tuples (number, codes, ended). Raise `GameError` if
+    the rounds can't be packed.
+    """
+    rv = bytearray()
+    for number, codes, ended in rounds:
+        if not codes:
+            raise GameError("round %s has no throw" % number)
+        for code in codes:
+            try:
+                rv.append(_CODES_INDEX[code])
+            except (KeyError, TypeError):
+                raise GameError("bad throw code: '%s'" % (code,))
+        if ended:
+            rv[-1] |= ROUND_END
+
+    return str(rv)
+
+def unpack(darts, rules, target_score, player_ids):
+    """Replay the packed darts of a leg.
+
+    `rules` are the `Rules` of the match, `player_ids` the players in the
+    order they play the leg. Return the list of the rounds played, each one a
+    tuple (number, player id, score start, score end, throws), the throws a
+    list of tuples (code, score).
+    """
+    nplayers = len(player_ids)
+    rounds = []
+    throws = None
+    for byte in bytearray(darts):
+        if throws is None:
+            number = len(rounds) + 1
+            if number > nplayers:
+                score_start = rounds[-nplayers][3]
+            else:
+                score_start = target_score
+            score = score_start
+            throws = []
+
+        code = CODES[byte & ~ROUND_END].code
+        value, result = rules.play(code, score, target_score)
+        score -= value
+        throws.append((code, value))
+
+        if byte & ROUND_END:
+            if result == game_rules.BUST:
+                score = score_start
+            rounds.append((number, player_ids[(number - 1) % nplayers],
+                score_start, score, throws))
+            throws = None
+
+    if throws is not None:
+        # the round in play when the match was archived: can't happen for a
+        # finished match, but better not lose darts
+        rounds.append((number, player_ids[(number - 1) % nplayers],
+            score_start, None, throws))
+
+    return rounds
+
+def archived_legs(legs):
+    """Generate the archived legs in a queryset of legs, replayed.
+
+    Return tuples (match id, leg id, rules, rounds), with the `Rules` of the
+    match and the rounds as returned by `unpack()`, in the queryset order or
+    else by match and number.
+    """
+    if not legs.ordered:
+        legs = legs.order_by('match', 'number')
+    legs = list(legs.filter(darts__isnull=False)
+        .values_list('match', 'id', 'number', 'darts'))
+    if not legs:
+        return
+
+    mids = sorted(set(row[0] for row in legs))
+    matches = {}
+    players = {}
+    for i in range(0, len(mids), _BATCH_SIZE):
+        batch = mids[i:i + _BATCH_SIZE]
+        for id, match_rules, target_score in (models.Match.objects
+                .filter(id__in=batch)
+                .values_list('id', 'rules', 'target_score')):
+            matches[id] = (game_rules.get(match_rules), target_score)
+        for mid, pid in (models.Entrant.objects
+                .filter(match__in=batch).order_by('order')
+                .values_list('match', 'player')):
+            players.setdefault(mid, []).append(pid)
+
+    for mid, id, number, darts in legs:
+        match_rules, target_score = matches[mid]
+        pids = players[mid]
+        idx = (number - 1) % len(pids)
+        yield mid, id, match_rules, unpack(darts, match_rules, target_score,
+            pids[idx:] + pids[:idx])
+
+
+@transaction.commit_on_success
+def archive(state):
+    """Pack the throws of a finished match, given its `MatchState`.
+
+    Return the number of rounds and throws rows deleted. Raise `GameError` if
+    the match can't be archived. The caller should invalidate the cached
+    state after.
+    """
+    if state.winner_id is None:
+        raise GameError("match %s is not finished" % state.match_id)
+    if state.archived:
+        raise GameError("match %s is already archived" % state.match_id)
+
+    packed = []
+    for leg in state.legs:
+        darts = pack(leg.rounds)
+        rounds = [ (r.number, r.player_id, r.score_start, r.score_end,
+                [ (t.code, t.score) for t in r.throws ])
+            for r in leg.rounds ]
+        if unpack(darts, state.rules, state.target_score,
+                state.leg_order(leg.number)) != rounds:
+            raise GameError("leg %s of match %s can't be replayed"
+                % (leg.number, state.match_id))
+        packed.append((leg.id, darts))
+
+    _bump_version(state)
+    for id, darts in packed:
+        models.Leg.objects.filter(id=id).update(darts=darts)
+    models.Throw.objects.filter(round__leg__match=state.match_id).delete()
+    models.Round.objects.filter(leg__match=state.match_id).delete()
+
+    # the state is read from the legs from now on
+    models.MatchLog.objects.filter(match=state.match_id).delete()
+    models.MatchSnapshot.objects.filter(match=state.match_id).delete()
+    return sum(len(r.throws) + 1 for leg in state.legs for r in leg.rounds)
+
+@transaction.commit_on_success
+def restore(state):
+    """Write back the rounds and throws rows of an archived match.
+
+    Return the number of rows inserted. The caller should invalidate the
+    cached state after.
+    """
+    if not state.archived:
+        raise GameError("match %s is not archived" % state.match_id)
+
+    _bump_version(state)
+    rv = 0
+    for leg in state.legs:
+        for r in leg.rounds:
+            rid = models.Round.objects.create(leg_id=leg.id, number=r.number,
+                player_id=r.player_id, score_start=r.score_start,
+                score_end=r.score_end).id
+            models.Throw.objects.bulk_create([ models.Throw(round_id=rid,
+                    number=t.number, code=t.code, score=t.score)
+                for t in r.throws ])
+            rv += len(r.throws) + 1
+
+    models.Leg.objects.filter(match=state.match_id).update(darts=None)
+    return rv
+
+def _bump_version(state):
+    # the same check of the game: fail if the match changed since the state
+    # was read
+    if not (models.Match.objects
+            .filter(id=state.match_id, version=state.match_version)
+            .update(version=F('version') + 1)):
+        raise GameError("match %s changed meanwhile" % state.match_id)
+    state.match_version += 1
@@ -0,0 +1,243 @@
+"""Tools to benchmark the game.
+
+The benchmarks run on a test database, created empty and destroyed at the
+end, and play simulated players throwing realistic darts.
+"""
+
+import os
+import gc
+import time
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max
+
+from darts import models
+from darts import checkout
+from darts import rules
+from darts.state import MatchState
+from darts.utils import BOARD, bulk_insert
+
+@contextmanager
+def test_database(verbosity=0, shared=False):
+    """Run a block on a new test database, destroyed at the end.
+
+    If `shared` the database can be used by other threads too: SQLite gets a
+    file instead of an in-memory database.
+    """
+    settings_dict = connection.settings_dict
+    old_name = settings_dict['NAME']
+    old_test_name = settings_dict.get('TEST_NAME')
+    if shared and connection.vendor == 'sqlite' \
+            and old_test_name in (None, ':memory:'):
+        settings_dict['TEST_NAME'] = os.path.join(tempfile.gettempdir(),
+            'darts-test-%d.sqlite3' % os.getpid())
+
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        settings_dict['TEST_NAME'] = old_test_name
+
+def parse_ints(s):
+    """Parse a list of numbers such as '1-4,8' into [1, 2, 3, 4, 8]."""
+    rv = []
+    for part in s.split(','):
+        if '-' in part:
+            start, end = map(int, part.split('-'))
+            rv.extend(range(start, end + 1))
+        else:
+            rv.append(int(part))
+    return rv
+
+def percentile(values, pct):
+    """Return the percentile `pct` (0-100) of a list of values."""
+    if not values:
+        return None
+    values = sorted(values)
+    idx = int(round((len(values) - 1) * pct / 100.0))
+    return values[idx]
+
+def timed(f, *args, **kwargs):
+    """Call a function and return the time it took, in milliseconds."""
+    t0 = time.time()
+    f(*args, **kwargs)
+    return (time.time() - t0) * 1000
+
+def mean(values):
+    if not values:
+        return None
+    return float(sum(values)) / len(values)
+
+
+class Player(object):
+    """A simulated darts player.
+
+    The player aims for a reasonable target given the score left and hits it
+    with probability `accuracy`, else hits something close to it.
+    """
+    def __init__(self, rng, accuracy=0.4):
+        self.rng = rng
+        self.accuracy = accuracy
+
+    def aim(self, score, darts_left):
+        return checkout.target(score, darts_left)
+
+    def throw(self, score, darts_left):
+        code = self.aim(score, darts_left)
+        rng = self.rng
+        if rng.random() < self.accuracy:
+            return code
+
+        if code in ('BULL', 'RING'):
+            return rng.choice(['RING', 'RING', str(rng.choice(BOARD))])
+
+        mult = code[0] if code[0] in 'DT' else ''
+        number = int(code.lstrip('DT'))
+        x = rng.random()
+        if x < 0.5:
+            # same number, wrong ring
+            if mult == 'D':
+                return rng.choice(['MISS', str(number)])
+            return str(number)
+        else:
+            # the number close
+            idx = BOARD.index(number) + rng.choice([-1, 1])
+            return mult + str(BOARD[idx % len(BOARD)])
+
+
+class Sample(object):
+    __slots__ = ('time', 'queries', 'objects')
+
+    def __init__(self, time, queries, objects):
+        self.time = time
+        self.queries = queries
+        self.objects = objects
+
+
+class Recorder(object):
+    """Measure the requests made to the darts views.
+
+    For every request record the wall time, the number of queries executed
+    and the net number of objects allocated (as counted by the garbage
+    collector, so only containers are accounted).
+    """
+    def __init__(self):
+        self.samples = {}
+
+    def measure(self, endpoint, f, *args, **kwargs):
+        old_debug = settings.DEBUG
+        settings.DEBUG = True   # or queries are not recorded
+        gc.disable()
+        try:
+            count0 = gc.get_count()[0]
+            t0 = time.time()
+            rv = f(*args, **kwargs)
+            t1 = time.time()
+            count1 = gc.get_count()[0]
+        finally:
+            gc.enable()
+            settings.DEBUG = old_debug
+
+        # the queries list is reset at every request
+        self.samples.setdefault(endpoint, []).append(
+            Sample(t1 - t0, len(connection.queries), count1 - count0))
+        return rv
+
+    def report(self):
+        """Return a summary per endpoint as a list of dicts."""
+        rv = []
+        for endpoint in sorted(self.samples):
+            samples = self.samples[endpoint]
+            times = [ s.time * 1000 for s in samples ]
+            queries = [ s.queries for s in samples ]
+            objects = [ s.objects for s in samples ]
+            rv.append({
+                'endpoint': endpoint,
+                'requests': len(samples),
+                'queries_mean': mean(queries),
+                'queries_max': max(queries),
+                'time_mean': mean(times),
+                'time_p95': percentile(times, 95),
+                'objects_mean': mean(objects),
+            })
+        return rv
+
+
+def populate(nthrows, rng, nplayers=2, target_score=501, legs_number=3):
+    """Fill the database with finished matches for `nthrows` throws or more.
+
+    The matches are simulated in memory and the rows inserted in bulk, which
+    is much faster than playing them through the game.
+    """
+    players = [ models.Player.objects.create(
+            username='populate%d' % i, avatar='player.png')
+        for i in range(nplayers) ]
+    sims = dict((p.id, Player(rng)) for p in players)
+
+    ids = {}
+    def next_id(model):
+        if model not in ids:
+            ids[model] = (model.objects.aggregate(id=Max('id'))['id'] or 0)
+        ids[model] += 1
+        return ids[model]
+
+    rows = dict((model, []) for model in
+        (models.Match, models.Entrant, models.Leg, models.Round, models.Throw))
+    count = 0
+    while count < nthrows:
+        state = MatchState(next_id(models.Match), target_score, legs_number,
+            [ p.id for p in players ])
+        while state.winner_id is None:
+            leg = state.current_leg
+            round = state.current_round
+            code = sims[round.player_id].throw(round.score,
+                3 - len(round.throws))
+            value, result = state.rules.play(code, round.score, target_score)
+            new_score = round.score - value
+            win = result == rules.WIN
+            bust = result == rules.BUST
+
+            if leg.id is None:
+                leg.id = next_id(models.Leg)
+            if round.id is None:
+                round.id = next_id(models.Round)
+            throw = state.add_throw(code, value)
+            throw.id = next_id(models.Throw)
+            count += 1
+
+            if bust:
+                state.end_round(round.score_start)
+            elif win or throw.number == 3:
+                state.end_round(new_score)
+            if win:
+                state.win_leg(round.player_id)
+
+        rows[models.Match].append(models.Match(id=state.match_id,
+            target_score=target_score, legs_number=legs_number,
+            legs_played=state.legs_played, winner_id=state.winner_id))
+        for i, p in enumerate(players):
+            rows[models.Entrant].append(models.Entrant(
+                id=next_id(models.Entrant), match_id=state.match_id,
+                player_id=p.id, order=i + 1, result=state.legs_won[p.id]))
+        for leg in state.legs:
+            rows[models.Leg].append(models.Leg(id=leg.id,
+                match_id=state.match_id, number=leg.number,
+                winner_id=leg.winner_id))
+            for r in leg.rounds:
+                rows[models.Round].append(models.Round(id=r.id, leg_id=leg.id,
+                    number=r.number, player_id=r.player_id,
+                    score_start=r.score_start, score_end=r.score_end))
+                for t in r.throws:
+                    rows[models.Throw].append(models.Throw(id=t.id,
+                        round_id=r.id, number=t.number, code=t.code,
+                        score=t.score))
+
+    for model in (models.Match, models.Entrant, models.Leg, models.Round,
+            models.Throw):
+        bulk_insert(model, rows[model])
+
+    return count
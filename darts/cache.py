@@ -1,4 +1,8 @@
+import sys
+from time import time
+from threading import Lock, RLock, Event
 from functools import wraps
+from collections import OrderedDict
 
 def cached(f):
 	"""Evaluate a function call only once.
@@ -6,8 +10,9 @@ def cached(f):
 	The function should be called using only positional arguments. All the
 	parameters should be hashable.
 
-	The decorator is not thread-safe. If needed use the `synchro` decorator
-	to serialize access to the function.
+	The decorator is not thread-safe and the cache is never emptied. If needed
+	use the `synchro` decorator to serialize access to the function, or use
+	`cached_lru` instead.
 	"""
 	return cached_in({})(f)
 
@@ -39,6 +44,7 @@ def cached_method(f):
 	decorator to serialize access to the function.
 	"""
 	cache_name = "_cache_%s" % f.__name__
+	hook_name = "%s.%s" % (f.__module__.rsplit('.', 1)[-1], f.__name__)
 	@wraps(f)
 	def cached_method_(self, *args):
 		try:
@@ -48,11 +54,235 @@ def cached_method(f):
 			setattr(self, cache_name, cache)
 
 		try:
-			return cache[args]
+			rv = cache[args]
 		except KeyError:
+			if cached_method_hook is not None:
+				cached_method_hook(hook_name, False)
 			cache[args] = f(self, *args)
 			return cache[args]
+		else:
+			if cached_method_hook is not None:
+				cached_method_hook(hook_name, True)
+			return rv
 
 	return cached_method_
 
+# If set, called as hook(name, hit) at every call of a cached method
+cached_method_hook = None
+
+class LRUCache(object):
+	"""A mapping with a maximum size and an optional time to live.
+
+	When the cache is full the least recently used item is discarded. Items
+	stored more than `ttl` seconds ago are considered missing.
+
+	Access to the cache is serialized, so an instance can be shared among
+	threads.
+
+	The cache counts its hits, misses, evictions and expired items: if a
+	`name` is given it is added to the `registry`, from which the counters
+	can be read.
+	"""
+	def __init__(self, maxsize=100, ttl=None, name=None):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.name = name
+		self._data = OrderedDict()
+		self._lock = Lock()
+		self.hits = self.misses = self.evictions = self.expirations = 0
+		if name is not None:
+			registry[name] = self
+
+	def get(self, key, default=None):
+		with self._lock:
+			value = self._lookup(key, _missing)
+			if value is _missing:
+				self.misses += 1
+				return default
+			else:
+				self.hits += 1
+				return value
+
+	def _lookup(self, key, default):
+		# call it holding the lock
+		try:
+			value, expires = self._data.pop(key)
+		except KeyError:
+			return default
+
+		if expires is not None and expires < time():
+			self.expirations += 1
+			return default
+
+		# reinsert as the most recently used
+		self._data[key] = (value, expires)
+		return value
+
+	def put(self, key, value):
+		if self.ttl is not None:
+			expires = time() + self.ttl
+		else:
+			expires = None
+
+		with self._lock:
+			self._data.pop(key, None)
+			self._data[key] = (value, expires)
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+				self.evictions += 1
+
+	def pop(self, key, default=None):
+		with self._lock:
+			try:
+				value, expires = self._data.pop(key)
+			except KeyError:
+				return default
+
+			if expires is not None and expires < time():
+				return default
+
+			return value
+
+	def clear(self):
+		with self._lock:
+			self._data.clear()
+
+	def stats(self):
+		"""Return the counters of the cache as a dict."""
+		with self._lock:
+			return {
+				'size': len(self._data),
+				'maxsize': self.maxsize,
+				'hits': self.hits,
+				'misses': self.misses,
+				'evictions': self.evictions,
+				'expirations': self.expirations,
+			}
+
+	def __len__(self):
+		return len(self._data)
+
+# The caches with a name, by name
+registry = {}
+
+_missing = object()
+
+
+def cached_lru(maxsize=100, ttl=None):
+	"""Evaluate a function call only once, keeping a limited number of results.
+
+	Like `cached` but thread-safe, with the results stored in a `LRUCache` of
+	size `maxsize` and time to live `ttl`. The cache is registered with the
+	name of the function and is available as the `cache` attribute of the
+	function decorated.
+	"""
+	def cached_lru_(f):
+		cache = LRUCache(maxsize=maxsize, ttl=ttl,
+			name='%s.%s' % (f.__module__, f.__name__))
+		return cached_lru_in(cache)(f)
+
+	return cached_lru_
+
+def cached_lru_in(cache):
+	"""Evaluate a function call only once, storing the results in a `LRUCache`.
+
+	Like `cached_in` but thread-safe. When concurrent calls with the same
+	arguments miss the cache the function is evaluated only once: the other
+	callers wait for its result (or its exception).
+	"""
+	def cached_lru_in_(f):
+		flights = {}
+		lock = Lock()
+
+		@wraps(f)
+		def cached_lru_in__(*args):
+			value = cache.get(args, _missing)
+			if value is not _missing:
+				return value
+
+			with lock:
+				flight = flights.get(args)
+				if flight is not None:
+					leader = False
+				else:
+					# the result may have arrived meanwhile
+					with cache._lock:
+						value = cache._lookup(args, _missing)
+					if value is not _missing:
+						return value
+					leader = True
+					flight = flights[args] = _Flight()
+
+			if not leader:
+				return flight.wait()
+
+			# whatever happens, e.g. KeyboardInterrupt, release the waiters
+			try:
+				value = f(*args)
+			except BaseException:
+				flight.fail(sys.exc_info())
+				raise
+			else:
+				try:
+					cache.put(args, value)
+				finally:
+					flight.done(value)
+				return value
+			finally:
+				with lock:
+					del flights[args]
+
+		cached_lru_in__.cache = cache
+		return cached_lru_in__
+
+	return cached_lru_in_
+
+class _Flight(object):
+	"""A function evaluation other threads can wait for."""
+	def __init__(self):
+		self._event = Event()
+		self._value = None
+		self._exc_info = None
+
+	def done(self, value):
+		self._value = value
+		self._event.set()
+
+	def fail(self, exc_info):
+		self._exc_info = exc_info
+		self._event.set()
+
+	def wait(self):
+		self._event.wait()
+		if self._exc_info is not None:
+			raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+		return self._value
+
+
+def synchro(f):
+	"""Serialize the calls to a function: only one thread at time runs it."""
+	lock = RLock()
+	@wraps(f)
+	def synchro_(*args, **kwargs):
+		with lock:
+			return f(*args, **kwargs)
+
+	return synchro_
+
+def synchro_method(f):
+	"""Serialize the calls to a method on the same instance."""
+	lock_name = "_lock_%s" % f.__name__
+	@wraps(f)
+	def synchro_method_(self, *args, **kwargs):
+		lock = self.__dict__.get(lock_name)
+		if lock is None:
+			with _locks_lock:
+				lock = self.__dict__.setdefault(lock_name, RLock())
+
+		with lock:
+			return f(self, *args, **kwargs)
+
+	return synchro_method_
 
+# Serialize the creation of the locks of synchro_method
+_locks_lock = Lock()
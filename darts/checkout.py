@@ -0,0 +1,161 @@
+"""Precomputed tables of the finishes available for every score.
+
+The tables are built once at import time, one for every out rule (see
+`darts.rules`): for every score and number of darts left they contain every
+way to finish the leg, the preferred first.
+
+A finish must end on a dart allowed by the out rule: in double-out on a
+double or on the bull. The finishes are ranked by:
+
+- number of darts: fewer is better;
+- difficulty of the darts: singles are the easiest target, then trebles,
+  then doubles, ring and bull; the bull is the hardest finish;
+- preference of the finishing dart, in the order of `FINISH_PREFERENCE`,
+  then the highest.
+
+Permutations of the same setup darts are only reported once, the highest
+scoring dart first.
+"""
+
+from django.utils import simplejson
+
+from darts import rules
+from darts.codes import CODES, parse_code
+
+MAX_DARTS = 3
+
+# The preferred doubles to finish: the ones that can be halved many times
+# first, so that hitting the single still leaves a double.
+FINISH_PREFERENCE = ['D20', 'D16', 'D8', 'D18', 'D12', 'D10', 'D4', 'D14',
+    'D6', 'D2', 'D19', 'D17', 'D15', 'D13', 'D11', 'D9', 'D7', 'D5', 'D3',
+    'D1', 'BULL']
+
+# The difficulty to hit a target, by multiplier
+DIFFICULTY = {1: 1, 2: 3, 3: 2}
+
+# The difficulty of the last dart, by multiplier: relatively to the others
+# the bull is harder to hit to finish
+FINISH_DIFFICULTY = {1: 0, 2: 2, 3: 1}
+
+def _difficulty(c, last=False):
+    if c.code == 'RING':
+        return 3
+    if c.code == 'BULL':
+        return last and 4 or 3
+    return (last and FINISH_DIFFICULTY or DIFFICULTY)[c.multiplier]
+
+def _setup_segments():
+    """Return the darts that can be thrown before the last one.
+
+    Return a list of (code, value, difficulty), the highest values first.
+    """
+    rv = []
+    for c in CODES:
+        if c.value:
+            rv.append((c.code, c.value, _difficulty(c)))
+    rv.sort(key=lambda s: (-s[1], s[2]))
+    return rv
+
+def _finish_segments(out):
+    """Return the darts that can end a leg with an out rule.
+
+    Return a list of (code, value, difficulty, rank).
+    """
+    is_finishing = rules.OUTS[out]
+    codes = [ parse_code(code) for code in FINISH_PREFERENCE ]
+    codes.extend(sorted((c for c in CODES
+            if c.code not in FINISH_PREFERENCE),
+        key=lambda c: (-c.value, c.multiplier)))
+
+    rv = []
+    for c in codes:
+        if is_finishing(c):
+            rv.append((c.code, c.value, _difficulty(c, last=True), len(rv)))
+    return rv
+
+def _build(out):
+    setups = _setup_segments()
+    finishes = _finish_segments(out)
+
+    # map (score, number of darts) -> [(rank key, path)]
+    found = {}
+    def add(score, path, key):
+        try:
+            found[score, len(path)].append((key, path))
+        except KeyError:
+            found[score, len(path)] = [(key, path)]
+
+    for fc, fv, fd, rank in finishes:
+        add(fv, (fc,), (1, fd, rank, -fv))
+        for i, (c1, v1, d1) in enumerate(setups):
+            add(v1 + fv, (c1, fc), (2, d1 + fd, rank, -v1, -fv))
+            for c2, v2, d2 in setups[i:]:
+                add(v1 + v2 + fv, (c1, c2, fc),
+                    (3, d1 + d2 + fd, rank, -v1, -v2, -fv))
+
+    # with n darts left, any finish with n darts or less is good
+    table = {}
+    for (score, ndarts), paths in found.iteritems():
+        paths.sort()
+        for left in range(ndarts, MAX_DARTS + 1):
+            table.setdefault((score, left), []).append(
+                (ndarts, [ p for k, p in paths ]))
+
+    for key, lists in table.iteritems():
+        lists.sort()
+        table[key] = tuple(p for ndarts, paths in lists for p in paths)
+
+    return table
+
+# map out rule -> (score, darts left) -> tuple of finishes, each one a tuple
+# of codes
+TABLES = dict((out, _build(out)) for out in rules.OUTS)
+
+# The double-out finishes
+FINISHES = TABLES['double']
+
+def finishes(score, darts=MAX_DARTS, out='double'):
+    """Return all the finishes for a score with some darts left.
+
+    The finishes are returned as a tuple of tuples of codes, the preferred
+    first, empty if the score cannot be finished.
+    """
+    return TABLES[out].get((score, darts), ())
+
+def best_finish(score, darts=MAX_DARTS, out='double'):
+    """Return the preferred finish for a score, `None` if there is none."""
+    rv = finishes(score, darts, out)
+    if rv:
+        return rv[0]
+
+def target(score, darts=MAX_DARTS, out='double'):
+    """Return the code of the segment to aim at with a score to make.
+
+    Aim at the first dart of the best finish if there is one, else leave a
+    double for the next darts, or score as much as possible.
+    """
+    finish = best_finish(score, darts, out)
+    if finish is not None:
+        return finish[0]
+    if score <= 60:
+        # leave a double
+        for left in (32, 40, 16, 20):
+            if 1 <= score - left <= 20:
+                return str(score - left)
+        return '1'
+    if score < 62:
+        return '19'
+    return 'T20'
+
+def _table_json(out):
+    table = {}
+    for (score, darts), paths in TABLES[out].iteritems():
+        table.setdefault(str(darts), {})[str(score)] = paths[0]
+    return simplejson.dumps(table, separators=(',', ':'), sort_keys=True)
+
+# The best finishes of every out rule as a JSON object
+# {darts: {score: [code, ...]}}
+TABLES_JSON = dict((out, _table_json(out)) for out in rules.OUTS)
+
+# The double-out finishes as JSON
+TABLE_JSON = TABLES_JSON['double']
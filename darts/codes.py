@@ -0,0 +1,57 @@
+"""The codes of the throws and their values."""
+
+from array import array
+from collections import namedtuple
+
+class GameError(Exception):
+    pass
+
+class ThrowCode(namedtuple('ThrowCode', 'code value multiplier is_double')):
+    """A code that can be used for a throw and its meaning."""
+    __slots__ = ()
+
+def _make_codes():
+    rv = []
+    for n in range(1, 21):
+        rv.append(ThrowCode(str(n), n, 1, False))
+    for n in range(1, 21):
+        rv.append(ThrowCode('D%d' % n, 2 * n, 2, True))
+    for n in range(1, 21):
+        rv.append(ThrowCode('T%d' % n, 3 * n, 3, False))
+    rv.append(ThrowCode('RING', 25, 1, False))
+    rv.append(ThrowCode('BULL', 50, 2, True))
+
+    # darts not scoring: out of the board, bounced on the wire, fallen from
+    # the board, forfeited
+    for code in ('MISS', 'WALL', 'FALL', 'FORE'):
+        rv.append(ThrowCode(code, 0, 0, False))
+
+    return tuple(rv)
+
+# All the valid throw codes
+CODES = _make_codes()
+_CODES_MAP = dict((c.code, c) for c in CODES)
+
+def parse_code(code):
+    """Return the `ThrowCode` of a code. Raise `GameError` if not valid."""
+    try:
+        return _CODES_MAP[code]
+    except (KeyError, TypeError):
+        raise _bad_code(code)
+
+def throw_values(codes):
+    """Return the values of a sequence of throw codes as an array of bytes.
+
+    Raise `GameError` if any code is not valid.
+    """
+    try:
+        return array('B', [ _CODES_MAP[c].value for c in codes ])
+    except KeyError, e:
+        raise _bad_code(e.args[0])
+    except TypeError, e:
+        raise GameError('bad throw code: %s' % e)
+
+def _bad_code(code):
+    if isinstance(code, unicode):
+        code = code.encode('ascii', 'replace')
+    return GameError("bad throw code: '%s'" % (code,))
@@ -0,0 +1,111 @@
+"""The dartboard drawn as SVG.
+
+The board is built once at import time and served as a static image: every
+area to hit is a shape with class 'area' and the code of the target in the
+'data-code' attribute, for the page to catch the clicks on it.
+"""
+
+import hashlib
+from math import pi, sin, cos
+
+# The numbers of the slices, starting from 3 o'clock, counterclockwise
+NUMBERS = [6, 13, 4, 18, 1, 20, 5, 12, 9, 14, 11, 8, 16, 7, 19, 3, 17, 2,
+    15, 10]
+
+# The outer radii of the rings
+RING = 16
+RADII = {
+    'bull': 15,         # bull's eye
+    'ring': 30,         # bull's ring
+    'inner': 107 - RING,
+    'treble': 107,
+    'outer': 170 - RING,
+    'double': 170,
+    'edge': 226,
+}
+
+SIZE = 451
+
+STYLE = """
+text.scorenum {
+  fill: white;
+  font-size: 16pt;
+  font-family: sans-serif;
+  alignment-baseline: middle;
+  text-anchor: middle;
+}
+.board {
+  fill: black;
+}
+.area {
+  stroke: black;
+  stroke-width: 0.8;
+}
+.area:hover {
+  fill: yellow !important;
+}
+.even_slice {
+  fill: white;
+}
+.odd_slice {
+  fill: black;
+}
+.odd_slice.double, .odd_slice.treble, .bull {
+  fill: red;
+}
+.even_slice.double, .even_slice.treble, .ring {
+  fill: green;
+}
+"""
+
+_SLICE = 2 * pi / len(NUMBERS)
+
+def _point(angle, radius):
+    return '%.1f %.1f' % (cos(angle) * radius, -sin(angle) * radius)
+
+def _section(ir, or_, index):
+    """Return the path of the section of a slice between two radii."""
+    start = (index - 0.5) * _SLICE
+    end = (index + 0.5) * _SLICE
+    return 'M %s L %s A %s %s 0 0 0 %s L %s A %s %s 0 0 1 %s z' % (
+        _point(start, ir), _point(start, or_), or_, or_, _point(end, or_),
+        _point(end, ir), ir, ir, _point(start, ir))
+
+def render():
+    """Return the SVG document of the dartboard."""
+    r = RADII
+    parts = [
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<svg xmlns="http://www.w3.org/2000/svg" width="%spx" height="%spx">'
+            % (SIZE, SIZE),
+        '<defs><style type="text/css"><![CDATA[%s]]></style></defs>' % STYLE,
+        '<g transform="translate(%s, %s)">' % (SIZE / 2.0, SIZE / 2.0),
+        '<circle cx="0" cy="0" r="%s" class="board"/>' % r['edge'],
+        '<circle cx="0" cy="0" r="%s" class="area ring" data-code="RING"/>'
+            % r['ring'],
+        '<circle cx="0" cy="0" r="%s" class="area bull" data-code="BULL"/>'
+            % r['bull'],
+    ]
+
+    for i, num in enumerate(NUMBERS):
+        cls = 'area ' + (i % 2 == 0 and 'even_slice' or 'odd_slice')
+        for ir, or_, mult, prefix in (
+                (r['ring'], r['inner'], '', ''),
+                (r['inner'], r['treble'], ' treble', 'T'),
+                (r['treble'], r['outer'], '', ''),
+                (r['outer'], r['double'], ' double', 'D')):
+            parts.append('<path class="%s%s" d="%s" data-code="%s%s"/>'
+                % (cls, mult, _section(ir, or_, i), prefix, num))
+
+        # the number in the middle between the double ring and the edge
+        tr = 0.4 * r['edge'] + 0.6 * r['double']
+        parts.append('<text id="text_n%s" class="scorenum" x="%.1f" y="%.1f">'
+            '%s</text>' % (num, cos(i * _SLICE) * tr, -sin(i * _SLICE) * tr,
+                num))
+
+    parts.append('</g></svg>\n')
+    return '\n'.join(parts)
+
+# The dartboard document and its version, to make its url change with it
+SVG = render()
+VERSION = hashlib.md5(SVG).hexdigest()[:12]
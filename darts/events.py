@@ -0,0 +1,166 @@
+"""Push of the events of the matches to the spectators (Server-Sent Events).
+
+The last events of every match are stored in the shared cache, so they can
+be streamed by every process. The subscribers waiting in the process that
+publishes an event are woken up immediately; the ones in the other
+processes see it at their next poll of the cache.
+
+Every subscriber keeps busy the thread serving it: to hold hundreds of
+connections in a process run the server with green threads (e.g.
+``gunicorn -k gevent``): the waits are then cheap switches in an event loop.
+"""
+
+import threading
+from time import time, sleep
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.utils import simplejson
+
+_backend = get_cache(getattr(settings, 'DARTS_STATE_CACHE_BACKEND', 'default'))
+_timeout = getattr(settings, 'DARTS_STATE_CACHE_TTL', 3600)
+
+# Seconds between two polls of the cache by a waiting subscriber
+POLL_INTERVAL = getattr(settings, 'DARTS_EVENTS_POLL_INTERVAL', 1.0)
+
+# Seconds after which a stream is closed: the browser will reconnect
+STREAM_DURATION = getattr(settings, 'DARTS_EVENTS_STREAM_DURATION', 300)
+
+# Seconds of silence after which a comment is sent to keep the stream open
+KEEPALIVE = 15
+
+# Number of events of a match kept for the subscribers reconnecting
+MAX_EVENTS = 50
+
+# Seconds after which the lock of the events of a match is released anyway,
+# if the process holding it died
+LOCK_TIMEOUT = 5
+
+def _events_key(match_id):
+    return 'darts:events:%s' % match_id
+
+def _lock_key(match_id):
+    return 'darts:events:lock:%s' % match_id
+
+
+class _Channel(object):
+    """The events of a match published in this process and its waiters."""
+    def __init__(self):
+        self.cond = threading.Condition(_lock)
+        self.events = deque(maxlen=MAX_EVENTS)
+        self.subscribers = 0
+
+    def after(self, last_id):
+        return [ e for e in self.events if e[0] > last_id ]
+
+_lock = threading.Lock()
+_channels = {}
+
+
+def publish(match_id, type, data):
+    """Send an event to the subscribers of a match.
+
+    `data` must be serializable to JSON. Return the id of the event.
+    """
+    key = _events_key(match_id)
+    data = simplejson.dumps(data)
+    with _cache_lock(match_id):
+        events = list(_backend.get(key) or ())
+
+        # start from a timestamp if the events were lost, as the state
+        # versions
+        id = events and events[-1][0] + 1 or int(time() * 1000)
+        event = (id, 'id: %d\nevent: %s\ndata: %s\n\n' % (id, type, data))
+        events.append(event)
+        _backend.set(key, tuple(events[-MAX_EVENTS:]), _timeout)
+
+        # still holding the lock, for the events to arrive in order
+        with _lock:
+            channel = _channels.get(match_id)
+            if channel is not None:
+                channel.events.append(event)
+                channel.cond.notify_all()
+
+    return id
+
+@contextmanager
+def _cache_lock(match_id):
+    """Hold the lock of the events of a match stored in the shared cache.
+
+    Without it two processes publishing at the same time would give the
+    same id to their events and store only one of them.
+    """
+    key = _lock_key(match_id)
+    while not _backend.add(key, 1, LOCK_TIMEOUT):
+        sleep(0.001)
+    try:
+        yield
+    finally:
+        _backend.delete(key)
+
+def last_event_id(match_id):
+    """Return the id of the last event of a match, 0 if not known."""
+    events = _backend.get(_events_key(match_id))
+    return events and events[-1][0] or 0
+
+def stream(match_id, last_id=None, duration=None):
+    """Generate the messages of the events of a match in SSE format.
+
+    Stream the events following `last_id` (the "Last-Event-ID" sent by a
+    client reconnecting), or the ones from now on if `None`. Stop after
+    `duration` seconds (default `STREAM_DURATION`).
+    """
+    if duration is None:
+        duration = STREAM_DURATION
+
+    channel = _subscribe(match_id)
+    try:
+        if last_id is None:
+            last_id = last_event_id(match_id)
+
+        # tell the browser to reconnect soon after the stream is closed
+        yield 'retry: 1000\n\n'
+
+        now = time()
+        deadline = now + duration
+        keepalive = now + KEEPALIVE
+        while now < deadline:
+            with _lock:
+                events = channel.after(last_id)
+                if not events:
+                    channel.cond.wait(min(POLL_INTERVAL, deadline - now))
+                    events = channel.after(last_id)
+
+            if not events:
+                # maybe published by another process
+                events = _backend.get(_events_key(match_id)) or ()
+                events = [ e for e in events if e[0] > last_id ]
+
+            now = time()
+            if events:
+                last_id = events[-1][0]
+                keepalive = now + KEEPALIVE
+                yield ''.join(e[1] for e in events)
+            elif now >= keepalive:
+                keepalive = now + KEEPALIVE
+                yield ': keepalive\n\n'
+
+    finally:
+        _unsubscribe(match_id)
+
+def _subscribe(match_id):
+    with _lock:
+        channel = _channels.get(match_id)
+        if channel is None:
+            channel = _channels[match_id] = _Channel()
+        channel.subscribers += 1
+        return channel
+
+def _unsubscribe(match_id):
+    with _lock:
+        channel = _channels[match_id]
+        channel.subscribers -= 1
+        if not channel.subscribers:
+            del _channels[match_id]
@@ -1,52 +1,134 @@
-import re
-from collections import defaultdict
+import time
+import random
+import logging
+
+from django.db import connection
+from django.db.models import F, Max
+from django.utils import simplejson
 
 from darts import models
 from darts import cache
+from darts import metrics
+from darts import aggregates
+from darts import state as match_state
+from darts.state import MatchState
+from darts.codes import GameError, parse_code, throw_values
+
+logger = logging.getLogger(__name__)
+
+class ConflictError(Exception):
+    """The match was changed by someone else while playing a change.
+
+    The transaction should be rolled back and the change played again on a
+    new `Game`.
+    """
+
+# How many times to play again a change failed for a conflict
+CONFLICT_RETRIES = 10
+
+def conflict_backoff(attempt):
+    """Wait a random time before playing a change again after a conflict.
+
+    The wait grows with the attempt number (0-based), up to 80 ms, so that
+    the players of the conflicting changes don't collide again.
+    """
+    time.sleep(random.uniform(0, 0.005 * 2 ** min(attempt, 4)))
+
+def _delete_rows(model, ids):
+    """Delete rows by id in a query.
 
-class GameError(Exception):
-    pass
+    Unlike `QuerySet.delete()` don't look for the rows referring to them:
+    the caller must have deleted them already.
+    """
+    if ids:
+        connection.cursor().execute("DELETE FROM %s WHERE id IN (%s)"
+            % (model._meta.db_table, ', '.join(['%s'] * len(ids))), ids)
 
 class Game(object):
     """Represent the state of the game at a certain point.
 
     The object is to be used only once: create, fetch, use, destroy.
+
+    The state of the match is shared with the other games on the same match
+    through a cache: after a change has been committed to the database call
+    `save_state()` to store the new state, if the change fails call
+    `invalidate_state()` to drop it.
+
+    Create the game `for_update` to change the match: its state is not
+    shared with the other games until `save_state()`. The version of the match is
+    checked when the change is written: if someone else has changed the
+    match since its state was read `ConflictError` is raised.
     """
-    def __init__(self, id):
-        self._match_id = id
+    def __init__(self, id, for_update=False):
+        self._match_id = int(id)
+        self._for_update = for_update
+        self._version_checked = False
 
     @property
     @cache.cached_method
+    @metrics.instrumented
     def match(self):
         return models.Match.objects.get(id=self._match_id)
 
     @property
     @cache.cached_method
+    @metrics.instrumented
     def entrants(self):
         return (models.Entrant.objects
             .select_related('player')
-            .filter(match=self.match)
+            .filter(match=self._match_id)
             .order_by('order')).all()
 
+    @property
+    @cache.cached_method
+    @metrics.instrumented
+    def state(self):
+        state = match_state.get_cached(self._match_id, self._for_update)
+        if state is None:
+            version = match_state.get_version(self._match_id)
+            state = MatchState.load(self.match, self.entrants)
+            state.version = version
+            # a state to change may be read in a transaction with changes
+            # not committed yet (see `darts.writer`): don't share it
+            if not self._for_update:
+                match_state.set_cached(state)
+        return state
+
+    def save_state(self):
+        """Share the state after its changes have been committed.
+
+        The change can't fail anymore: if the state can't be stored log the
+        error and invalidate the cached state.
+        """
+        try:
+            match_state.state_changed(self.state)
+        except Exception:
+            logger.exception("storing the state of match %s", self._match_id)
+            try:
+                self.invalidate_state()
+            except Exception:
+                logger.exception(
+                    "invalidating the state of match %s", self._match_id)
+
+    def invalidate_state(self):
+        match_state.invalidate(self._match_id)
+
+    @metrics.instrumented
     def get_players_and_leg_score(self):
         players = self.players_leg_order
         pmap = dict((p.id, p) for p in players)
-
         leg_score = self.current_leg_score
-        rounds = self.last_rounds
-        rmap = dict((r.id, r.player_id) for r in rounds)  # round -> player
-        throws = (models.Throw.objects
-            .filter(round__in=rounds)
-            .order_by('id'))
 
         # decorate players with leg score and throws
         for p in players:
             p.leg_score = leg_score[p.id]
             p.last_throws = []
 
-        for t in throws:
-            p = pmap[rmap[t.round_id]]
-            p.last_throws.append(t)
+        for round in self.last_rounds:
+            p = pmap[round.player_id]
+            p.last_throws = [ models.Throw(id=t.id, number=t.number,
+                    code=t.code, score=t.score)
+                for t in round.throws ]
 
         # complete the throws list with blank ones
         for p in players:
@@ -60,314 +142,318 @@ class Game(object):
 
         return players
 
-    @property
-    @cache.cached_method
-    def current_leg(self):
-        leg = (models.Leg.objects
-            .filter(match=self.match)
-            .order_by('-number'))[0:1]
-
-        if leg:
-            leg = leg[0]
-            if leg.winner_id is not None and self.match.winner_id is None:
-                leg = models.Leg(number=leg.number+1, match=self.match)
+    @metrics.instrumented
+    def get_scoreboard(self):
+        """Return the situation of the match as a dict serializable to JSON.
+
+        The players are in the order they throw in the current leg.
+        """
+        state = self.state
+        leg = state.current_leg
+        rv = {
+            'match': state.match_id,
+            'target_score': state.target_score,
+            'legs_number': state.legs_number,
+            'leg': leg.number,
+            'leg_winner': leg.winner_id,
+            'match_winner': state.winner_id,
+            'players': [ {
+                    'id': p.id,
+                    'username': p.username,
+                    'avatar': p.avatar.url,
+                    'legs_won': state.legs_won[p.id],
+                    'leg_score': p.leg_score,
+                    'last_throws': [ t.code for t in p.last_throws if t.code ],
+                } for p in self.get_players_and_leg_score() ],
+        }
+
+        if state.winner_id is None:
+            round = state.current_round
+            rv['current_player'] = round.player_id
+            rv['current_throw'] = len(round.throws) + 1
 
-        else:
-            leg = models.Leg(number=1, match=self.match)
+        return rv
 
-        return leg
+    @property
+    @metrics.instrumented
+    def current_leg(self):
+        return self.state.current_leg
 
     @property
-    @cache.cached_method
+    @metrics.instrumented
     def current_round(self):
-        round = None
-        leg = self.current_leg
-        if leg.id is not None:
-            round = (models.Round.objects
-                .filter(leg=leg)
-                .order_by('-number'))[0:1]
-
-        if not round:
-            # first round
-            return models.Round(leg=leg, number=1,
-                score_start=self.match.target_score,
-                player_id=self._get_round_player_id(leg.number, 1))
-        else:
-            round = round[0]
-
-        if round.score_end:
-            # round is over, so have the next one
-            player_id = self._get_round_player_id(leg.number, round.number + 1)
-            prev_round = (models.Round.objects
-                .filter(leg=leg, player_id=player_id)
-                .order_by('-number'))[0:1]
-            if prev_round:
-                prev_score = prev_round[0].score_end
-            else:
-                prev_score = self.match.target_score
-
-            round = models.Round(leg=leg, number=round.number + 1,
-                score_start=prev_score, player_id=player_id)
-
-        return round
+        return self.state.current_round
 
     def _get_round_player_id(self, leg_number, round_number):
-        ents = self._get_entrants_leg_order(leg_number)
-        return ents[(round_number - 1) % len(ents)].player_id
+        return self.state.round_player_id(leg_number, round_number)
 
     @property
-    @cache.cached_method
+    @metrics.instrumented
     def current_player(self):
-        round = self.current_round
-        return round.player
+        return self._get_player(self.current_round.player_id)
+
+    def _get_player(self, id):
+        for e in self.entrants:
+            if e.player_id == id:
+                return e.player
+        else:
+            assert False, "player %s not in match %s" % (id, self._match_id)
 
     @property
+    @metrics.instrumented
     def players(self):
         return [ e.player for e in self.entrants ]
 
     @property
     @cache.cached_method
+    @metrics.instrumented
     def players_leg_order(self):
         leg = self.current_leg
-        return [e.player for e in self._get_entrants_leg_order(leg.number)]
-
-    def _get_entrants_leg_order(self, leg_number):
-        players = self.entrants
-        idx = (leg_number - 1) % len(players)
-        return players[idx:] + players[:idx]
+        return [ self._get_player(pid)
+            for pid in self.state.leg_order(leg.number) ]
 
     @property
-    @cache.cached_method
+    @metrics.instrumented
     def last_rounds(self):
-        leg = self.current_leg
-        curr = self.current_round
-        if curr.id is None:
-            nrounds = len(self.entrants) - 1
-        else:
-            nrounds = len(self.entrants)
-
-        rv = list(models.Round.objects
-            .filter(leg=leg)
-            .order_by('-number')[:nrounds])
-
-        if curr.id is None:
-            rv.append(curr)
-
-        return rv
+        return self.state.last_rounds()
 
     @property
-    @cache.cached_method
+    @metrics.instrumented
     def current_leg_score(self):
-        players = self.players
-        rounds = self.last_rounds
-
-        # map player id -> score
-        smap = dict((p.id, self.match.target_score) for p in players)
-
-        for round in rounds:
-            if round.score_end is not None:
-                smap[round.player_id] = round.score_end
-            else:
-                score = round.score_start
-                throws = models.Throw.objects.filter(round=round)
-                for t in throws:
-                    score -= t.score
-
-                smap[round.player_id] = score
-
-        return smap
+        return self.state.leg_score()
 
+    @metrics.instrumented
     def throw(self, throw_code):
-        if self.match.winner_id is not None:
+        state = self.state
+        if state.winner_id is not None:
             raise GameError('this game is over')
-
-        leg = self.current_leg
-        round = self.current_round
-        if round.id is not None:
-            throws = list(models.Throw.objects
-                .filter(round=round)
-                .order_by('number'))
-        else:
-            throws = []
-
-        nthrow = len(throws) + 1
-
-        prev_score = round.score_start
-        value = self.throw_value(throw_code)
-        round_score = sum(t.score for t in throws) + value
-        new_score = prev_score - round_score
-
-        # win/bust?
-        win = new_score == 0 and bool(re.match(r'^(D\d+)|BULL$', throw_code))
-        bust = not win and new_score <= 1
-
-        if bust:
-            new_score = prev_score
-
-        # save the objects
-        if leg.id is None:
-            leg.save()
-        if round.id is None:
-            round.leg = leg     # need reiterate to store the leg id
-            round.save()
-
-        throw = models.Throw(round=round, number=nthrow,
-            code=throw_code, score=value)
-        throw.save()
-        throws.append(throw)
-
-        if nthrow == 3 or win or bust:
-            round.score_end = new_score
-            round.save()
-            if not win:
-                next_round = round.number + 1
-                next_throw = 1
-        else:
-            next_round = round.number
-            next_throw= nthrow + 1
+        parse_code(throw_code)  # validate it before writing
+
+        self._check_version()
+        return self._play('throw', throw_code)
+
+    @metrics.instrumented
+    def redo_throw(self):
+        """Play again the last throw undone.
+
+        Return the same result of `throw()`. Raise `GameError` if no throw
+        was undone after the last one played.
+        """
+        state = self.state
+        if not state.undone:
+            raise GameError('nothing to redo')
+
+        self._check_version()
+        return self._play('redo', state.undone[-1])
+
+    def _play(self, action, throw_code):
+        state = self.state
+        round = state.current_round
+        new_leg = state.current_leg.id is None
+        new_round = round.id is None
+        play = state.apply(action, throw_code)
+        leg = play.leg
+        throw = play.throw
+        win = play.win
+
+        # save the objects: only insert the new rows and update what changed
+        if new_leg:
+            leg.id = models.Leg.objects.create(match_id=state.match_id,
+                number=leg.number, winner_id=leg.winner_id).id
+        elif win:
+            models.Leg.objects.filter(id=leg.id).update(winner=leg.winner_id)
+
+        if new_round:
+            round.id = models.Round.objects.create(leg_id=leg.id,
+                number=round.number, player_id=round.player_id,
+                score_start=round.score_start, score_end=round.score_end).id
+        elif round.score_end is not None:
+            models.Round.objects.filter(id=round.id).update(
+                score_end=round.score_end)
+
+        throw.id = models.Throw.objects.create(round_id=round.id,
+            number=throw.number, code=throw.code, score=throw.score).id
 
         if win:
-            leg.winner = self.current_player
-            leg.save()
+            self._save_legs_won(round.player_id)
 
-            mwid = self._get_match_winner_id()
-            if mwid is not None:
-                self.match.winner_id = mwid
-                self.match.save()
+        aggregates.throw_played(round.player_id, throw.code,
+            aggregates.throw_deltas(throw.code, throw.score,
+                round.score_start, play.prev_scores, round.score_end,
+                state.round_visit(round.number), state.rules),
+            finish=win and round.score_start or None)
 
-        else:
-            if nthrow == 3 or bust:
-                next_player = self._get_round_player_id(leg.number, next_round)
-            else:
-                next_player = self.current_round.player_id
+        # the next leg is loaded from the state at its start
+        self._log(action, throw.code, leg.id, round.id, throw.id,
+            snapshot=win)
 
         rv = {}
-        rv['leg_score'] = new_score
-        rv['throws'] = [ { 'code': t.code, 'score': t.score } for t in throws ]
+        rv['leg_score'] = play.score
+        rv['throws'] = [ { 'code': t.code, 'score': t.score }
+            for t in round.throws ]
 
-        if bust:
+        if play.bust:
             rv['bust'] = True
 
         if win:
-            rv['leg_winner'] = self.current_player.id
-            if mwid is not None:
-                rv['match_winner'] = mwid
+            rv['leg_winner'] = round.player_id
+            if play.match_winner_id is not None:
+                rv['match_winner'] = play.match_winner_id
         else:
             # note: not defined if win
-            rv['next_player'] = next_player
-            rv['next_throw'] = next_throw
+            next_round = state.current_round
+            rv['next_player'] = next_round.player_id
+            rv['next_throw'] = len(next_round.throws) + 1
 
         return rv
 
-    def _get_match_winner_id(self):
-        legs = (models.Leg.objects
-            .filter(match=self.match, winner__isnull=False)).all()
-        pids = [ e.player_id for e in self.entrants ]
-        assert len(pids) > 0
-
-        # special case: if there is a single players, he'll play all the legs
-        if len(pids) == 1:
-            if len(legs) >= self.match.legs_number:
-                return pids[0]
-            else:
-                return None
-
-        player_score = defaultdict(int)
-        for leg in legs:
-            player_score[leg.winner_id] += 1
-
-        rank = [ (player_score[pid], pid) for pid in pids ]
-        rank.sort(reverse=True)
-
-        # if the second can't get the first, the first is the winner
-        if rank[1][0] + (self.match.legs_number - len(legs)) < rank[0][0]:
-            for pid in pids:
-                if pid == rank[0][1]:
-                    return pid
-            else:
-                assert False
-        else:
-            return None
-
-
-    def undo_throw(self):
-        leg = (models.Leg.objects
-            .filter(match=self.match)
-            .order_by('-number'))[0:1]
+    @metrics.instrumented
+    def throw_round(self, throw_codes):
+        """Play several throws of the current round in a row.
 
-        if not leg:
-            # no leg has been played yet in the match.
-            return
+        If a throw ends the round before the end of the list (a bust or a
+        win) the following throws are not played.
 
-        leg = leg[0]
+        Return the list of the results of `throw()` for the throws played.
+        """
+        if not throw_codes:
+            raise GameError('no throw code')
+        throw_values(throw_codes)   # validate them all before playing
 
-        rounds = list(models.Round.objects
-            .filter(leg=leg)
-            .order_by('-number'))[0:2]
+        nleft = 3 - len(self.current_round.throws)
+        if len(throw_codes) > nleft:
+            raise GameError('too many throws: %d left in the round' % nleft)
 
-        if not rounds:
-            # no round has been played yet in the leg.
-            return
+        rv = []
+        for throw_code in throw_codes:
+            res = self.throw(throw_code)
+            rv.append(res)
+            if res.get('bust') or 'leg_winner' in res:
+                break
 
-        throw = (models.Throw.objects
-            .filter(round__in=rounds)
-            .order_by('-id'))[0:1]
+        return rv
 
-        if not throw:
-            # no throw played in the leg yet
+    @metrics.instrumented
+    def undo_throw(self):
+        """Cancel the last throw played.
+
+        Return a dict with the leg score and who is to throw next.
+        """
+        if self.state.archived:
+            raise GameError("the match is archived: restore it first")
+
+        undo = self.state.apply('undo')
+        if undo is None:
+            # nothing played yet
+            return self._next_throw()
+
+        self._check_version()
+        self._log('undo')
+
+        # the state knows the rows to delete: no need to look for them
+        if undo.throw is not None:
+            _delete_rows(models.Throw, [undo.throw.id])
+
+        rounds = [ round.id for round in undo.empty_rounds ]
+        if undo.round_deleted:
+            rounds.append(undo.round.id)
+        _delete_rows(models.Round, rounds)
+        if undo.round_reopened:
+            models.Round.objects.filter(id=undo.round.id).update(
+                score_end=None)
+
+        if undo.leg_deleted:
+            _delete_rows(models.Leg, [undo.leg.id])
+        elif undo.leg_winner_cleared:
+            models.Leg.objects.filter(id=undo.leg.id).update(winner=None)
+
+        if undo.leg_winner_cleared:
+            self._save_legs_won(undo.leg_winner_id)
+
+        if undo.throw is not None:
+            round = undo.round
+            throw = undo.throw
+            aggregates.throw_undone(round.player_id, throw.code,
+                aggregates.throw_deltas(throw.code, throw.score,
+                    round.score_start, [ t.score for t in round.throws ],
+                    undo.round_score_end,
+                    self.state.round_visit(round.number), self.state.rules),
+                won=undo.leg_winner_cleared)
+
+        return self._next_throw()
+
+    def _next_throw(self):
+        round = self.state.current_round
+        return {
+            'leg_score': self.current_leg_score,
+            'next_player': round.player_id,
+            'next_throw': len(round.throws) + 1, }
+
+    def _check_version(self):
+        """Bump the version of the match if it is the one of the state.
+
+        Called by every change before its first write. Raise `ConflictError`
+        if the match has been changed since the state was read. Else drop
+        the shared state: until the change is committed the other games,
+        e.g. the following changes of a batch of `darts.writer`, must read
+        the match from the database.
+        """
+        if self._version_checked:
             return
 
-        throw = throw[0]
-
-        # there shouldn't be a round without throws in the db, but just in
-        # case...
-        if rounds[0].id == throw.round_id:
-            round = rounds[0]
-        else:
-            rounds[0].delete()
-            round = rounds[1]
-            assert round.id == throw.round_id
-
-        if throw.number > 1:
-            # easy stuff: we just drop one throw from the round
-            throw.delete()
-            if round.score_end is not None:
-                round.score_end = None
-                round.save()
-
-        else:
-            # we must delete the throw and its round
-            throw.delete()
-            round.delete()
-            if round.number == 1:
-                leg.delete()
-
-        # if the last throw had made a winner, well, he is no more
-        if leg.winner_id is not None:
-            leg.winner_id = None
-            leg.save()
-
-        # ditto for the match
-        if self.match.winner_id is not None:
-            self.match.winner_id = None
-            self.match.save()
+        state = self.state
+        if not (models.Match.objects
+                .filter(id=state.match_id, version=state.match_version)
+                .update(version=F('version') + 1)):
+            # the cached state is stale, unless the other change has already
+            # stored its own: drop it for the change to be played again on
+            # the state in the database
+            match_state.invalidate(state.match_id, state.version)
+            raise ConflictError(
+                "match %s changed by someone else" % state.match_id)
+
+        state.match_version += 1
+        self._version_checked = True
+        self.invalidate_state()
+
+    def _log(self, action, code='', leg_id=None, round_id=None,
+            throw_id=None, snapshot=False):
+        """Append a change to the log of the match.
+
+        Snapshot the state after the change if `snapshot` or if the log of
+        the match starts with the change.
+        """
+        state = self.state
+        if state.log_seq is None:
+            # the state was read from the rows: continue the log, if any
+            state.log_seq = (models.MatchLog.objects
+                .filter(match=state.match_id)
+                .aggregate(n=Max('seq'))['n'] or 0)
+            snapshot = True
+
+        state.log_seq += 1
+        models.MatchLog.objects.create(match_id=state.match_id,
+            seq=state.log_seq, action=action, code=code,
+            leg=leg_id, round=round_id, throw=throw_id)
+
+        if snapshot:
+            models.MatchSnapshot.objects.create(match_id=state.match_id,
+                seq=state.log_seq, format=match_state._FORMAT,
+                data=simplejson.dumps(match_state.serialize(state),
+                    separators=(',', ':')))
+
+    def _save_legs_won(self, player_id):
+        """Save the legs won counters after a leg has been won or undone."""
+        state = self.state
+        (models.Entrant.objects
+            .filter(match=state.match_id, player=player_id)
+            .update(result=state.legs_won[player_id]))
+        (models.Match.objects
+            .filter(id=state.match_id)
+            .update(legs_played=state.legs_played, winner=state.winner_id))
 
     def throw_value(self, code):
-        m = re.match(r'^(?:([DT])?(\d+))|(RING|BULL)$', code)
-        if not m:
-            return 0    # miss, void etc.
-        if m.group(3) == 'RING':
-            return 25
-        elif m.group(3) == 'BULL':
-            return 50
-
-        value = int(m.group(2))
-        if m.group(1) == 'D':
-            value *= 2
-        elif m.group(1) == 'T':
-            value *= 3
-
-        return value
+        return parse_code(code).value
 
 
 class Score(object):
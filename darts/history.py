@@ -0,0 +1,252 @@
+"""Export and import of the matches history.
+
+Every match is represented by a record, a dict with its entrants, legs,
+rounds and throws, which is serialized as a line of JSON. The players are
+referred to by username, so the records can be imported in a database with
+different ids.
+
+Matches are read and written in batches: the memory used doesn't depend on
+the size of the history.
+"""
+
+from contextlib import contextmanager
+
+from django.utils.dateparse import parse_datetime
+
+from darts import models
+from darts import rules
+from darts import archive
+from darts.codes import GameError, throw_values
+from darts.utils import bulk_insert
+
+# the columns of the csv export, one row per throw
+CSV_FIELDS = ('match', 'created_at', 'target_score', 'legs_number', 'leg',
+    'round', 'player', 'score_start', 'score_end', 'throw', 'code', 'score')
+
+
+def export_matches(matches, batch_size=100):
+    """Generate the records of the matches of a queryset, in id order."""
+    players = dict(models.Player.objects.values_list('id', 'username'))
+    avatars = dict(models.Player.objects.values_list('id', 'avatar'))
+    last_id = 0
+    while 1:
+        batch = list(matches.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'created_at', 'target_score', 'legs_number',
+                'rules', 'legs_played', 'winner')[:batch_size])
+        if not batch:
+            break
+
+        last_id = batch[-1][0]
+        ids = [ row[0] for row in batch ]
+        records = {}
+        for id, created_at, target_score, legs_number, match_rules, \
+                legs_played, winner in batch:
+            records[id] = {
+                'id': id,
+                'created_at': created_at.isoformat(),
+                'target_score': target_score,
+                'legs_number': legs_number,
+                'rules': match_rules,
+                'legs_played': legs_played,
+                'winner': players.get(winner),
+                'entrants': [],
+                'legs': [] }
+
+        for mid, pid, result in (models.Entrant.objects
+                .filter(match__in=ids).order_by('match', 'order')
+                .values_list('match', 'player', 'result').iterator()):
+            records[mid]['entrants'].append({
+                'player': players[pid], 'avatar': avatars[pid],
+                'result': result })
+
+        legs = {}
+        for id, mid, number, started_at, winner in (models.Leg.objects
+                .filter(match__in=ids).order_by('match', 'number')
+                .values_list('id', 'match', 'number', 'started_at', 'winner')
+                .iterator()):
+            legs[id] = { 'number': number,
+                'started_at': started_at.isoformat(),
+                'winner': players.get(winner), 'rounds': [] }
+            records[mid]['legs'].append(legs[id])
+
+        rounds = {}
+        for id, lid, number, pid, score_start, score_end in (
+                models.Round.objects
+                .filter(leg__match__in=ids).order_by('leg', 'number')
+                .values_list('id', 'leg', 'number', 'player',
+                    'score_start', 'score_end')
+                .iterator()):
+            rounds[id] = { 'number': number, 'player': players[pid],
+                'score_start': score_start, 'score_end': score_end,
+                'throws': [] }
+            legs[lid]['rounds'].append(rounds[id])
+
+        for rid, code, score in (models.Throw.objects
+                .filter(round__leg__match__in=ids).order_by('round', 'number')
+                .values_list('round', 'code', 'score')
+                .iterator()):
+            rounds[rid]['throws'].append([code, score])
+
+        for mid, lid, leg_rules, leg_rounds in archive.archived_legs(
+                models.Leg.objects.filter(match__in=ids)):
+            legs[lid]['rounds'] = [ { 'number': number,
+                    'player': players[pid], 'score_start': score_start,
+                    'score_end': score_end,
+                    'throws': [ [code, score] for code, score in throws ] }
+                for number, pid, score_start, score_end, throws
+                    in leg_rounds ]
+
+        for id in ids:
+            yield records[id]
+
+def csv_rows(records):
+    """Generate the rows of the csv export of match records."""
+    for m in records:
+        for leg in m['legs']:
+            for r in leg['rounds']:
+                for i, (code, score) in enumerate(r['throws']):
+                    yield (m['id'], m['created_at'], m['target_score'],
+                        m['legs_number'], leg['number'], r['number'],
+                        r['player'].encode('utf8'), r['score_start'],
+                        r['score_end'], i + 1, code.encode('utf8'), score)
+
+
+def import_matches(records):
+    """Insert the matches of a batch of records in the database.
+
+    The new matches get new ids. Every match is replayed by its rules before
+    being inserted: raise `ValueError` if any throw is not valid. Return the
+    number of throws inserted.
+    """
+    if not records:
+        return 0
+    for m in records:
+        _check_match(m)
+
+    players = _get_players(records)
+    with _keep_dates():
+        # bulk_create() doesn't return the ids: the matches are inserted one
+        # at time, the ids of the legs and rounds read back by their number
+        mids = []
+        entrants = []
+        legs = []
+        for m in records:
+            match = models.Match.objects.create(
+                created_at=parse_datetime(m['created_at']),
+                target_score=m['target_score'],
+                legs_number=m['legs_number'],
+                # the records exported before the rules were double-out
+                rules=rules.get(m.get('rules', rules.DEFAULT)).name,
+                legs_played=m['legs_played'],
+                winner_id=_player_id(players, m['winner']))
+            mids.append(match.id)
+
+            for i, e in enumerate(m['entrants']):
+                entrants.append(models.Entrant(match_id=match.id,
+                    player_id=players[e['player']], order=i + 1,
+                    result=e['result']))
+
+            for leg in m['legs']:
+                legs.append(models.Leg(match_id=match.id,
+                    number=leg['number'],
+                    started_at=parse_datetime(leg['started_at']),
+                    winner_id=_player_id(players, leg['winner'])))
+
+        bulk_insert(models.Entrant, entrants)
+        bulk_insert(models.Leg, legs)
+
+    # by range, not to exceed the SQLite parameters limit: the legs of other
+    # matches, if any, are not looked up
+    leg_ids = dict(((mid, number), id) for id, mid, number
+        in models.Leg.objects.filter(match__range=(mids[0], mids[-1]))
+            .values_list('id', 'match', 'number'))
+    rounds = []
+    for mid, m in zip(mids, records):
+        for leg in m['legs']:
+            lid = leg_ids[mid, leg['number']]
+            for r in leg['rounds']:
+                rounds.append(models.Round(leg_id=lid, number=r['number'],
+                    player_id=players[r['player']],
+                    score_start=r['score_start'], score_end=r['score_end']))
+    bulk_insert(models.Round, rounds)
+
+    round_ids = dict(((lid, number), id) for id, lid, number
+        in models.Round.objects
+            .filter(leg__match__range=(mids[0], mids[-1]))
+            .values_list('id', 'leg', 'number'))
+    throws = []
+    for mid, m in zip(mids, records):
+        for leg in m['legs']:
+            lid = leg_ids[mid, leg['number']]
+            for r in leg['rounds']:
+                rid = round_ids[lid, r['number']]
+                for i, (code, score) in enumerate(r['throws']):
+                    throws.append(models.Throw(round_id=rid,
+                        number=i + 1, code=code, score=score))
+    bulk_insert(models.Throw, throws)
+
+    return len(throws)
+
+def _check_match(m):
+    """Raise `ValueError` if the throws of a match record are not valid.
+
+    The codes must be in the codes table and the legs must be played again
+    from them by the rules of the match to the same rounds and scores.
+    """
+    try:
+        match_rules = rules.get(m.get('rules', rules.DEFAULT))
+        players = [ e['player'] for e in m['entrants'] ]
+        if not players:
+            raise GameError("no entrant")
+        for i, leg in enumerate(m['legs']):
+            if leg['number'] != i + 1:
+                raise GameError("bad leg number: %s" % leg['number'])
+
+            rounds = [ (r['number'], r['player'], r['score_start'],
+                    r['score_end'], [ tuple(t) for t in r['throws'] ])
+                for r in leg['rounds'] ]
+            for r in rounds:
+                throw_values([ code for code, score in r[4] ])
+
+            darts = archive.pack_codes([ (number, [ t[0] for t in throws ],
+                    score_end is not None)
+                for number, pid, score_start, score_end, throws in rounds ])
+            idx = i % len(players)
+            if archive.unpack(darts, match_rules, m['target_score'],
+                    players[idx:] + players[:idx]) != rounds:
+                raise GameError("the throws of leg %s don't follow the rules"
+                    % leg['number'])
+    except GameError, e:
+        raise ValueError("match %s: %s" % (m.get('id'), e))
+
+def _get_players(records):
+    """Return a map username -> player id, creating the players missing."""
+    avatars = {}
+    for m in records:
+        for e in m['entrants']:
+            avatars[e['player']] = e['avatar']
+
+    rv = dict(models.Player.objects
+        .filter(username__in=list(avatars)).values_list('username', 'id'))
+    for username in sorted(set(avatars) - set(rv)):
+        rv[username] = models.Player.objects.create(
+            username=username, avatar=avatars[username]).id
+
+    return rv
+
+def _player_id(players, username):
+    if username is not None:
+        return players[username]
+
+@contextmanager
+def _keep_dates():
+    """Don't replace the creation dates of the rows imported with now."""
+    fields = [ models.Match._meta.get_field('created_at'),
+        models.Leg._meta.get_field('started_at') ]
+    for f in fields:
+        f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f in fields:
+            f.auto_now_add = True
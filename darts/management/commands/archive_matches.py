@@ -0,0 +1,60 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from darts import models
+from darts import archive
+from darts import state as match_state
+from darts.codes import GameError
+from darts.state import MatchState
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--restore', action='store_true', default=False,
+            help="write back the rows of archived matches instead"),
+    )
+    args = '[match_id ...]'
+    help = ("Pack the throws of the finished matches in their legs and "
+        "delete their rounds and throws rows (default: all the finished "
+        "matches not archived yet).")
+
+    def handle(self, *args, **options):
+        matches = models.Match.objects.all()
+        if args:
+            matches = matches.filter(id__in=map(int, args))
+        elif options['restore']:
+            matches = matches.filter(leg__darts__isnull=False).distinct()
+        else:
+            matches = (matches.filter(winner__isnull=False)
+                .exclude(leg__darts__isnull=False))
+
+        if options['restore']:
+            f = archive.restore
+        else:
+            f = archive.archive
+
+        t0 = time.time()
+        nmatches = nrows = 0
+        errors = 0
+        for id in list(matches.order_by('id').values_list('id', flat=True)):
+            match = models.Match.objects.get(id=id)
+            entrants = (models.Entrant.objects
+                .filter(match=match).order_by('order'))
+            try:
+                nrows += f(MatchState.load(match, entrants))
+            except GameError, e:
+                self.stderr.write("%s\n" % e)
+                errors += 1
+                continue
+            finally:
+                match_state.invalidate(id)
+
+            nmatches += 1
+
+        self.stdout.write("%d matches %s, %d rows %s in %.1f s\n"
+            % (nmatches, options['restore'] and 'restored' or 'archived',
+                nrows, options['restore'] and 'inserted' or 'deleted',
+                time.time() - t0))
+        if errors:
+            raise CommandError("%d matches not changed" % errors)
@@ -0,0 +1,87 @@
+import random
+from optparse import make_option
+
+from django.db import connection, transaction
+from django.core.management.base import NoArgsCommand, CommandError
+
+from darts import models
+from darts import bench
+from darts import stats
+from darts import history
+from darts import archive
+from darts.state import MatchState
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--throws', type='int', default=200000,
+            help="throws to store in the database [default: %default]"),
+        make_option('--seed', type='int', default=42,
+            help="random seed [default: %default]"),
+    )
+    help = ("Archive the matches of a large test database and report the "
+        "size reduction and the time to read the history, verifying it "
+        "doesn't change.")
+
+    def handle_noargs(self, **options):
+        rng = random.Random(options['seed'])
+        with bench.test_database():
+            self.stdout.write("populating the database...\n")
+            nthrows = bench.populate(options['throws'], rng)
+            transaction.commit_unless_managed()
+            self.stdout.write("%d throws stored\n" % nthrows)
+
+            before = self.measure()
+            states = [ MatchState.load(m, m.entrant_set.order_by('order'))
+                for m in models.Match.objects.order_by('id') ]
+            ms = bench.timed(map, archive.archive, states)
+            self.stdout.write("%d matches archived in %.0f ms (%.3f ms/match)\n"
+                % (len(states), ms, ms / len(states)))
+            after = self.measure()
+
+        self.stdout.write("\n%-16s %14s %14s\n" % ('', 'rows', 'archived'))
+        for name in ('rounds', 'throws', 'darts bytes', 'database bytes',
+                'stats ms', 'export ms'):
+            self.stdout.write("%-16s %14s %14s\n" % (name,
+                before[name], after[name]))
+        if before['database bytes'] and after['database bytes']:
+            self.stdout.write("size reduction: %.1f%%\n"
+                % (100.0 - 100.0 * after['database bytes']
+                    / before['database bytes']))
+
+        for name in ('stats', 'export'):
+            if before[name] != after[name]:
+                raise CommandError("the %s changed after archiving" % name)
+        self.stdout.write("stats and export verified\n")
+
+    def measure(self):
+        rv = {}
+        rv['rounds'] = models.Round.objects.count()
+        rv['throws'] = models.Throw.objects.count()
+        rv['darts bytes'] = sum(len(darts) for darts in models.Leg.objects
+            .filter(darts__isnull=False).values_list('darts', flat=True))
+        rv['database bytes'] = self.database_size()
+
+        rv['stats ms'] = '%.0f' % bench.timed(self.stats)
+        rv['stats'] = self._stats
+        rv['export ms'] = '%.0f' % bench.timed(self.export)
+        rv['export'] = self._export
+        return rv
+
+    def stats(self):
+        self._stats = stats.compute(models.Throw.objects.all(),
+            models.Leg.objects.all())
+
+    def export(self):
+        self._export = list(history.export_matches(models.Match.objects.all()))
+
+    def database_size(self):
+        """Return the size of the database compacted, None if unknown."""
+        if connection.vendor != 'sqlite':
+            return None
+
+        cur = connection.cursor()
+        cur.execute("VACUUM")
+        cur.execute("PRAGMA page_count")
+        pages = cur.fetchone()[0]
+        cur.execute("PRAGMA page_size")
+        return pages * cur.fetchone()[0]
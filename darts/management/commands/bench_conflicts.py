@@ -0,0 +1,181 @@
+import time
+import random
+import threading
+from optparse import make_option
+
+from django.db import connection, DatabaseError
+from django.core.management.base import NoArgsCommand, CommandError
+
+from darts import views
+from darts import models
+from darts import bench
+from darts import state as match_state
+from darts.codes import CODES
+from darts.game import Game, ConflictError
+from darts.state import MatchState
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--matches', type='int', default=5,
+            help="matches played at once [default: %default]"),
+        make_option('--tablets', type='int', default=4,
+            help="threads throwing on every match at once "
+                "[default: %default]"),
+        make_option('--changes', type='int', default=400,
+            help="throws and undos to play in every match "
+                "[default: %default]"),
+        make_option('--undo-rate', type='float', default=0.05,
+            help="probability to undo a throw [default: %default]"),
+        make_option('--seed', type='int', default=42,
+            help="random seed [default: %default]"),
+    )
+    help = ("Play throws and undos on the same matches from many threads at "
+        "once, as tablets on the same board would, then verify that the "
+        "matches are consistent. Compare with one tablet per match.")
+
+    def handle_noargs(self, **options):
+        if min(options['matches'], options['tablets'], options['changes']) \
+                <= 0:
+            raise CommandError("matches, tablets and changes must be positive")
+
+        self.stdout.write("%-8s %8s %8s %8s %10s %9s %9s\n" % (
+            'tablets', 'changes', 'failed', 'errors', 'changes/s', 'p50 ms',
+            'p99 ms'))
+        with bench.test_database(shared=True):
+            players = [ models.Player.objects.create(
+                    username='player%d' % i, avatar='player.png')
+                for i in range(2) ]
+            for ntablets in sorted(set([1, options['tablets']])):
+                self.run(players, ntablets, options)
+
+    def run(self, players, ntablets, options):
+        rng = random.Random(options['seed'])
+        matches = []
+        for i in range(options['matches']):
+            # enough legs for the match not to end
+            match = models.Match.objects.create(
+                target_score=101, legs_number=1000)
+            for j, p in enumerate(players):
+                models.Entrant.objects.create(
+                    match=match, player=p, order=j + 1)
+            matches.append(match.id)
+
+        # every tablet makes its share of the changes of a match
+        nchanges = options['changes'] // ntablets
+        tablets = [ Tablet(match_id, nchanges, options['undo_rate'],
+                rng.randint(0, 1 << 30))
+            for match_id in matches for i in range(ntablets) ]
+
+        t0 = time.time()
+        for t in tablets:
+            t.start()
+        for t in tablets:
+            t.join()
+        elapsed = time.time() - t0
+
+        times = []
+        for t in tablets:
+            times.extend(t.times)
+        nok = sum(t.throws + t.undos for t in tablets)
+        self.stdout.write("%-8d %8d %8d %8d %10.1f %9.2f %9.2f\n" % (
+            ntablets, nok, sum(t.conflicts for t in tablets),
+            sum(t.errors for t in tablets), nok / elapsed,
+            bench.percentile(times, 50), bench.percentile(times, 99)))
+
+        for match_id in matches:
+            done = [ t for t in tablets if t.match_id == match_id ]
+            self.check(match_id, sum(t.throws for t in done),
+                sum(t.undos for t in done))
+
+    def check(self, match_id, nthrows, nundos):
+        """Verify the match against the changes done and its cached state."""
+        match = models.Match.objects.get(id=match_id)
+        entrants = list(models.Entrant.objects
+            .filter(match=match).order_by('order'))
+        state = MatchState.load(match, entrants)
+
+        errors = []
+        if match.version != nthrows + nundos:
+            errors.append("version %s after %d changes"
+                % (match.version, nthrows + nundos))
+
+        played = sum(len(r.throws) for l in state.legs for r in l.rounds)
+        if played != nthrows - nundos:
+            errors.append("%d throws in the match, %d expected"
+                % (played, nthrows - nundos))
+
+        scores = {}
+        for leg in state.legs:
+            for pid in state.player_ids:
+                scores[pid] = state.target_score
+            for i, r in enumerate(leg.rounds):
+                if r.number != i + 1:
+                    errors.append("leg %s: round %s in position %d"
+                        % (leg.number, r.number, i + 1))
+                if r.player_id != state.round_player_id(leg.number, r.number):
+                    errors.append("leg %s round %s: wrong player"
+                        % (leg.number, r.number))
+                if [ t.number for t in r.throws ] \
+                        != range(1, len(r.throws) + 1) or len(r.throws) > 3:
+                    errors.append("leg %s round %s: throws %s"
+                        % (leg.number, r.number,
+                            [ t.number for t in r.throws ]))
+                if r.score_start != scores[r.player_id]:
+                    errors.append("leg %s round %s: starts from %s, not %s"
+                        % (leg.number, r.number, r.score_start,
+                            scores[r.player_id]))
+                if r.score_end is not None:
+                    scores[r.player_id] = r.score_end
+
+        cached = Game(match_id).state
+        data = list(match_state.serialize(cached))
+        data[7] = state.version = cached.version
+        if tuple(data) != match_state.serialize(state):
+            errors.append("the cached state differs from the database")
+
+        if errors:
+            raise CommandError("match %s not consistent: %s"
+                % (match_id, '; '.join(errors)))
+
+
+class Tablet(threading.Thread):
+    """Throw and undo on a match as fast as possible, with no wait."""
+    def __init__(self, match_id, nchanges, undo_rate, seed):
+        super(Tablet, self).__init__()
+        self.daemon = True
+        self.match_id = match_id
+        self.nchanges = nchanges
+        self.undo_rate = undo_rate
+        self.rng = random.Random(seed)
+        self.times = []
+        self.throws = self.undos = 0
+        self.conflicts = self.errors = 0
+
+    def run(self):
+        try:
+            for i in range(self.nchanges):
+                # undo only a throw made by this tablet: it is still there,
+                # as the other undos remove the throws of the other tablets
+                if self.throws > self.undos \
+                        and self.rng.random() < self.undo_rate:
+                    self.change('undo_throw')
+                else:
+                    self.change('throw', self.rng.choice(CODES).code)
+        finally:
+            connection.close()
+
+    def change(self, method, *args):
+        t0 = time.time()
+        try:
+            views.change_game(self.match_id, method, *args)
+        except ConflictError:
+            self.conflicts += 1
+        except DatabaseError:
+            # "database is locked"
+            self.errors += 1
+        else:
+            if method == 'throw':
+                self.throws += 1
+            else:
+                self.undos += 1
+        self.times.append((time.time() - t0) * 1000)
@@ -0,0 +1,114 @@
+import time
+import random
+import threading
+from optparse import make_option
+
+from django.test.client import Client, RequestFactory
+from django.core.urlresolvers import reverse
+from django.core.management.base import NoArgsCommand, CommandError
+
+from darts import views
+from darts import models
+from darts import bench
+from darts.game import Game
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--subscribers', type='int', default=200,
+            help="spectators following the match [default: %default]"),
+        make_option('--throws', type='int', default=200,
+            help="throws to play [default: %default]"),
+        make_option('--interval', type='float', default=0.02,
+            help="seconds between two throws [default: %default]"),
+        make_option('--seed', type='int', default=42,
+            help="random seed [default: %default]"),
+    )
+    help = ("Play a match followed by many spectators streaming its events "
+        "and report the latency of the delivery of the throws.")
+
+    def handle_noargs(self, **options):
+        rng = random.Random(options['seed'])
+        nthrows = options['throws']
+
+        with bench.test_database():
+            player = models.Player.objects.create(
+                username='player', avatar='player.png')
+            # a target score not reachable: the match doesn't end
+            match = models.Match.objects.create(
+                target_score=1000000, legs_number=1)
+            models.Entrant.objects.create(match=match, player=player, order=1)
+
+            # the subscribers can't query the test database from their
+            # threads: they find the state in the cache
+            Game(match.id).state
+
+            # the time each throw was requested, by number
+            sent = {}
+            subscribers = [ Subscriber(match.id, nthrows, sent)
+                for i in range(options['subscribers']) ]
+            for s in subscribers:
+                s.start()
+            for s in subscribers:
+                s.ready.wait()
+
+            client = Client()
+            url = reverse('darts_match_throw', args=[match.id])
+            t0 = time.time()
+            for i in range(nthrows):
+                code = str(rng.choice(bench.BOARD))
+                sent[i] = time.time()
+                resp = client.post(url, {'throw_code': code})
+                if resp.status_code != 200:
+                    raise CommandError("throw failed: %s" % resp.content)
+                time.sleep(options['interval'])
+
+            for s in subscribers:
+                s.join(10)
+            elapsed = time.time() - t0
+
+        latencies = []
+        missing = 0
+        for s in subscribers:
+            latencies.extend(s.latencies)
+            missing += nthrows - len(s.latencies)
+
+        self.stdout.write("%d subscribers, %d throws in %.1f s: "
+            "%d events delivered, %d missing\n"
+            % (len(subscribers), nthrows, elapsed, len(latencies), missing))
+        if latencies:
+            self.stdout.write("latency ms: mean %.2f, p50 %.2f, p95 %.2f, "
+                "p99 %.2f, max %.2f\n" % (bench.mean(latencies),
+                    bench.percentile(latencies, 50),
+                    bench.percentile(latencies, 95),
+                    bench.percentile(latencies, 99),
+                    max(latencies)))
+
+
+class Subscriber(threading.Thread):
+    """A spectator reading the events stream of a match."""
+    def __init__(self, match_id, nthrows, sent):
+        super(Subscriber, self).__init__()
+        self.daemon = True
+        self.match_id = match_id
+        self.nthrows = nthrows
+        self.sent = sent
+        self.latencies = []
+        self.ready = threading.Event()
+
+    def run(self):
+        request = RequestFactory().get(
+            reverse('darts_match_events', args=[self.match_id]))
+        resp = views.match_events(request, self.match_id)
+        try:
+            for chunk in resp:
+                now = time.time()
+                self.ready.set()
+                for msg in chunk.split('\n\n'):
+                    if 'event: throw' in msg:
+                        sent = self.sent[len(self.latencies)]
+                        self.latencies.append((now - sent) * 1000)
+
+                if len(self.latencies) >= self.nthrows:
+                    break
+        finally:
+            resp.close()
@@ -0,0 +1,139 @@
+import random
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.test.client import Client
+from django.utils import simplejson
+
+from darts import models
+from darts import bench
+from darts.game import Game
+
+# Maximum number of queries allowed per request. Only raise them knowingly:
+# the game hot paths should only query the database to write changes.
+# The throws and undos also update the players stats counters: an upsert
+# per counters table, 2 queries more to lookup the highest finish again on
+# the undo of a win, and 1 to check and bump the version of the match. Every
+# change is appended to the match log, and the throw winning a leg snapshots
+# the state: 2 more. The undo deletes the rows known by the state, without
+# looking for them.
+QUERY_LIMITS = {
+    'match_throw': 10,
+    'match_undo': 11,
+    'match_play': 1,
+    'match_scoreboard': 1,
+    'scoreboard_304': 0,
+}
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--entrants', default='1-8',
+            help="numbers of entrants per match [default: %default]"),
+        make_option('--targets', default='301,501,1001',
+            help="target scores of the matches [default: %default]"),
+        make_option('--legs', default='1,3',
+            help="numbers of legs of the matches [default: %default]"),
+        make_option('--undo-rate', type='float', default=0.02,
+            help="probability to undo a throw [default: %default]"),
+        make_option('--seed', type='int', default=42,
+            help="random seed, to repeat the same matches [default: %default]"),
+        make_option('--no-check', action='store_false', dest='check',
+            default=True, help="don't fail if the query limits are exceeded"),
+    )
+    help = ("Play scripted matches on a test database and report queries, "
+        "latency and allocations of the game views.")
+
+    def handle_noargs(self, **options):
+        rng = random.Random(options['seed'])
+        recorder = bench.Recorder()
+
+        with bench.test_database():
+            players = [ models.Player.objects.create(
+                    username='player%d' % i, avatar='player.png')
+                for i in range(max(bench.parse_ints(options['entrants']))) ]
+
+            client = Client()
+            for nentrants in bench.parse_ints(options['entrants']):
+                for target in bench.parse_ints(options['targets']):
+                    for nlegs in bench.parse_ints(options['legs']):
+                        self.play_match(client, recorder, rng,
+                            players[:nentrants], target, nlegs,
+                            options['undo_rate'])
+
+        report = recorder.report()
+        self.stdout.write("%-16s %8s %8s %8s %9s %9s %9s\n" % (
+            'endpoint', 'requests', 'queries', 'max', 'mean ms', 'p95 ms',
+            'objects'))
+        for r in report:
+            self.stdout.write(
+                "%(endpoint)-16s %(requests)8d %(queries_mean)8.2f "
+                "%(queries_max)8d %(time_mean)9.2f %(time_p95)9.2f "
+                "%(objects_mean)9.1f\n" % r)
+
+        if options['check']:
+            errors = [ "%s: %d queries (max %d)"
+                    % (r['endpoint'], r['queries_max'],
+                        QUERY_LIMITS[r['endpoint']])
+                for r in report
+                if r['queries_max'] > QUERY_LIMITS[r['endpoint']] ]
+            if errors:
+                raise CommandError("query limits exceeded: %s"
+                    % '; '.join(errors))
+
+    def play_match(self, client, recorder, rng, players, target, nlegs,
+            undo_rate):
+        resp = client.post(reverse('darts_match_create'), {
+            'score': target, 'legs': nlegs,
+            'entrants': ','.join(str(p.id) for p in players)})
+        if resp.status_code != 200:
+            raise CommandError("match creation failed: %s" % resp.content)
+        match_id = int(simplejson.loads(resp.content)['redirect']
+            .rstrip('/').split('/')[-2])
+
+        sims = dict((p.id, bench.Player(rng)) for p in players)
+        urls = dict((name, reverse('darts_' + name, args=[match_id]))
+            for name in ('match_play', 'match_throw', 'match_undo',
+                'match_scoreboard'))
+        urls['scoreboard_304'] = urls['match_scoreboard']
+
+        # reading the situation from the game is not measured, but it keeps
+        # the state cache warm, as the views would do after every change
+        Game(match_id).state
+        self.request(client, recorder, 'match_play', 'get', urls)
+        while 1:
+            state = Game(match_id).state
+            if state.winner_id is not None:
+                break
+
+            round = state.current_round
+            code = sims[round.player_id].throw(round.score,
+                3 - len(round.throws))
+            rv = self.request(client, recorder, 'match_throw', 'post', urls,
+                {'throw_code': code})
+
+            # a scoreboard polling: it gets the change, then nothing new
+            resp = self.request(client, recorder, 'match_scoreboard', 'get',
+                urls, raw=True)
+            self.request(client, recorder, 'scoreboard_304', 'get', urls,
+                status=304, HTTP_IF_NONE_MATCH=resp['ETag'])
+
+            # the page is reloaded after an undo or to play the next leg
+            if rng.random() < undo_rate:
+                self.request(client, recorder, 'match_undo', 'post', urls)
+                self.request(client, recorder, 'match_play', 'get', urls)
+            elif 'leg_winner' in rv and 'match_winner' not in rv:
+                self.request(client, recorder, 'match_play', 'get', urls)
+
+    def request(self, client, recorder, endpoint, method, urls, data=None,
+            status=200, raw=False, **extra):
+        f = getattr(client, method)
+        resp = recorder.measure(endpoint, f, urls[endpoint], data or {},
+            **extra)
+        if resp.status_code != status:
+            raise CommandError("%s failed: %s %s"
+                % (endpoint, resp.status_code, resp.content))
+        if raw:
+            return resp
+        if resp['Content-Type'].startswith('application/json'):
+            return simplejson.loads(resp.content)
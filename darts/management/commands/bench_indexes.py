@@ -0,0 +1,142 @@
+import re
+import random
+from optparse import make_option
+
+from django.db import connection, transaction
+from django.core.management.base import NoArgsCommand
+from django.core.management.color import no_style
+from django.core.management.sql import custom_sql_for_model
+
+from darts import models
+from darts import bench
+from darts import state as match_state
+from darts.game import Game
+from darts.state import MatchState
+
+# The indexes replaced by the ones in the sql directory
+FK_INDEXES = [
+    ('darts_leg', 'match_id'),
+    ('darts_round', 'leg_id'),
+    ('darts_throw', 'round_id'),
+]
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--throws', type='int', default=100000,
+            help="throws to store in the database [default: %default]"),
+        make_option('--samples', type='int', default=2000,
+            help="operations to time [default: %default]"),
+        make_option('--seed', type='int', default=42,
+            help="random seed [default: %default]"),
+    )
+    help = ("Compare the query plans and the latency of the game with and "
+        "without the darts custom indexes, on a large test database.")
+
+    def handle_noargs(self, **options):
+        rng = random.Random(options['seed'])
+        with bench.test_database():
+            self.stdout.write("populating the database...\n")
+            nthrows = bench.populate(options['throws'], rng)
+            transaction.commit_unless_managed()
+            self.stdout.write("%d throws stored\n" % nthrows)
+
+            # before: only the indexes on the foreign keys, as syncdb used
+            # to create them
+            statements = self.index_statements()
+            self.run_sql([ "DROP INDEX %s" % re.search(
+                    r'CREATE INDEX (\w+)', s).group(1)
+                for s in statements ])
+            self.run_sql([ "CREATE INDEX %s_fk ON %s (%s)" % (t, t, c)
+                for t, c in FK_INDEXES ])
+            before = self.measure(rng, options['samples'])
+
+            self.run_sql([ "DROP INDEX %s_fk" % t for t, c in FK_INDEXES ])
+            self.run_sql(statements)
+            after = self.measure(rng, options['samples'])
+
+        for title, res in (('without indexes', before),
+                ('with indexes', after)):
+            self.stdout.write("\n=== %s ===\n" % title)
+            for name, plan in res['plans']:
+                self.stdout.write("%s:\n" % name)
+                for row in plan:
+                    self.stdout.write("    %s\n" % (row,))
+
+        self.stdout.write("\n%-12s %12s %12s %12s %12s\n" % ('',
+            'before mean', 'before p95', 'after mean', 'after p95'))
+        for name in ('state load', 'cold throw', 'warm throw'):
+            b = before['times'][name]
+            a = after['times'][name]
+            self.stdout.write("%-12s %9.3f ms %9.3f ms %9.3f ms %9.3f ms\n" % (
+                name, bench.mean(b), bench.percentile(b, 95),
+                bench.mean(a), bench.percentile(a, 95)))
+
+    def index_statements(self):
+        rv = []
+        for model in (models.Leg, models.Round, models.Throw):
+            rv.extend(custom_sql_for_model(model, no_style(), connection))
+        return rv
+
+    def run_sql(self, statements):
+        cur = connection.cursor()
+        for s in statements:
+            cur.execute(s)
+        transaction.commit_unless_managed()
+
+    def measure(self, rng, nsamples):
+        rv = {'plans': [], 'times': {}}
+
+        # the queries reading the state of a match
+        match = models.Match.objects.order_by('?')[0]
+        cur = connection.cursor()
+        for name, qs in (
+                ('legs', models.Leg.objects
+                    .filter(match=match).order_by('number')),
+                ('rounds', models.Round.objects
+                    .filter(leg__match=match)
+                    .order_by('leg__number', 'number')),
+                ('throws', models.Throw.objects
+                    .filter(round__leg__match=match)
+                    .order_by('round__leg__number', 'round__number',
+                        'number'))):
+            sql, params = qs.query.sql_with_params()
+            cur.execute("EXPLAIN QUERY PLAN " + sql, params)
+            rv['plans'].append((name, cur.fetchall()))
+
+        # load the state of random finished matches
+        maxid = models.Match.objects.order_by('-id')[0].id
+        times = rv['times']['state load'] = []
+        for i in range(nsamples):
+            match = models.Match.objects.get(id=rng.randint(1, maxid))
+            entrants = list(models.Entrant.objects.filter(match=match))
+            times.append(bench.timed(MatchState.load, match, entrants))
+
+        # play new matches, with and without the state in the cache
+        players = list(models.Player.objects.all()[:2])
+        sims = dict((p.id, bench.Player(rng)) for p in players)
+        for name in ('cold throw', 'warm throw'):
+            times = rv['times'][name] = []
+            game = None
+            while len(times) < nsamples:
+                if game is None or game.state.winner_id is not None:
+                    game = self.new_game(players)
+                if name == 'cold throw':
+                    match_state.invalidate(game.state.match_id)
+                game = Game(game.state.match_id)
+                round = game.state.current_round
+                code = sims[round.player_id].throw(round.score,
+                    3 - len(round.throws))
+                times.append(bench.timed(self.throw, game, code))
+
+        return rv
+
+    def new_game(self, players):
+        match = models.Match.objects.create(target_score=501, legs_number=1)
+        for i, p in enumerate(players):
+            models.Entrant.objects.create(match=match, player=p, order=i + 1)
+        transaction.commit_unless_managed()
+        return Game(match.id)
+
+    @transaction.commit_on_success
+    def throw(self, game, code):
+        game.throw(code)
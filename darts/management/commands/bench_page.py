@@ -0,0 +1,112 @@
+import re
+import random
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.contrib.staticfiles import finders
+from django.conf import settings
+from django.test.client import Client
+
+from darts import models
+from darts import bench
+from darts import matches
+from darts.game import Game
+
+# The assets of the page served by the site: scripts, styles, images
+_ASSET_RE = re.compile(r'''["'](/[^"'\s]+\.(?:js|css|svg)(?:\?[^"'\s]*)?)["']''')
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--entrants', type='int', default=4,
+            help="number of entrants of the match [default: %default]"),
+        make_option('--throws', type='int', default=200,
+            help="throws to play, reloading the page after every one "
+                "[default: %default]"),
+        make_option('--seed', type='int', default=42,
+            help="random seed [default: %default]"),
+    )
+    help = ("Report the weight of the match page, the size of its assets "
+        "and the time to render it after a change and when reloaded "
+        "without changes.")
+
+    def handle_noargs(self, **options):
+        rng = random.Random(options['seed'])
+        recorder = bench.Recorder()
+        client = Client()
+
+        with bench.test_database():
+            players = [ models.Player.objects.create(
+                    username='player%d' % i, avatar='player.png')
+                for i in range(options['entrants']) ]
+            res = matches.create_matches([{'score': 501, 'legs': 3,
+                'entrants': [ p.id for p in players ]}])[0]
+            if 'error' in res:
+                raise CommandError(res['error'])
+
+            match_id = res['id']
+            sims = dict((p.id, bench.Player(rng)) for p in players)
+            url = reverse('darts_match_play', args=[match_id])
+            throw_url = reverse('darts_match_throw', args=[match_id])
+
+            for i in range(options['throws']):
+                state = Game(match_id).state
+                if state.winner_id is not None:
+                    break
+
+                round = state.current_round
+                client.post(throw_url, {'throw_code':
+                    sims[round.player_id].throw(round.score,
+                        3 - len(round.throws))})
+                html = self.request(client, recorder, 'changed', url)
+                self.request(client, recorder, 'reloaded', url)
+
+            assets = self.assets(client, html)
+
+        report = recorder.report()
+        self.stdout.write("%-16s %8s %8s %9s %9s\n" % (
+            'page', 'requests', 'queries', 'mean ms', 'p95 ms'))
+        for r in report:
+            self.stdout.write(
+                "%(endpoint)-16s %(requests)8d %(queries_mean)8.2f "
+                "%(time_mean)9.2f %(time_p95)9.2f\n" % r)
+
+        inline = sum(len(s) for s in re.findall(
+            r'<script[^>]*>(.*?)</script>', html, re.DOTALL))
+        self.stdout.write("\n%-40s %8s\n" % ('content', 'bytes'))
+        self.stdout.write("%-40s %8d\n" % ('page', len(html)))
+        self.stdout.write("%-40s %8d\n" % ('  of which inline scripts', inline))
+        for name, size, cc in assets:
+            self.stdout.write("%-40s %8d  %s\n"
+                % (name.split('?')[0], size, cc))
+        self.stdout.write("%-40s %8d\n" % ('first load',
+            len(html) + sum(a[1] for a in assets)))
+        self.stdout.write("%-40s %8d\n" % ('reload (assets cached)',
+            len(html) + sum(a[1] for a in assets if not a[2])))
+
+    def request(self, client, recorder, endpoint, url):
+        resp = recorder.measure(endpoint, client.get, url)
+        if resp.status_code != 200:
+            raise CommandError("%s failed: %s %s"
+                % (url, resp.status_code, resp.content))
+        return resp.content
+
+    def assets(self, client, html):
+        """Return name, size and cache policy of the assets of a page."""
+        rv = []
+        for url in sorted(set(_ASSET_RE.findall(html))):
+            if url.startswith(settings.STATIC_URL):
+                path = finders.find(url[len(settings.STATIC_URL):]
+                    .split('?')[0])
+                if path is None:
+                    raise CommandError("static file not found: %s" % url)
+                # served by the web server, with the expiry it's told to
+                rv.append((url, len(open(path, 'rb').read()), 'static'))
+            else:
+                resp = client.get(url)
+                if resp.status_code != 200:
+                    raise CommandError("%s failed: %s"
+                        % (url, resp.status_code))
+                rv.append((url, len(resp.content),
+                    resp.get('Cache-Control', '')))
+        return rv
@@ -0,0 +1,90 @@
+import random
+from optparse import make_option
+
+import numpy as np
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from darts import models
+from darts import bench
+from darts import winprob
+from darts import state as match_state
+from darts.game import Game
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--trials', default='500,1000,2000,5000',
+            help="numbers of trials to measure [default: %default]"),
+        make_option('--history', type='int', default=20000,
+            help="throws played by the players before [default: %default]"),
+        make_option('--target', type='int', default=501,
+            help="target score of the match [default: %default]"),
+        make_option('--legs', type='int', default=3,
+            help="legs to win the match [default: %default]"),
+        make_option('--seed', type='int', default=42,
+            help="random seed [default: %default]"),
+    )
+    help = ("Play a match on a test database and report the time to compute "
+        "the chances of the players to win at every throw.")
+
+    def handle_noargs(self, **options):
+        trials = bench.parse_ints(options['trials'])
+        if min(trials) <= 0:
+            raise CommandError("the trials must be positive")
+
+        rng = random.Random(options['seed'])
+        with bench.test_database():
+            bench.populate(options['history'], rng)
+            players = list(models.Player.objects.order_by('id'))
+            ms = bench.timed(map, winprob.player_outcomes,
+                [ p.id for p in players ])
+            self.stdout.write("players model from %d throws: %.2f ms\n"
+                % (options['history'], ms))
+
+            states = self.play(players, rng, options)
+            self.measure(states, trials, options)
+
+    def measure(self, states, trials, options):
+        self.stdout.write("%d positions of a match of %d legs\n"
+            % (len(states), options['legs']))
+        self.stdout.write("%8s %9s %9s %9s %9s %11s\n" % (
+            'trials', 'first ms', 'mean ms', 'p95 ms', 'max ms', 'trials/s'))
+        for n in trials:
+            nprng = np.random.RandomState(options['seed'])
+            # the first call also simulates the legs from the start
+            first = bench.timed(winprob.compute_chances, states[0], n, nprng)
+            times = [ bench.timed(winprob.compute_chances, s, n, nprng)
+                for s in states ]
+            mean = bench.mean(times)
+            self.stdout.write("%8d %9.2f %9.2f %9.2f %9.2f %11.0f\n" % (
+                n, first, mean, bench.percentile(times, 95), max(times),
+                n / mean * 1000))
+
+        # the first call computes them
+        times = [ bench.timed(winprob.win_chances, states[-1])
+            for i in range(101) ]
+        self.stdout.write("cached: %.3f ms\n" % bench.mean(times[1:]))
+
+    def play(self, players, rng, options):
+        """Play a match, return a copy of its state after every throw."""
+        match = models.Match.objects.create(
+            target_score=options['target'], legs_number=options['legs'])
+        for i, p in enumerate(players):
+            models.Entrant.objects.create(match=match, player=p, order=i + 1)
+
+        sims = dict((p.id, bench.Player(rng)) for p in players)
+        states = []
+        while 1:
+            game = Game(match.id)
+            state = game.state
+            if state.winner_id is not None:
+                break
+
+            states.append(match_state.deserialize(
+                match_state.serialize(state)))
+            round = state.current_round
+            game.throw(sims[round.player_id].throw(round.score,
+                3 - len(round.throws)))
+            game.save_state()
+
+        return states
@@ -0,0 +1,111 @@
+import time
+import random
+import threading
+from optparse import make_option
+
+from django.db import connection, DatabaseError
+from django.core.management.base import NoArgsCommand, CommandError
+
+from darts import views
+from darts import models
+from darts import writer
+from darts import bench
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--matches', type='int', default=20,
+            help="matches played at once, one thread each "
+                "[default: %default]"),
+        make_option('--throws', type='int', default=200,
+            help="throws to play in every match [default: %default]"),
+        make_option('--window', type='float', default=writer.WINDOW,
+            help="seconds the writer waits to group the changes "
+                "[default: %default]"),
+        make_option('--seed', type='int', default=42,
+            help="random seed [default: %default]"),
+    )
+    help = ("Play many matches at once on a test database, committing every "
+        "throw by itself and then in groups by the writer thread, and "
+        "report the writes per second.")
+
+    def handle_noargs(self, **options):
+        if options['matches'] <= 0 or options['throws'] <= 0:
+            raise CommandError("matches and throws must be positive")
+
+        enabled, window = writer.ENABLED, writer.WINDOW
+        writer.WINDOW = options['window']
+        self.stdout.write("%-14s %8s %8s %9s %9s %9s %9s\n" % (
+            'mode', 'throws', 'errors', 'writes/s', 'p50 ms', 'p99 ms',
+            'batch'))
+        try:
+            with bench.test_database(shared=True):
+                for mode, group in (('direct', False), ('group commit', True)):
+                    writer.ENABLED = group
+                    self.run(mode, options)
+        finally:
+            writer.ENABLED, writer.WINDOW = enabled, window
+
+    def run(self, mode, options):
+        rng = random.Random(options['seed'])
+        matches = []
+        for i in range(options['matches']):
+            player = models.Player.objects.create(
+                username='%s %d' % (mode, i), avatar='player.png')
+            # a target score not reachable: the match doesn't end
+            match = models.Match.objects.create(
+                target_score=1000000, legs_number=1)
+            models.Entrant.objects.create(match=match, player=player, order=1)
+            matches.append(match.id)
+
+        threads = [ Thrower(match_id, options['throws'],
+                rng.randint(0, 1 << 30))
+            for match_id in matches ]
+
+        stats0 = writer.stats()
+        t0 = time.time()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - t0
+        stats1 = writer.stats()
+
+        nthrows = models.Throw.objects.filter(
+            round__leg__match__in=matches).count()
+        times = []
+        for t in threads:
+            times.extend(t.times)
+        batches = stats1['batches'] - stats0['batches']
+        changes = stats1['changes'] - stats0['changes']
+
+        self.stdout.write("%-14s %8d %8d %9.1f %9.2f %9.2f %9s\n" % (
+            mode, nthrows, sum(t.errors for t in threads),
+            nthrows / elapsed, bench.percentile(times, 50),
+            bench.percentile(times, 99),
+            batches and '%.1f' % (float(changes) / batches) or '-'))
+
+
+class Thrower(threading.Thread):
+    """Play the throws of a match as fast as they are committed."""
+    def __init__(self, match_id, nthrows, seed):
+        super(Thrower, self).__init__()
+        self.daemon = True
+        self.match_id = match_id
+        self.nthrows = nthrows
+        self.rng = random.Random(seed)
+        self.times = []
+        self.errors = 0
+
+    def run(self):
+        try:
+            for i in range(self.nthrows):
+                code = str(self.rng.choice(bench.BOARD))
+                t0 = time.time()
+                try:
+                    views.change_game(self.match_id, 'throw', code)
+                except DatabaseError:
+                    # "database is locked"
+                    self.errors += 1
+                self.times.append((time.time() - t0) * 1000)
+        finally:
+            connection.close()
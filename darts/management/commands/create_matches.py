@@ -0,0 +1,47 @@
+import sys
+import time
+
+from django.utils import simplejson
+from django.core.management.base import BaseCommand, CommandError
+
+from darts import matches
+
+class Command(BaseCommand):
+    args = 'FILE'
+    help = ("Create the matches described in a file, one per line in JSON "
+        "with the fields of the creation form, e.g. "
+        "{\"score\": 501, \"legs\": 3, \"entrants\": [1, 2]} "
+        "('-' to read stdin). The matches not valid are reported and "
+        "skipped.")
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("please specify the file to read")
+
+        f = args[0] == '-' and sys.stdin or open(args[0], 'rb')
+        lines = []
+        records = []
+        for lineno, line in enumerate(f):
+            if not line.strip():
+                continue
+            try:
+                records.append(simplejson.loads(line))
+            except ValueError, e:
+                raise CommandError("line %d: %s" % (lineno + 1, e))
+            if not isinstance(records[-1], dict):
+                raise CommandError("line %d: not a match" % (lineno + 1))
+            lines.append(lineno + 1)
+
+        t0 = time.time()
+        errors = 0
+        for lineno, res in zip(lines, matches.create_matches(records)):
+            if 'error' in res:
+                self.stderr.write("line %d: %s\n" % (lineno, res['error']))
+                errors += 1
+            elif int(options['verbosity']) >= 2:
+                self.stdout.write("line %d: match %d\n" % (lineno, res['id']))
+
+        self.stdout.write("%d matches created in %.1f s\n"
+            % (len(records) - errors, time.time() - t0))
+        if errors:
+            raise CommandError("%d matches not valid" % errors)
@@ -0,0 +1,67 @@
+import sys
+import csv
+import time
+from optparse import make_option
+
+from django.utils import simplejson
+from django.core.management.base import BaseCommand, CommandError
+
+from darts import models
+from darts import history
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--format', choices=('jsonl', 'csv'), default='jsonl',
+            help="output format: 'jsonl' (a match per line, can be "
+                "imported) or 'csv' (a throw per row) [default: %default]"),
+        make_option('-o', '--output', metavar="FILE",
+            help="file to write [default: stdout]"),
+        make_option('--batch-size', type='int', default=100,
+            help="matches to read at time [default: %default]"),
+    )
+    args = '[match_id ...]'
+    help = "Export the history of the matches."
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError("bad batch size: %s" % options['batch_size'])
+
+        matches = models.Match.objects.all()
+        if args:
+            matches = matches.filter(id__in=map(int, args))
+
+        if options['output']:
+            f = open(options['output'], 'wb')
+        else:
+            f = sys.stdout
+
+        t0 = time.time()
+        records = history.export_matches(matches, options['batch_size'])
+        try:
+            if options['format'] == 'csv':
+                writer = csv.writer(f)
+                writer.writerow(history.CSV_FIELDS)
+                for row in history.csv_rows(self.count(records)):
+                    writer.writerow(row)
+            else:
+                for record in self.count(records):
+                    f.write(simplejson.dumps(record, separators=(',', ':')))
+                    f.write('\n')
+        finally:
+            if f is not sys.stdout:
+                f.close()
+
+        elapsed = max(time.time() - t0, 0.001)
+        self.stderr.write("%d matches, %d throws exported in %.1f s "
+            "(%.0f matches/s, %.0f throws/s)\n"
+            % (self.nmatches, self.nthrows, elapsed,
+                self.nmatches / elapsed, self.nthrows / elapsed))
+
+    def count(self, records):
+        self.nmatches = self.nthrows = 0
+        for record in records:
+            self.nmatches += 1
+            for leg in record['legs']:
+                for r in leg['rounds']:
+                    self.nthrows += len(r['throws'])
+            yield record
@@ -0,0 +1,72 @@
+import sys
+import time
+from itertools import islice
+from optparse import make_option
+
+from django.db import transaction
+from django.utils import simplejson
+from django.core.management.base import BaseCommand, CommandError
+
+from darts import history
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=100,
+            help="matches to insert in every transaction "
+                "[default: %default]"),
+        make_option('--start', type='int', default=1, metavar="LINE",
+            help="first line of the file to import, to resume an import "
+                "failed [default: %default]"),
+    )
+    args = 'FILE'
+    help = ("Import the matches exported in jsonl format by export_matches "
+        "('-' to read stdin). Run rebuild_stats after the import to update "
+        "the players statistics.")
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("please specify the file to import")
+        if options['batch_size'] <= 0:
+            raise CommandError("bad batch size: %s" % options['batch_size'])
+        if options['start'] <= 0:
+            raise CommandError("bad start line: %s" % options['start'])
+
+        verbosity = int(options['verbosity'])
+        batch_size = options['batch_size']
+        f = args[0] == '-' and sys.stdin or open(args[0], 'rb')
+
+        t0 = time.time()
+        nmatches = nthrows = 0
+        lineno = options['start']
+        lines = islice(f, lineno - 1, None)
+        while 1:
+            batch = list(islice(lines, batch_size))
+            if not batch:
+                break
+
+            try:
+                records = [ simplejson.loads(line)
+                    for line in batch if line.strip() ]
+                nthrows += self.import_batch(records)
+            except Exception, e:
+                raise CommandError("importing lines %d-%d: %s\n"
+                    "the lines before have been imported: "
+                    "resume with --start %d"
+                    % (lineno, lineno + len(batch) - 1,
+                        "%s: %s" % (e.__class__.__name__, e), lineno))
+
+            nmatches += len(records)
+            lineno += len(batch)
+            if verbosity >= 2:
+                self.stdout.write("%d matches imported (%.0f throws/s)\n"
+                    % (nmatches, nthrows / max(time.time() - t0, 0.001)))
+
+        elapsed = max(time.time() - t0, 0.001)
+        self.stdout.write("%d matches, %d throws imported in %.1f s "
+            "(%.0f matches/s, %.0f throws/s)\n"
+            % (nmatches, nthrows, elapsed,
+                nmatches / elapsed, nthrows / elapsed))
+
+    @transaction.commit_on_success
+    def import_batch(self, records):
+        return history.import_matches(records)
@@ -0,0 +1,253 @@
+import sys
+import time
+import random
+import urllib
+import urllib2
+import cookielib
+import threading
+from Queue import Queue, Empty
+from optparse import make_option
+from SocketServer import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+from django.db import DatabaseError
+from django.utils import simplejson
+from django.core.signals import got_request_exception
+from django.core.urlresolvers import reverse
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import NoArgsCommand, CommandError
+
+from darts import models
+from darts import bench
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--url',
+            help="base url of a running server, e.g. http://127.0.0.1:8000 "
+                "[default: serve the app in this process on a test db]"),
+        make_option('--matches', type='int', default=20,
+            help="matches to play [default: %default]"),
+        make_option('--workers', type='int', default=0,
+            help="threads playing the matches [default: one per match]"),
+        make_option('--entrants', type='int', default=2,
+            help="players in every match [default: %default]"),
+        make_option('--target', type='int', default=501,
+            help="target score of the matches [default: %default]"),
+        make_option('--legs', type='int', default=3,
+            help="legs to win the matches [default: %default]"),
+        make_option('--undo-rate', type='float', default=0.02,
+            help="probability to undo a throw [default: %default]"),
+        make_option('--seed', type='int', default=42,
+            help="random seed [default: %default]"),
+    )
+    help = ("Play many matches at once through the HTTP interface and "
+        "report throughput, latency and errors per endpoint.")
+
+    def handle_noargs(self, **options):
+        if options['matches'] <= 0 or options['entrants'] <= 0:
+            raise CommandError("matches and entrants must be positive")
+
+        if options['url']:
+            # the players are created in the database of the server
+            self.run(options['url'].rstrip('/'), options)
+            return
+
+        with bench.test_database(shared=True):
+            server = make_server('127.0.0.1', 0, WSGIHandler(),
+                server_class=ThreadingWSGIServer,
+                handler_class=QuietHandler)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+
+            locked = []
+            def count_locks(sender, **kwargs):
+                # the message of SQLite, other backends may differ
+                e = sys.exc_info()[1]
+                if isinstance(e, DatabaseError) and 'locked' in str(e):
+                    locked.append(e)
+
+            got_request_exception.connect(count_locks)
+            try:
+                self.run('http://127.0.0.1:%d' % server.server_port,
+                    options)
+            finally:
+                got_request_exception.disconnect(count_locks)
+                server.shutdown()
+
+            self.stdout.write("database lock timeouts: %d\n" % len(locked))
+
+    def run(self, base_url, options):
+        rng = random.Random(options['seed'])
+        players = [ models.Player.objects.get_or_create(
+                username='load%d' % i, defaults={'avatar': 'player.png'})[0]
+            for i in range(options['entrants'] * options['matches']) ]
+
+        queue = Queue()
+        for i in range(options['matches']):
+            queue.put((players[i * options['entrants']:
+                (i + 1) * options['entrants']], rng.randint(0, 1 << 30)))
+
+        recorder = Recorder()
+        nworkers = options['workers'] or options['matches']
+        workers = [ Worker(base_url, queue, recorder, options)
+            for i in range(nworkers) ]
+
+        t0 = time.time()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.time() - t0
+
+        self.report(recorder, workers, elapsed)
+
+    def report(self, recorder, workers, elapsed):
+        nrequests = sum(len(v) for v in recorder.times.itervalues())
+        nthrows = len(recorder.times.get('match_throw', ()))
+        self.stdout.write("%d matches played, %d failed, by %d workers "
+            "in %.1f s\n" % (
+                sum(w.played for w in workers),
+                sum(w.failed for w in workers), len(workers), elapsed))
+        self.stdout.write("%d requests (%.1f/s), %d throws (%.1f/s)\n"
+            % (nrequests, nrequests / elapsed, nthrows, nthrows / elapsed))
+
+        self.stdout.write("%-16s %8s %8s %9s %9s %9s %9s\n" % (
+            'endpoint', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms',
+            'max ms'))
+        for endpoint in sorted(recorder.times):
+            times = recorder.times[endpoint]
+            self.stdout.write("%-16s %8d %8d %9.2f %9.2f %9.2f %9.2f\n" % (
+                endpoint, len(times), recorder.errors.get(endpoint, 0),
+                bench.percentile(times, 50), bench.percentile(times, 95),
+                bench.percentile(times, 99), max(times)))
+
+        for (endpoint, error), n in sorted(recorder.error_kinds.iteritems()):
+            self.stdout.write("%s: %s: %d\n" % (endpoint, error, n))
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class Recorder(object):
+    """Collect the latency and the errors of the requests of all workers."""
+    def __init__(self):
+        self.times = {}
+        self.errors = {}
+        self.error_kinds = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, ms, error=None):
+        with self._lock:
+            self.times.setdefault(endpoint, []).append(ms)
+            if error is not None:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+                key = (endpoint, error)
+                self.error_kinds[key] = self.error_kinds.get(key, 0) + 1
+
+
+class RequestFailed(Exception):
+    pass
+
+class Worker(threading.Thread):
+    """Play the matches in the queue, one at time, as a browser would."""
+    def __init__(self, base_url, queue, recorder, options):
+        super(Worker, self).__init__()
+        self.daemon = True
+        self.base_url = base_url
+        self.queue = queue
+        self.recorder = recorder
+        self.options = options
+        self.played = self.failed = 0
+        self.cookies = cookielib.CookieJar()
+        self.opener = urllib2.build_opener(
+            urllib2.HTTPCookieProcessor(self.cookies))
+        self.csrf_token = None
+
+    def run(self):
+        while 1:
+            try:
+                players, seed = self.queue.get_nowait()
+            except Empty:
+                return
+
+            try:
+                self.play(players, random.Random(seed))
+            except RequestFailed:
+                self.failed += 1
+            else:
+                self.played += 1
+
+    def play(self, players, rng):
+        resp = self.request('match_create', reverse('darts_match_create'), {
+            'score': self.options['target'],
+            'legs': self.options['legs'],
+            'entrants': ','.join(str(p.id) for p in players)})
+        match_id = int(resp['redirect'].rstrip('/').split('/')[-2])
+        urls = dict((name, reverse('darts_' + name, args=[match_id]))
+            for name in ('match_play', 'match_throw', 'match_undo',
+                'match_scoreboard'))
+        sims = dict((p.id, bench.Player(rng)) for p in players)
+
+        self.request('match_play', urls['match_play'])
+        while 1:
+            # the scoreboard tells who is to throw and its score
+            board = self.request('match_scoreboard', urls['match_scoreboard'])
+            if board['match_winner'] is not None:
+                break
+
+            pid = board['current_player']
+            score = [ p['leg_score'] for p in board['players']
+                if p['id'] == pid ][0]
+            code = sims[pid].throw(score, 4 - board['current_throw'])
+            rv = self.request('match_throw', urls['match_throw'],
+                {'throw_code': code})
+
+            # the page is reloaded after an undo or to play the next leg
+            if rng.random() < self.options['undo_rate']:
+                self.request('match_undo', urls['match_undo'], {})
+                self.request('match_play', urls['match_play'])
+            elif 'leg_winner' in rv and 'match_winner' not in rv:
+                self.request('match_play', urls['match_play'])
+
+    def request(self, endpoint, path, data=None):
+        """Make a request (a POST if there is data), return the JSON content.
+
+        Raise `RequestFailed` if the request fails.
+        """
+        req = urllib2.Request(self.base_url + path)
+        if data is not None:
+            req.add_data(urllib.urlencode(data))
+            req.add_header('X-CSRFToken', self.get_csrf_token())
+
+        t0 = time.time()
+        try:
+            resp = self.opener.open(req)
+            content = resp.read()
+        except urllib2.HTTPError, e:
+            self.recorder.record(endpoint, (time.time() - t0) * 1000,
+                'HTTP %s' % e.code)
+            raise RequestFailed(e)
+        except Exception, e:
+            self.recorder.record(endpoint, (time.time() - t0) * 1000,
+                e.__class__.__name__)
+            raise RequestFailed(e)
+
+        self.recorder.record(endpoint, (time.time() - t0) * 1000)
+        if resp.info().gettype() == 'application/json':
+            return simplejson.loads(content)
+
+    def get_csrf_token(self):
+        # the page of the match creation sets the cookie
+        if self.csrf_token is None:
+            self.opener.open(
+                self.base_url + reverse('darts_match_create')).read()
+            for cookie in self.cookies:
+                if cookie.name == 'csrftoken':
+                    self.csrf_token = cookie.value
+        return self.csrf_token
@@ -0,0 +1,66 @@
+from optparse import make_option
+
+from django.db import transaction
+from django.db.models import Count
+from django.core.management.base import BaseCommand
+
+from darts import models
+from darts import state
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', action='store_true', default=False,
+            help="only report the counters that would be fixed"),
+    )
+    args = '[match_id ...]'
+    help = ("Rebuild the legs won by every entrant and the legs played in "
+        "every match from the legs winners.")
+
+    def handle(self, *args, **options):
+        fixed = self.rebuild(args, options['dry_run'])
+
+        # the cached states have the old counters
+        if not options['dry_run']:
+            for mid in fixed:
+                state.invalidate(mid)
+
+        self.stdout.write("%d matches %s\n"
+            % (len(fixed), options['dry_run'] and 'to fix' or 'fixed'))
+
+    @transaction.commit_on_success
+    def rebuild(self, args, dry_run):
+        """Fix the counters, return the ids of the matches changed."""
+        matches = models.Match.objects.all()
+        entrants = models.Entrant.objects.all()
+        legs = models.Leg.objects.filter(winner__isnull=False)
+        if args:
+            ids = map(int, args)
+            matches = matches.filter(id__in=ids)
+            entrants = entrants.filter(match__in=ids)
+            legs = legs.filter(match__in=ids)
+
+        # map (match id, player id) -> legs won
+        won = dict(((r['match'], r['winner']), r['n'])
+            for r in legs.values('match', 'winner').annotate(n=Count('id')))
+
+        played = {}
+        for (mid, pid), n in won.iteritems():
+            played[mid] = played.get(mid, 0) + n
+
+        fixed = set()
+        for id, mid, pid, result in entrants.values_list(
+                'id', 'match', 'player', 'result'):
+            n = won.get((mid, pid), 0)
+            if result != n:
+                fixed.add(mid)
+                if not dry_run:
+                    models.Entrant.objects.filter(id=id).update(result=n)
+
+        for mid, legs_played in matches.values_list('id', 'legs_played'):
+            n = played.get(mid, 0)
+            if legs_played != n:
+                fixed.add(mid)
+                if not dry_run:
+                    models.Match.objects.filter(id=mid).update(legs_played=n)
+
+        return fixed
@@ -0,0 +1,85 @@
+from optparse import make_option
+
+from django.db import transaction
+from django.core.management.base import NoArgsCommand, CommandError
+
+from darts import models
+from darts import stats
+from darts import aggregates
+from darts.utils import bulk_insert
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--check', action='store_true', default=False,
+            help="only verify the counters, don't rebuild them"),
+    )
+    help = ("Rebuild the players statistics counters from the throws "
+        "history and verify them. Don't run it while matches are played.")
+
+    def handle_noargs(self, **options):
+        expected = stats.compute(models.Throw.objects.all(),
+            models.Leg.objects.all())
+        if not options['check']:
+            self.rebuild(expected)
+
+        errors = self.verify(expected)
+        for msg in errors:
+            self.stderr.write(msg + '\n')
+        if errors:
+            raise CommandError("%d counters don't match the throws history"
+                % len(errors))
+
+        self.stdout.write("%d players %s\n"
+            % (len(expected), options['check'] and 'verified' or 'rebuilt'))
+
+    @transaction.commit_on_success
+    def rebuild(self, expected):
+        models.PlayerSegmentStats.objects.all().delete()
+        models.PlayerStats.objects.all().delete()
+
+        players = []
+        segments = []
+        for pid, s in sorted(expected.iteritems()):
+            values = dict((k, s[k]) for k in aggregates.COUNTERS)
+            players.append(models.PlayerStats(player_id=pid,
+                highest_finish=s['highest_finish'] or 0, **values))
+            for code, n in sorted(s['heatmap'].iteritems()):
+                if n:
+                    segments.append(models.PlayerSegmentStats(
+                        player_id=pid, code=code, hits=n))
+
+        bulk_insert(models.PlayerStats, players)
+        bulk_insert(models.PlayerSegmentStats, segments)
+
+    def verify(self, expected):
+        """Compare the counters in the database with the expected ones.
+
+        Return a list of error messages.
+        """
+        fields = aggregates.COUNTERS + ('highest_finish',)
+        found = dict((row[0], dict(zip(fields, row[1:])))
+            for row in models.PlayerStats.objects.values_list(
+                'player', *fields))
+        segments = {}
+        for pid, code, n in models.PlayerSegmentStats.objects.values_list(
+                'player', 'code', 'hits'):
+            if n:
+                segments.setdefault(pid, {})[code] = n
+
+        rv = []
+        for pid in sorted(set(expected) | set(found) | set(segments)):
+            exp = expected.get(pid) or stats.empty_stats()
+            got = found.get(pid) or dict.fromkeys(fields, 0)
+            for k in fields:
+                if (exp[k] or 0) != got[k]:
+                    rv.append("player %s: %s is %s, expected %s"
+                        % (pid, k, got[k], exp[k] or 0))
+
+            exp = dict((c, n) for c, n in exp['heatmap'].iteritems() if n)
+            got = segments.get(pid, {})
+            for code in sorted(set(exp) | set(got)):
+                if exp.get(code, 0) != got.get(code, 0):
+                    rv.append("player %s: %s hits are %s, expected %s"
+                        % (pid, code, got.get(code, 0), exp.get(code, 0)))
+
+        return rv
@@ -0,0 +1,106 @@
+"""Creation of the matches, one or many at once.
+
+A match is described by a dict with the same fields of the creation form:
+'score' (the target score), 'legs' (the number of legs), 'rules' (optional)
+and 'entrants' (the player ids in order, as a list or a comma-separated
+string).
+"""
+
+from django.db import transaction
+
+from darts import models
+from darts import rules
+from darts.codes import GameError
+from darts.utils import bulk_insert
+
+
+def parse_match(data):
+    """Validate the description of a match.
+
+    Return a tuple (target score, legs number, rules name, player ids).
+    Raise `ValueError` if not valid.
+    """
+    score = data.get('score')
+    try:
+        score = int(score)
+        if score <= 0:
+            raise Exception()
+    except:
+        raise ValueError("bad target score: '%s'" % score)
+
+    nlegs = data.get('legs')
+    try:
+        nlegs = int(nlegs)
+        if nlegs <= 0:
+            raise Exception()
+    except:
+        raise ValueError("bad legs number: '%s'" % nlegs)
+
+    try:
+        match_rules = rules.get(data.get('rules') or rules.DEFAULT).name
+    except GameError, e:
+        raise ValueError(str(e))
+
+    eids = data.get('entrants')
+    if not eids:
+        raise ValueError("no player selected")
+
+    try:
+        if isinstance(eids, basestring):
+            eids = eids.split(',')
+        eids = map(int, eids)
+    except:
+        raise ValueError("bad entrants: '%s'" % (eids,))
+
+    if len(eids) != len(set(eids)):
+        raise ValueError("duplicate entrants")
+
+    return score, nlegs, match_rules, eids
+
+@transaction.commit_on_success
+def create_matches(matches):
+    """Create the matches of a list of descriptions in a single transaction.
+
+    The players of all the matches are looked up in one query and the
+    entrants inserted in bulk. Return a list with, for every description,
+    either {'id': match id} or {'error': message}: the matches not valid are
+    skipped, the others are created anyway.
+    """
+    rv = []
+    parsed = []
+    for data in matches:
+        try:
+            parsed.append(parse_match(data))
+            rv.append(None)
+        except ValueError, e:
+            parsed.append(None)
+            rv.append({'error': str(e)})
+
+    pids = set()
+    for p in parsed:
+        if p is not None:
+            pids.update(p[3])
+    players = models.Player.objects.in_bulk(list(pids))
+
+    entrants = []
+    for i, p in enumerate(parsed):
+        if p is None:
+            continue
+
+        score, nlegs, match_rules, eids = p
+        missing = [ eid for eid in eids if eid not in players ]
+        if missing:
+            rv[i] = {'error': 'player not found: %s' % missing[0]}
+            continue
+
+        # bulk_create() doesn't return the ids: the matches are inserted one
+        # at time, the entrants all together
+        match = models.Match.objects.create(target_score=score,
+            legs_number=nlegs, rules=match_rules)
+        entrants.extend(models.Entrant(match_id=match.id, player_id=eid,
+                order=j + 1)
+            for j, eid in enumerate(eids))
+        rv[i] = {'id': match.id}
+
+    bulk_insert(models.Entrant, entrants)
+    return rv
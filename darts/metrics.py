@@ -0,0 +1,170 @@
+"""Opt-in instrumentation of the game and of the views.
+
+Set DARTS_METRICS = True in the settings to record, for every request, the
+time spent and the queries run in every function decorated with
+`instrumented` (the time of nested calls is included in the caller's) and
+the hits and misses of the cached methods. The values are aggregated in
+histograms exposed by `exposition()` in the Prometheus text format.
+
+When the setting is off the functions are not wrapped at all.
+"""
+
+import threading
+from time import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+from django.core.signals import request_started, request_finished
+
+from darts import cache
+
+ENABLED = getattr(settings, 'DARTS_METRICS', False)
+
+# The upper bounds of the histograms buckets
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0)
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+
+
+def instrumented(f):
+    """Record the time and the queries of the calls to a function."""
+    if not ENABLED:
+        return f
+
+    name = "%s.%s" % (f.__module__.rsplit('.', 1)[-1], f.__name__)
+    @wraps(f)
+    def instrumented_(*args, **kwargs):
+        nqueries = len(connection.queries)
+        t0 = time()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            _record(name, time() - t0,
+                max(0, len(connection.queries) - nqueries))
+
+    return instrumented_
+
+
+class Histogram(object):
+    """Count the values observed in buckets of given upper bounds."""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, metric, labels):
+        """Generate the lines of the text exposition of the histogram."""
+        n = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            n += count
+            yield '%s_bucket{%s,le="%s"} %s' % (metric, labels, bound, n)
+        yield '%s_sum{%s} %s' % (metric, labels, self.sum)
+        yield '%s_count{%s} %s' % (metric, labels, self.count)
+
+
+_lock = threading.Lock()
+_seconds = {}       # name -> Histogram
+_queries = {}       # name -> Histogram
+_cached = {}        # (name, hit) -> count
+
+# the values recorded in the request being served by the thread
+_local = threading.local()
+
+def _record(name, seconds, queries):
+    values = getattr(_local, 'values', None)
+    if values is None:
+        # not in a request
+        _observe({name: [seconds, queries]}, {})
+        return
+
+    v = values.get(name)
+    if v is None:
+        values[name] = [seconds, queries]
+    else:
+        v[0] += seconds
+        v[1] += queries
+
+def _record_cached(name, hit):
+    counts = getattr(_local, 'cached', None)
+    if counts is None:
+        _observe({}, {(name, hit): 1})
+        return
+
+    key = (name, hit)
+    counts[key] = counts.get(key, 0) + 1
+
+def _observe(values, cached):
+    with _lock:
+        for name, (seconds, queries) in values.iteritems():
+            if name not in _seconds:
+                _seconds[name] = Histogram(SECONDS_BUCKETS)
+                _queries[name] = Histogram(QUERIES_BUCKETS)
+            _seconds[name].observe(seconds)
+            _queries[name].observe(queries)
+
+        for key, n in cached.iteritems():
+            _cached[key] = _cached.get(key, 0) + n
+
+def _request_started(sender, **kwargs):
+    # record the queries even if not in debug mode
+    connection.use_debug_cursor = True
+    _local.values = {}
+    _local.cached = {}
+
+def _request_finished(sender, **kwargs):
+    values = getattr(_local, 'values', None)
+    cached = getattr(_local, 'cached', None)
+    _local.values = _local.cached = None
+    if values is not None:
+        _observe(values, cached)
+
+if ENABLED:
+    request_started.connect(_request_started)
+    request_finished.connect(_request_finished)
+    cache.cached_method_hook = _record_cached
+
+
+def exposition():
+    """Return the metrics collected in the Prometheus text format."""
+    rv = []
+    with _lock:
+        rv.append('# TYPE darts_call_seconds histogram')
+        for name in sorted(_seconds):
+            rv.extend(_seconds[name].lines(
+                'darts_call_seconds', 'name="%s"' % name))
+
+        rv.append('# TYPE darts_call_queries histogram')
+        for name in sorted(_queries):
+            rv.extend(_queries[name].lines(
+                'darts_call_queries', 'name="%s"' % name))
+
+        rv.append('# TYPE darts_cached_method_total counter')
+        for (name, hit), n in sorted(_cached.iteritems()):
+            rv.append('darts_cached_method_total{name="%s",result="%s"} %s'
+                % (name, hit and 'hit' or 'miss', n))
+
+    caches = [ (name, c.stats()) for name, c in sorted(cache.registry.items()) ]
+    for counter in ('hits', 'misses', 'evictions', 'expirations'):
+        rv.append('# TYPE darts_cache_%s_total counter' % counter)
+        for name, stats in caches:
+            rv.append('darts_cache_%s_total{cache="%s"} %s'
+                % (counter, name, stats[counter]))
+
+    rv.append('# TYPE darts_cache_size gauge')
+    for name, stats in caches:
+        rv.append('darts_cache_size{cache="%s"} %s' % (name, stats['size']))
+
+    rv.append('')
+    return '\n'.join(rv)
@@ -1,4 +1,20 @@
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+class BlobField(models.Field):
+    """Binary data, read and written as a string."""
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'bytea'
+        return 'blob'
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if value is not None:
+            # as the database adapters expect binary data
+            value = buffer(value)
+        return value
+
 
 class Player(models.Model):
     username = models.CharField(max_length=64, unique=True)
@@ -17,19 +33,23 @@ class Match(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     target_score = models.IntegerField()
     legs_number = models.IntegerField()
+    legs_played = models.IntegerField(default=0)    # legs with a winner
     winner = models.ForeignKey(Player, blank=True, null=True)
+    version = models.IntegerField(default=0)    # bumped at every change
+    rules = models.CharField(max_length=32, default='double-out') # rules.py
 
 class Entrant(models.Model):
     match = models.ForeignKey(Match)
     player = models.ForeignKey(Player)
     order = models.IntegerField()
-    result = models.IntegerField(blank=True, null=True)
+    result = models.IntegerField(blank=True, null=True, default=0) # legs won
 
 class Leg(models.Model):
-    match = models.ForeignKey(Match)
+    match = models.ForeignKey(Match, db_index=False) # see sql/leg.sql
     started_at = models.DateTimeField(auto_now_add=True)
     number = models.IntegerField()
     winner = models.ForeignKey(Player, blank=True, null=True)
+    darts = BlobField(blank=True, null=True) # if archived, see archive.py
 
     def __eq__(self, other):
         if self.id is None:
@@ -44,16 +64,75 @@ class Leg(models.Model):
         return hash((self.id, self.number))
 
 class Round(models.Model):
-    leg = models.ForeignKey(Leg)
+    leg = models.ForeignKey(Leg, db_index=False) # see sql/round.sql
     number = models.IntegerField()
     player = models.ForeignKey(Player)
     score_start = models.IntegerField()
     score_end = models.IntegerField(blank=True, null=True)
 
 class Throw(models.Model):
-    round = models.ForeignKey(Round)
+    round = models.ForeignKey(Round, db_index=False) # see sql/throw.sql
     number = models.IntegerField()
     code = models.CharField(max_length=16) # es. "8", "T20", "RING", "BULL",
     score = models.IntegerField()   # value of the throw
 
 
+class MatchLog(models.Model):
+    """A change of a match, in the append-only log the state is replayed from.
+    """
+    match = models.ForeignKey(Match, db_index=False) # see Meta
+    seq = models.IntegerField()     # 1, 2... in the match
+    action = models.CharField(max_length=8) # 'throw', 'undo', 'redo'
+    code = models.CharField(max_length=16, blank=True)  # thrown or redone
+
+    # the ids of the leg, round and throw rows of a throw or redo
+    leg = models.IntegerField(blank=True, null=True)
+    round = models.IntegerField(blank=True, null=True)
+    throw = models.IntegerField(blank=True, null=True)
+
+    class Meta:
+        unique_together = (('match', 'seq'),)
+
+class MatchSnapshot(models.Model):
+    """The state of a match after a change of its log, taken at every leg."""
+    match = models.ForeignKey(Match, db_index=False) # see Meta
+    seq = models.IntegerField()     # of the last change in the state
+    data = models.TextField()       # state.serialize() as JSON
+    format = models.IntegerField(default=0) # state._FORMAT of the data
+
+    class Meta:
+        unique_together = (('match', 'seq'),)
+
+
+class PlayerStats(models.Model):
+    """Counters of a player throws, updated at every throw and undo."""
+    player = models.OneToOneField(Player, primary_key=True)
+    darts = models.IntegerField(default=0)
+    points = models.IntegerField(default=0)
+    visits = models.IntegerField(default=0)         # rounds played
+    first9_darts = models.IntegerField(default=0)   # in the first 3 rounds
+    first9_points = models.IntegerField(default=0)  # of every leg
+    checkout_attempts = models.IntegerField(default=0)
+    checkouts = models.IntegerField(default=0)
+    doubles = models.IntegerField(default=0)        # hit in the attempts
+    highest_finish = models.IntegerField(default=0)
+    scores_100 = models.IntegerField(default=0)     # rounds of 100 or more
+    scores_140 = models.IntegerField(default=0)
+    scores_180 = models.IntegerField(default=0)
+
+class PlayerSegmentStats(models.Model):
+    """Number of throws of a player on a segment (a throw code)."""
+    player = models.ForeignKey(Player)
+    code = models.CharField(max_length=16)
+    hits = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('player', 'code'),)
+
+
+@receiver(post_save, sender=Match)
+@receiver(post_delete, sender=Match)
+def match_changed(sender, instance, **kwargs):
+    # the match may have been changed out of the game (e.g. in the admin)
+    from darts import state
+    state.invalidate(instance.id)
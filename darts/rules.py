@@ -0,0 +1,125 @@
+"""The rules of the variants of the game.
+
+The rules say how a player starts scoring in a leg (the "in") and how the
+leg must be finished (the "out"):
+
+- straight-in: every dart scores; double-in: the darts only score after
+  the player has hit a double or the bull;
+- double-out: the leg must end on a double or the bull; master-out: on a
+  double, a treble or the bull; straight-out: on any dart.
+
+A dart going below zero, to zero without a finishing dart, or to a score
+that can't be finished anymore is a bust.
+
+Every `Rules` builds, when created, a table with what each dart does for
+the score left, so playing a throw is a lookup whatever the variant.
+"""
+
+from darts.codes import GameError, CODES, _bad_code
+
+# The results of a dart
+PLAY, WIN, BUST = 'play', 'win', 'bust'
+
+# The darts that can end a leg, by out rule
+OUTS = {
+    'double': lambda c: c.is_double,
+    'master': lambda c: c.is_double or c.multiplier == 3,
+    'straight': lambda c: c.value > 0,
+}
+
+
+class Rules(object):
+    """The rules a match is played with."""
+    def __init__(self, name, label, double_in, out):
+        self.name = name
+        self.label = label
+        self.double_in = double_in
+        self.out = out
+
+        is_finishing = OUTS[out]
+        self.finishing = tuple(c.code for c in CODES if is_finishing(c))
+
+        # the lowest score that can still be finished
+        self.min_left = min(c.value for c in CODES if is_finishing(c))
+
+        # the scores that can be finished with a single dart
+        self.finishes = frozenset(c.value for c in CODES if is_finishing(c))
+
+        # map code -> (value, results), the results indexed by the score
+        # left after the dart, clamped to -1..min_left, plus one
+        self._darts = {}
+        self._opening = {}
+        for c in CODES:
+            dart = (c.value, self._results(is_finishing(c)))
+            self._darts[c.code] = dart
+            if double_in and not c.is_double:
+                # not in yet: the dart doesn't score
+                dart = (0, self._results(False))
+            self._opening[c.code] = dart
+
+    def _results(self, finishing):
+        rv = [BUST] * (self.min_left + 2)
+        if finishing:
+            rv[1] = WIN
+        rv[-1] = PLAY
+        return tuple(rv)
+
+    def dart(self, code, opened=True):
+        """Return the value of a dart and its results by the score it leaves.
+
+        `opened` tells if the player is in. The result of a dart leaving a
+        score `left` is `results[min(max(left, -1), self.min_left) + 1]`.
+        Raise `GameError` if the code is not valid.
+        """
+        try:
+            return (opened and self._darts or self._opening)[code]
+        except (KeyError, TypeError):
+            raise _bad_code(code)
+
+    def play(self, code, score, target_score):
+        """Return the value of a dart and its result (`PLAY`, `WIN`, `BUST`).
+
+        `score` is the score left before the dart: the player is in if it is
+        lower than the `target_score`. Raise `GameError` if the code is not
+        valid.
+        """
+        value, results = self.dart(code, score < target_score)
+        left = score - value
+        if left < 0:
+            left = -1
+        elif left > self.min_left:
+            left = self.min_left
+        return value, results[left + 1]
+
+    def __repr__(self):
+        return '<Rules %s>' % self.name
+
+
+def _make_rules():
+    rv = []
+    for double_in in (False, True):
+        for out in ('double', 'master', 'straight'):
+            name = '%s-out' % out
+            label = '%s out' % out
+            if double_in:
+                name = 'double-in-' + name
+                label = 'double in, ' + label
+            rv.append(Rules(name, label, double_in, out))
+
+    return tuple(rv)
+
+# All the rules a match can be played with
+RULES = _make_rules()
+_RULES_MAP = dict((r.name, r) for r in RULES)
+
+# The name of the rules of the matches not choosing any
+DEFAULT = 'double-out'
+
+def get(name):
+    """Return the `Rules` with a name. Raise `GameError` if not valid."""
+    try:
+        return _RULES_MAP[name]
+    except (KeyError, TypeError):
+        if isinstance(name, unicode):
+            name = name.encode('ascii', 'replace')
+        raise GameError("bad rules: '%s'" % (name,))
@@ -0,0 +1,2 @@
+-- The legs of a match are looked up in order.
+CREATE INDEX darts_leg_match_id_number ON darts_leg (match_id, number);
@@ -0,0 +1,2 @@
+-- The rounds of a leg are looked up in order.
+CREATE INDEX darts_round_leg_id_number ON darts_round (leg_id, number);
@@ -0,0 +1,2 @@
+-- The throws of a round are looked up in order.
+CREATE INDEX darts_throw_round_id_number ON darts_throw (round_id, number);
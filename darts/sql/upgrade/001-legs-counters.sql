@@ -0,0 +1,4 @@
+-- Add the legs counters to the matches and the entrants.
+-- After running it, run "manage.py rebuild_counters" to fill them in.
+
+ALTER TABLE darts_match ADD COLUMN legs_played integer NOT NULL DEFAULT 0;
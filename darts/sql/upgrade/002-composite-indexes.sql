@@ -0,0 +1,11 @@
+-- Replace the indexes on the foreign keys of legs, rounds and throws with
+-- indexes for their ordered lookups.
+-- New databases get them from the sql/<model>.sql files.
+
+CREATE INDEX darts_leg_match_id_number ON darts_leg (match_id, number);
+CREATE INDEX darts_round_leg_id_number ON darts_round (leg_id, number);
+CREATE INDEX darts_throw_round_id_number ON darts_throw (round_id, number);
+
+DROP INDEX darts_leg_661a1ece;
+DROP INDEX darts_round_3cb9d579;
+DROP INDEX darts_throw_70086e75;
@@ -0,0 +1,26 @@
+-- Add the tables of the players statistics counters.
+-- After running it, run "manage.py rebuild_stats" to fill them in.
+
+CREATE TABLE darts_playerstats (
+    player_id integer NOT NULL PRIMARY KEY REFERENCES darts_player (id),
+    darts integer NOT NULL,
+    points integer NOT NULL,
+    visits integer NOT NULL,
+    first9_darts integer NOT NULL,
+    first9_points integer NOT NULL,
+    checkout_attempts integer NOT NULL,
+    checkouts integer NOT NULL,
+    doubles integer NOT NULL,
+    highest_finish integer NOT NULL,
+    scores_100 integer NOT NULL,
+    scores_140 integer NOT NULL,
+    scores_180 integer NOT NULL
+);
+
+CREATE TABLE darts_playersegmentstats (
+    id integer NOT NULL PRIMARY KEY,
+    player_id integer NOT NULL REFERENCES darts_player (id),
+    code varchar(16) NOT NULL,
+    hits integer NOT NULL,
+    UNIQUE (player_id, code)
+);
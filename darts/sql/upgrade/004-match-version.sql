@@ -0,0 +1,4 @@
+-- Add the version of the matches, checked by the game to detect concurrent
+-- changes. The states cached by the previous version are ignored.
+
+ALTER TABLE darts_match ADD COLUMN version integer NOT NULL DEFAULT 0;
@@ -0,0 +1,5 @@
+-- Add the rules the matches are played with. The existing matches were
+-- played double-out. The states cached by the previous version are ignored.
+
+ALTER TABLE darts_match ADD COLUMN rules varchar(32) NOT NULL
+    DEFAULT 'double-out';
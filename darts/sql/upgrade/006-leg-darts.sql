@@ -0,0 +1,4 @@
+-- Add the darts of the archived legs (see darts/archive.py). On PostgreSQL
+-- use the type bytea instead of blob.
+
+ALTER TABLE darts_leg ADD COLUMN darts blob;
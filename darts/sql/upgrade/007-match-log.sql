@@ -0,0 +1,24 @@
+-- Add the log of the changes of the matches and the snapshots of their
+-- state. The matches already started keep being read from the rounds and
+-- throws until their next change, which takes their first snapshot.
+
+CREATE TABLE darts_matchlog (
+    id integer NOT NULL PRIMARY KEY,
+    match_id integer NOT NULL REFERENCES darts_match (id),
+    seq integer NOT NULL,
+    action varchar(8) NOT NULL,
+    code varchar(16) NOT NULL,
+    leg integer NULL,
+    round integer NULL,
+    throw integer NULL,
+    UNIQUE (match_id, seq)
+);
+
+CREATE TABLE darts_matchsnapshot (
+    id integer NOT NULL PRIMARY KEY,
+    match_id integer NOT NULL REFERENCES darts_match (id),
+    seq integer NOT NULL,
+    data text NOT NULL,
+    format integer NOT NULL,
+    UNIQUE (match_id, seq)
+);
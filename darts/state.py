@@ -0,0 +1,659 @@
+"""In-memory representation of the state of a match.
+
+The state is loaded from the database once and then kept up to date applying
+the throws (and their undo) in memory, so that the game logic doesn't need to
+rebuild it from the tables at each throw.
+
+Every change of a match is appended to its log (`models.MatchLog`) and the
+state is snapshot at the start of every leg (`models.MatchSnapshot`): the
+state is loaded from the last snapshot replaying the changes after it. The
+matches without a log, started before it or imported, are read from the
+rounds and throws tables, which are kept up to date for the statistics and
+the history anyway.
+
+The states are cached in the Django cache configured by the
+`DARTS_STATE_CACHE_BACKEND` setting, so that they can be shared by several
+processes, and in a per-process LRU cache to avoid deserializing them again.
+Every match has a version number in the shared cache, bumped at every change:
+a cached state is only valid if it has the current version.
+"""
+
+from time import time
+
+from django.conf import settings
+from django.utils import simplejson
+from django.core.cache import get_cache
+
+from darts import models
+from darts import archive
+from darts import rules as game_rules
+from darts.codes import GameError
+from darts.cache import LRUCache
+
+class ThrowState(object):
+    __slots__ = ('id', 'number', 'code', 'score')
+
+    def __init__(self, id, number, code, score):
+        self.id = id
+        self.number = number
+        self.code = code
+        self.score = score
+
+
+class RoundState(object):
+    __slots__ = ('id', 'number', 'player_id', 'score_start', 'score_end',
+        'throws')
+
+    def __init__(self, id, number, player_id, score_start, score_end=None):
+        self.id = id
+        self.number = number
+        self.player_id = player_id
+        self.score_start = score_start
+        self.score_end = score_end
+        self.throws = []
+
+    @property
+    def score(self):
+        """The player score after the throws of the round."""
+        if self.score_end is not None:
+            return self.score_end
+
+        score = self.score_start
+        for t in self.throws:
+            score -= t.score
+        return score
+
+
+class LegState(object):
+    __slots__ = ('id', 'number', 'winner_id', 'rounds')
+
+    def __init__(self, id, number, winner_id=None):
+        self.id = id
+        self.number = number
+        self.winner_id = winner_id
+        self.rounds = []
+
+
+class PlayResult(object):
+    """What a throw has added to the state.
+
+    The game uses it to know what to insert and update in the database.
+    """
+    def __init__(self):
+        self.leg = None
+        self.round = None
+        self.throw = None
+        self.prev_scores = None     # of the throws before in the round
+        self.score = None           # left after the throw, or before if bust
+        self.win = False
+        self.bust = False
+        self.match_winner_id = None
+
+
+class UndoResult(object):
+    """What an undo has removed from the state.
+
+    The game uses it to know what to delete and update in the database.
+    """
+    def __init__(self):
+        self.throw = None
+        self.round = None
+        self.round_score_end = None     # before the undo
+        self.round_deleted = False
+        self.round_reopened = False
+        self.empty_rounds = []
+        self.leg = None
+        self.leg_deleted = False
+        self.leg_winner_cleared = False
+        self.leg_winner_id = None
+        self.match_winner_cleared = False
+
+
+class MatchState(object):
+    """The state of a match: legs, rounds and throws played so far.
+
+    Objects not yet saved in the database (the leg or round about to be
+    played) have a `None` id: the caller is responsible to set the ids after
+    having saved the new rows.
+    """
+    def __init__(self, match_id, target_score, legs_number, player_ids,
+            winner_id=None, rules=game_rules.DEFAULT):
+        self.match_id = match_id
+        self.target_score = target_score
+        self.legs_number = legs_number
+        self.rules = game_rules.get(rules)
+        self.player_ids = list(player_ids)
+        self.winner_id = winner_id
+        self.legs = []
+
+        # if the rounds are packed in the legs, see `darts.archive`
+        self.archived = False
+
+        # the last change of the match log in the state, None if the log
+        # doesn't cover the state (see `load()`)
+        self.log_seq = None
+
+        # the codes of the throws undone, the last undone last: they can be
+        # played again until a new throw is played
+        self.undone = []
+
+        # the number of legs won by each player, and won by anyone
+        self.legs_won = dict((pid, 0) for pid in self.player_ids)
+        self.legs_played = 0
+
+        # the version of the match the state refers to
+        self.version = None
+
+        # the version of the match row, checked by the game before writing
+        self.match_version = 0
+
+        # the leg/round about to be played, not in the state yet
+        self._next_leg = None
+        self._next_round = None
+
+    @classmethod
+    def load(cls, match, entrants):
+        """Build the state of a match reading it from the database."""
+        state = cls._load_log(match, entrants)
+        if state is None:
+            state = cls._load_rows(match, entrants)
+        return state
+
+    @classmethod
+    def _load_log(cls, match, entrants):
+        """Build the state from the last snapshot and the changes after it.
+
+        Return `None` if the match has no log.
+        """
+        seq = 0
+        state = None
+        for seq, format, data in (models.MatchSnapshot.objects
+                .filter(match=match).order_by('-seq')
+                .values_list('seq', 'format', 'data')[:1]):
+            if format != _FORMAT:
+                # taken by another version: read the rows instead. The log
+                # doesn't cover the state: the next change snapshots it
+                state = cls._load_rows(match, entrants)
+                state.log_seq = None
+                return state
+
+            state = deserialize(simplejson.loads(data))
+            state.version = None
+
+        changes = list(models.MatchLog.objects
+            .filter(match=match, seq__gt=seq).order_by('seq')
+            .values_list('seq', 'action', 'code', 'leg', 'round', 'throw'))
+        if state is None:
+            if not changes:
+                return None
+            state = cls(match.id, match.target_score, match.legs_number,
+                [ e.player_id for e in entrants ], rules=match.rules)
+
+        # the log is read after the match: it may have changes committed
+        # meanwhile. The state is newer than the match version: changing it
+        # will raise a conflict.
+        for seq, action, code, leg_id, round_id, throw_id in changes:
+            state.apply(action, code, leg_id, round_id, throw_id)
+
+        state.log_seq = seq
+        state.match_version = match.version
+        return state
+
+    @classmethod
+    def _load_rows(cls, match, entrants):
+        state = cls(match.id, match.target_score, match.legs_number,
+            [ e.player_id for e in entrants ], winner_id=match.winner_id,
+            rules=match.rules)
+        for e in entrants:
+            state.legs_won[e.player_id] = e.result or 0
+        state.legs_played = match.legs_played
+        state.match_version = match.version
+
+        lmap = {}
+        for id, number, winner_id, darts in (models.Leg.objects
+                .filter(match=match)
+                .order_by('number')
+                .values_list('id', 'number', 'winner_id', 'darts')):
+            leg = LegState(id, number, winner_id)
+            state.legs.append(leg)
+            if darts is None:
+                lmap[id] = leg
+                continue
+
+            # archived: the rounds are replayed, they have no id
+            state.archived = True
+            for rnumber, player_id, score_start, score_end, throws in (
+                    archive.unpack(darts, state.rules, state.target_score,
+                        state.leg_order(number))):
+                round = RoundState(
+                    None, rnumber, player_id, score_start, score_end)
+                leg.rounds.append(round)
+                round.throws = [ ThrowState(None, i + 1, code, score)
+                    for i, (code, score) in enumerate(throws) ]
+
+        if not lmap:
+            if not state.legs:
+                # nothing played: the log, empty, covers the state
+                state.log_seq = 0
+            return state
+
+        rmap = {}
+        for id, leg_id, number, player_id, score_start, score_end in (
+                models.Round.objects
+                .filter(leg__match=match)
+                .order_by('leg__number', 'number')
+                .values_list('id', 'leg', 'number', 'player',
+                    'score_start', 'score_end')):
+            # the tables are read one at time: skip the rows of the changes
+            # committed meanwhile. The state is older than the match version:
+            # changing it will raise a conflict.
+            if leg_id not in lmap:
+                continue
+            round = rmap[id] = RoundState(
+                id, number, player_id, score_start, score_end)
+            lmap[leg_id].rounds.append(round)
+
+        for id, round_id, number, code, score in (models.Throw.objects
+                .filter(round__leg__match=match)
+                .order_by('round__leg__number', 'round__number',
+                    'number')
+                .values_list('id', 'round', 'number', 'code', 'score')):
+            if round_id not in rmap:
+                continue    # added meanwhile, as above
+            rmap[round_id].throws.append(ThrowState(id, number, code, score))
+
+        return state
+
+    def leg_order(self, leg_number):
+        """Return the player ids in the order they play a leg."""
+        pids = self.player_ids
+        idx = (leg_number - 1) % len(pids)
+        return pids[idx:] + pids[:idx]
+
+    def round_player_id(self, leg_number, round_number):
+        pids = self.player_ids
+        return pids[(leg_number - 1 + round_number - 1) % len(pids)]
+
+    def round_visit(self, round_number):
+        """Return the number of rounds played before in the leg by the player
+        of a round."""
+        return (round_number - 1) // len(self.player_ids)
+
+    @property
+    def current_leg(self):
+        if self.legs:
+            leg = self.legs[-1]
+            if leg.winner_id is None or self.winner_id is not None:
+                return leg
+            number = leg.number + 1
+        else:
+            number = 1
+
+        if self._next_leg is None or self._next_leg.number != number:
+            self._next_leg = LegState(None, number)
+        return self._next_leg
+
+    @property
+    def current_round(self):
+        leg = self.current_leg
+        if leg.rounds:
+            round = leg.rounds[-1]
+            if round.score_end is None:
+                return round
+            number = round.number + 1
+        else:
+            number = 1
+
+        # the previous round of the same player, if any, has the score
+        nplayers = len(self.player_ids)
+        if len(leg.rounds) >= nplayers:
+            score_start = leg.rounds[-nplayers].score_end
+        else:
+            score_start = self.target_score
+
+        player_id = self.round_player_id(leg.number, number)
+        rnd = self._next_round
+        if rnd is None or rnd.number != number \
+                or rnd.player_id != player_id \
+                or rnd.score_start != score_start:
+            rnd = self._next_round = RoundState(
+                None, number, player_id, score_start)
+        return rnd
+
+    def last_rounds(self):
+        """Return the last round played by each player in the current leg.
+
+        The current round is included, even if not started yet.
+        """
+        leg = self.current_leg
+        curr = self.current_round
+        nplayers = len(self.player_ids)
+        if curr is self._next_round:
+            rv = leg.rounds[max(0, len(leg.rounds) - nplayers + 1):]
+            rv.append(curr)
+        else:
+            rv = leg.rounds[-nplayers:]
+        return rv
+
+    def leg_score(self):
+        """Return a map player id -> score in the current leg."""
+        smap = dict((pid, self.target_score) for pid in self.player_ids)
+        for round in self.last_rounds():
+            smap[round.player_id] = round.score
+        return smap
+
+    def apply(self, action, code=None, leg_id=None, round_id=None,
+            throw_id=None):
+        """Apply a change to the state: 'throw' `code`, 'undo' or 'redo'.
+
+        A throw or redo sets the ids of its objects to the ones passed and
+        returns a `PlayResult`; an undo returns the result of `undo_throw()`.
+        """
+        if action == 'undo':
+            return self.undo_throw()
+
+        if action == 'redo':
+            if not self.undone:
+                raise GameError('nothing to redo')
+            self.undone.pop()
+        else:
+            del self.undone[:]
+
+        rv = self.play(code)
+        if leg_id is not None:
+            rv.leg.id = leg_id
+        if round_id is not None:
+            rv.round.id = round_id
+        if throw_id is not None:
+            rv.throw.id = throw_id
+        return rv
+
+    def play(self, code):
+        """Play a throw in the current round.
+
+        Return a `PlayResult`. Raise `GameError`, without changing the state,
+        if the match is over or the code is not valid.
+        """
+        if self.winner_id is not None:
+            raise GameError('this game is over')
+
+        rv = PlayResult()
+        rv.leg = self.current_leg
+        round = rv.round = self.current_round
+        rv.prev_scores = [ t.score for t in round.throws ]
+
+        score = round.score
+        value, result = self.rules.play(code, score, self.target_score)
+        rv.score = score - value
+        rv.win = result == game_rules.WIN
+        rv.bust = result == game_rules.BUST
+        if rv.bust:
+            rv.score = round.score_start
+
+        throw = rv.throw = self.add_throw(code, value)
+        if throw.number == 3 or rv.win or rv.bust:
+            self.end_round(rv.score)
+        if rv.win:
+            rv.match_winner_id = self.win_leg(round.player_id)
+
+        return rv
+
+    def add_throw(self, code, score):
+        """Add a throw to the current round.
+
+        Add the current leg and round to the state too, if they are new.
+        Return the new `ThrowState`.
+        """
+        leg = self.current_leg
+        round = self.current_round
+        if leg is self._next_leg:
+            self.legs.append(leg)
+            self._next_leg = None
+        if round is self._next_round:
+            leg.rounds.append(round)
+            self._next_round = None
+
+        throw = ThrowState(None, len(round.throws) + 1, code, score)
+        round.throws.append(throw)
+        return throw
+
+    def end_round(self, score_end):
+        self.current_round.score_end = score_end
+
+    def win_leg(self, player_id):
+        """Set the winner of the current leg.
+
+        Return the id of the match winner if the leg has decided the match,
+        else `None`.
+        """
+        self.current_leg.winner_id = player_id
+        self.legs_won[player_id] += 1
+        self.legs_played += 1
+
+        mwid = self._get_match_winner_id()
+        if mwid is not None:
+            self.winner_id = mwid
+        return mwid
+
+    def _get_match_winner_id(self):
+        pids = self.player_ids
+        assert len(pids) > 0
+        nlegs = self.legs_played
+
+        # special case: if there is a single players, he'll play all the legs
+        if len(pids) == 1:
+            if nlegs >= self.legs_number:
+                return pids[0]
+            else:
+                return None
+
+        rank = [ (self.legs_won[pid], pid) for pid in pids ]
+        rank.sort(reverse=True)
+
+        # if the second can't get the first, the first is the winner
+        if rank[1][0] + (self.legs_number - nlegs) < rank[0][0]:
+            return rank[0][1]
+        else:
+            return None
+
+    def undo_throw(self):
+        """Remove the last throw played from the state.
+
+        Return an `UndoResult` or `None` if there was nothing to undo.
+        """
+        if not self.legs:
+            # no leg has been played yet in the match.
+            return
+
+        leg = self.legs[-1]
+        rv = UndoResult()
+        rv.leg = leg
+
+        # there shouldn't be a round without throws in the db, but just in
+        # case...
+        while leg.rounds and not leg.rounds[-1].throws:
+            rv.empty_rounds.append(leg.rounds.pop())
+
+        if not leg.rounds:
+            # no throw played in the leg yet
+            if not rv.empty_rounds:
+                return
+            return rv
+
+        round = rv.round = leg.rounds[-1]
+        rv.round_score_end = round.score_end
+        rv.throw = round.throws.pop()
+        self.undone.append(rv.throw.code)
+
+        if round.throws:
+            # easy stuff: we just drop one throw from the round
+            if round.score_end is not None:
+                round.score_end = None
+                rv.round_reopened = True
+        else:
+            # we must drop the throw and its round
+            leg.rounds.pop()
+            rv.round_deleted = True
+            if not leg.rounds:
+                self.legs.pop()
+                rv.leg_deleted = True
+
+        # if the last throw had made a winner, well, he is no more
+        if leg.winner_id is not None:
+            self.legs_won[leg.winner_id] -= 1
+            self.legs_played -= 1
+            rv.leg_winner_id = leg.winner_id
+            leg.winner_id = None
+            rv.leg_winner_cleared = True
+
+        # ditto for the match
+        if self.winner_id is not None:
+            self.winner_id = None
+            rv.match_winner_cleared = True
+
+        return rv
+
+
+def serialize(state):
+    """Return a compact representation of a `MatchState`.
+
+    The representation is only made of tuples and numbers/strings so it can
+    be stored efficiently by any cache backend.
+    """
+    return (state.match_id, state.target_score, state.legs_number,
+        state.rules.name,
+        tuple((pid, state.legs_won[pid]) for pid in state.player_ids),
+        state.legs_played, state.winner_id, state.version, state.match_version,
+        tuple((leg.id, leg.number, leg.winner_id,
+            tuple((r.id, r.number, r.player_id, r.score_start, r.score_end,
+                tuple((t.id, t.code, t.score) for t in r.throws))
+                for r in leg.rounds))
+            for leg in state.legs),
+        state.archived, state.log_seq, tuple(state.undone))
+
+def deserialize(data):
+    """Build a `MatchState` from the output of `serialize()`."""
+    (match_id, target_score, legs_number, rules, players, legs_played,
+        winner_id, version, match_version, legs, archived, log_seq,
+        undone) = data
+
+    state = MatchState(match_id, target_score, legs_number,
+        [ pid for pid, legs_won in players ], winner_id=winner_id,
+        rules=rules)
+    state.legs_won.update(players)
+    state.legs_played = legs_played
+    state.version = version
+    state.match_version = match_version
+    state.archived = archived
+    state.log_seq = log_seq
+    state.undone = list(undone)
+    for id, number, leg_winner_id, rounds in legs:
+        leg = LegState(id, number, leg_winner_id)
+        state.legs.append(leg)
+
+        for id, number, player_id, score_start, score_end, throws in rounds:
+            round = RoundState(id, number, player_id, score_start, score_end)
+            leg.rounds.append(round)
+            round.throws = [ ThrowState(id, i + 1, code, score)
+                for i, (id, code, score) in enumerate(throws) ]
+
+    return state
+
+
+_backend = get_cache(getattr(settings, 'DARTS_STATE_CACHE_BACKEND', 'default'))
+_timeout = getattr(settings, 'DARTS_STATE_CACHE_TTL', 3600)
+
+# The states already deserialized by this process, by match id and version:
+# the states of the old versions are never looked up again and age out
+_states = LRUCache(
+    maxsize=getattr(settings, 'DARTS_STATE_CACHE_SIZE', 100),
+    ttl=_timeout, name='darts.state')
+
+# Bump it if the output of serialize() changes: the snapshots in the database
+# taken with another format are ignored too
+_FORMAT = 6
+
+def _version_key(match_id):
+    return 'darts:version:%s' % match_id
+
+def _state_key(match_id):
+    return 'darts:state:%s:%s' % (_FORMAT, match_id)
+
+def get_version(match_id):
+    """Return the current version of a match state.
+
+    If the version is unknown, start a new one: use a timestamp instead of
+    restarting from 1, so that a state stored with an evicted version is not
+    mistaken for a current one.
+    """
+    key = _version_key(match_id)
+    version = _backend.get(key)
+    if version is None:
+        _backend.add(key, int(time() * 1000), _timeout)
+        version = _backend.get(key)
+    return version
+
+def get_cached(match_id, for_update=False):
+    """Return the cached state of a match, `None` if not available.
+
+    Cost a single round-trip to the cache backend. If `for_update` the state
+    is a private copy, deserialized again and never kept in the process
+    cache: the caller can change it without other threads seeing the change,
+    and share it by `state_changed()` once committed.
+    """
+    vkey = _version_key(match_id)
+    skey = _state_key(match_id)
+    data = _backend.get_many([vkey, skey])
+    version = data.get(vkey)
+    if version is None:
+        return None
+
+    if not for_update:
+        state = _states.get((match_id, version))
+        if state is not None:
+            return state
+
+    data = data.get(skey)
+    if data is None:
+        return None
+
+    state = deserialize(data)
+    if state.version != version:
+        return None
+
+    if not for_update:
+        _states.put((match_id, version), state)
+    return state
+
+def set_cached(state):
+    """Store the state of a match read from the database in the cache.
+
+    `state.version` should be the one returned by `get_version()` *before*
+    reading the state: if the match has been changed meanwhile the state
+    will not be considered valid.
+    """
+    _states.put((state.match_id, state.version), state)
+    _backend.set(_state_key(state.match_id), serialize(state), _timeout)
+
+def state_changed(state):
+    """Store in the cache a state just committed to the database."""
+    state.version = _bump_version(state.match_id)
+    set_cached(state)
+
+def invalidate(match_id, version=None):
+    """Make any cached state of the match invalid.
+
+    If `version` is specified only drop the state if it has that version: a
+    newer state stored meanwhile is left in the cache.
+    """
+    if version is not None and _backend.get(_version_key(match_id)) != version:
+        return
+    _bump_version(match_id)
+
+def _bump_version(match_id):
+    key = _version_key(match_id)
+    try:
+        return _backend.incr(key)
+    except ValueError:
+        # the version is not in the cache
+        return get_version(match_id)
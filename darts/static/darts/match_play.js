@@ -0,0 +1,189 @@
+/* The match page: play the darts clicked on the board and show the game.
+ *
+ * The page defines DARTS_MATCH with the urls of the match, the csrf token
+ * and the match winner, if any.
+ */
+
+$(function () {
+  var match = DARTS_MATCH;
+
+  // sent with the changes, to recognize our events in the stream
+  var client = Math.random().toString(36).substr(2);
+
+  // the board is a static image: bring it in the page to click on it
+  $.ajax({
+    url: match.dartboard_url,
+    dataType: 'xml',
+    success: function (doc) {
+      var svg = document.importNode(doc.documentElement, true);
+      $('#dartboard').append(svg);
+      $(svg).find('.area').bind('click', function (e) {
+        // some jquery stuff doesn't work well with svg elements
+        var dart = jQuery.Event('dart');
+        dart.code = $(e.target).attr('data-code');
+        $('#dartboard').trigger(dart);
+      });
+    }
+  });
+
+  $('table.score td.score').bind('click', function (e) {
+    var dart = jQuery.Event('dart');
+    dart.code = $(e.currentTarget).attr('data-code');
+    $('#dartboard').trigger(dart);
+  });
+
+  $('#dartboard').bind('dart', function(e) {
+    $.ajax({
+      url: match.throw_url,
+      type: 'POST',
+      data: {
+        csrfmiddlewaretoken: match.csrf_token,
+        client: client,
+        throw_code: e.code },
+      error: ajaxError,
+      success: function (data) { showThrow(data); }
+    });
+  });
+
+  var showThrow = function (data) {
+    // update the scores
+    $('#players .current .leg_score').text(data.leg_score);
+    $('#players .current .throw').each(function(i) {
+      $(this).text(data.throws[i] ? data.throws[i].code : '-');
+    });
+
+    // write the comment
+    if (data.bust) {
+      writeComment('BUST!');
+    } else if (data.leg_winner) {
+      writeComment('WIN!', data.leg_winner);
+    } else if (data.throws.length == 3) {
+      writeComment(data.throws[0].score
+             + data.throws[1].score
+             + data.throws[2].score);
+    }
+    if (data.match_winner) {
+      writeComment('MATCH WINNER!', data.match_winner);
+    }
+
+    // move the next action indicators
+    $('#players .current .throw.current').removeClass('current');
+    $('#players .current').removeClass('current');
+    if (data.next_player) {
+      $('#players .player[data-id=' + data.next_player + ']')
+        .addClass('current');
+      $($('#players .current .throw')[data.next_throw - 1])
+        .addClass('current');
+      if (data.next_throw == 1) {
+        $('#players .current .throw').text('-');
+      }
+    }
+    else {
+      if (data.match_winner) {
+        $('#new-match').show();
+      } else {
+        $('#next-leg').show();
+      }
+    }
+
+    writeSuggestion();
+    writeChances();
+  };
+
+  // receive the changes made by the other screens on the match
+  if (window.EventSource) {
+    var source = new EventSource(match.events_url);
+    source.addEventListener('throw', function (e) {
+      var data = $.parseJSON(e.data);
+      if (data.client != client) { showThrow(data); }
+    });
+    source.addEventListener('undo', function (e) {
+      var data = $.parseJSON(e.data);
+      if (data.client != client) { location.reload(); }
+    });
+  }
+
+  // the table of the best finishes: {darts: {score: [code, ...]}}
+  var checkouts = null;
+
+  var writeSuggestion = function () {
+    var sugg;
+    var player_elem = $('#players .current');
+    if (player_elem.length && checkouts) {
+      var score = parseInt(player_elem.children('.leg_score').text());
+      var nthrows = 3 - player_elem.children('.throw').map(
+        function (i) { if ($(this).hasClass('current')) return i; })[0];
+      sugg = checkouts[nthrows] && checkouts[nthrows][score];
+    }
+
+    $('#suggestion').text(sugg ? "To win: " + sugg.join(' + ') : '');
+  };
+
+  $.getJSON(match.checkout_url, function (data) {
+    checkouts = data;
+    writeSuggestion();
+  });
+
+  // the chances of the players to win the leg and the match
+  var writeChances = function () {
+    $.getJSON(match.chances_url, function (data) {
+      $.each(data, function (pid, c) {
+        $('#players .player[data-id=' + pid + '] .chances').text(
+          Math.round(c.leg * 100) + '% / ' + Math.round(c.match * 100) + '%');
+      });
+    });
+  };
+
+  var writeComment = function (text, player_id) {
+    var elem;
+    if (!player_id) {
+      elem = $('#players .current .comment');
+    } else {
+      elem = $('#players .player[data-id=' + player_id + '] .comment');
+    }
+    elem.text(text);
+  };
+
+  $('#undo').click(function () {
+    $.ajax({
+      url: match.undo_url,
+      type: 'POST',
+      data: { csrfmiddlewaretoken: match.csrf_token, client: client },
+      error: ajaxError,
+      success: function (data) {
+        location.reload();
+      }
+    });
+  });
+
+  $('#redo').click(function () {
+    $.ajax({
+      url: match.redo_url,
+      type: 'POST',
+      data: { csrfmiddlewaretoken: match.csrf_token, client: client },
+      error: ajaxError,
+      success: function (data) {
+        location.reload();
+      }
+    });
+  });
+
+  var ajaxError = function (xhr) {
+    if (xhr.status == 400) {
+      alert(xhr.responseText);
+    }
+    else {
+      alert("error: " + xhr.statusText);
+    }
+  };
+
+  if (match.winner_id) {
+    $('#players .current').removeClass('current')
+      .children('.throw.current').removeClass('current');
+    writeComment('MATCH WINNER', match.winner_id);
+    $('#new-match').show();
+  }
+
+  writeSuggestion();
+  writeChances();
+});
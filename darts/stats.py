@@ -0,0 +1,239 @@
+"""Players statistics computed on the throws history.
+
+The throws are fetched in bulk as tuples and all the statistics are computed
+on NumPy arrays: no model instance is created and no loop runs in Python
+for each throw, except to replay the archived legs (see `darts.archive`).
+
+The statistics of the players over all their matches are read from the
+counters in `darts.aggregates` instead.
+"""
+
+import numpy as np
+
+from darts import models
+from darts import archive
+from darts import aggregates
+from darts import rules as game_rules
+from darts.codes import CODES
+
+_CODES_INDEX = dict((c.code, i) for i, c in enumerate(CODES))
+_MISS = _CODES_INDEX['MISS']
+
+# the highest score of a dart
+_MAX_DART = max(c.value for c in CODES)
+
+# the fields of every throw fetched: keep in sync with compute()
+_FIELDS = ('round__player', 'round__leg', 'round', 'round__number',
+    'round__score_start', 'round__score_end', 'number', 'code', 'score',
+    'round__leg__match__rules')
+
+
+def player_stats(player_id):
+    """Return the statistics of a player over all the matches played."""
+    try:
+        ps = models.PlayerStats.objects.get(player=player_id)
+    except models.PlayerStats.DoesNotExist:
+        return empty_stats()
+
+    rv = dict((k, getattr(ps, k)) for k in aggregates.COUNTERS)
+    rv['highest_finish'] = ps.highest_finish or None
+    rv['heatmap'] = heatmap = dict((c.code, 0) for c in CODES)
+    heatmap.update(models.PlayerSegmentStats.objects
+        .filter(player=player_id).values_list('code', 'hits'))
+    return _derive(rv)
+
+def match_stats(match_id):
+    """Return the statistics of the players of a match by player id."""
+    rv = compute(models.Throw.objects.filter(round__leg__match=match_id),
+        models.Leg.objects.filter(match=match_id))
+    for pid in (models.Entrant.objects
+            .filter(match=match_id).values_list('player', flat=True)):
+        if pid not in rv:
+            rv[pid] = empty_stats()
+    return rv
+
+def compute(throws, legs=None):
+    """Compute the statistics of the players from a queryset of throws.
+
+    The throws of the archived legs in the queryset `legs`, if any, are
+    included too. Return a dict player id -> stats. Only the players with at
+    least one throw are returned.
+    """
+    rows = list(throws.values_list(*_FIELDS))
+    if legs is not None:
+        rows.extend(_archived_rows(legs))
+    if not rows:
+        return {}
+
+    (player, leg, round, round_number, score_start, score_end,
+        number, code, score, rules) = zip(*rows)
+    del rows
+
+    # sort the throws by round and by number in the round
+    players, pidx = np.unique(player, return_inverse=True)
+    rounds, ridx = np.unique(round, return_inverse=True)
+    order = np.lexsort((np.array(number), ridx))
+    pidx = pidx[order]
+    ridx = ridx[order]
+    leg = np.array(leg)[order]
+    round_number = np.array(round_number)[order]
+    score_start = np.array(score_start)[order]
+    score_end = np.array([ s if s is not None else -1 for s in score_end ])
+    score_end = score_end[order]
+    code = np.array([ _CODES_INDEX.get(c, _MISS) for c in code ])[order]
+    score = np.array(score)[order]
+    rules_names, rules = np.unique(rules, return_inverse=True)
+    rules = rules[order]
+
+    nplayers = len(players)
+    nrounds = len(rounds)
+
+    # rounds attributes, taken from their first throw
+    first = np.flatnonzero(np.r_[True, ridx[1:] != ridx[:-1]])
+    r_pidx = pidx[first]
+    r_leg = leg[first]
+    r_number = round_number[first]
+    r_start = score_start[first]
+    r_end = score_end[first]
+    r_darts = np.bincount(ridx, minlength=nrounds)
+
+    # the points of a round closed are known (a bust is worth 0), the ones
+    # of the round in play are the sum of its throws
+    r_points = np.where(r_end >= 0, r_start - r_end,
+        np.bincount(ridx, weights=score, minlength=nrounds))
+
+    darts = np.bincount(pidx, minlength=nplayers)
+    visits = np.bincount(r_pidx, minlength=nplayers)
+    points = np.bincount(r_pidx, weights=r_points, minlength=nplayers)
+
+    # first 9 darts: the first 3 rounds of every player in every leg
+    rorder = np.lexsort((r_number, r_pidx, r_leg))
+    ord_leg = r_leg[rorder]
+    ord_pidx = r_pidx[rorder]
+    new_group = np.r_[True,
+        (ord_leg[1:] != ord_leg[:-1]) | (ord_pidx[1:] != ord_pidx[:-1])]
+    pos = np.arange(nrounds)
+    visit = np.empty(nrounds, dtype=int)
+    visit[rorder] = pos - np.maximum.accumulate(np.where(new_group, pos, 0))
+    f9 = visit < aggregates.FIRST_VISITS
+    f9_points = np.bincount(r_pidx[f9], weights=r_points[f9],
+        minlength=nplayers)
+    f9_darts = np.bincount(r_pidx[f9], weights=r_darts[f9],
+        minlength=nplayers)
+
+    # the score left before each dart, to know when a finish was possible,
+    # and if the dart could finish, by the rules of its match
+    scored = np.cumsum(score) - score
+    left = score_start - (scored - scored[first][ridx])
+    finishes, finishing = _finish_tables(rules_names)
+    attempt = finishes[rules, np.clip(left, 0, _MAX_DART + 1)]
+    is_finishing = finishing[rules, code]
+    checkout = is_finishing & (score == left)
+    attempts = np.bincount(pidx[attempt], minlength=nplayers)
+    checkouts = np.bincount(pidx[checkout], minlength=nplayers)
+    doubles = np.bincount(pidx[attempt & is_finishing], minlength=nplayers)
+
+    won = r_end == 0
+    highest = np.zeros(nplayers, dtype=int)
+    np.maximum.at(highest, r_pidx[won], r_start[won])
+
+    scores_100 = np.bincount(r_pidx[r_points >= 100], minlength=nplayers)
+    scores_140 = np.bincount(r_pidx[r_points >= 140], minlength=nplayers)
+    scores_180 = np.bincount(r_pidx[r_points == 180], minlength=nplayers)
+
+    ncodes = len(CODES)
+    heatmap = np.bincount(pidx * ncodes + code,
+        minlength=nplayers * ncodes).reshape(nplayers, ncodes)
+
+    rv = {}
+    for i, pid in enumerate(players):
+        rv[int(pid)] = _derive({
+            'darts': int(darts[i]),
+            'points': int(points[i]),
+            'visits': int(visits[i]),
+            'first9_darts': int(f9_darts[i]),
+            'first9_points': int(f9_points[i]),
+            'checkout_attempts': int(attempts[i]),
+            'checkouts': int(checkouts[i]),
+            'doubles': int(doubles[i]),
+            'highest_finish': int(highest[i]) or None,
+            'scores_100': int(scores_100[i]),
+            'scores_140': int(scores_140[i]),
+            'scores_180': int(scores_180[i]),
+            'heatmap': dict((c.code, int(n))
+                for c, n in zip(CODES, heatmap[i])),
+        })
+
+    return rv
+
+def _finish_tables(rules_names):
+    """Return the tables of the finishes of a list of rules.
+
+    Return two boolean arrays indexed by rules: the first by the score left,
+    up to the highest dart plus one, true if it can be finished with a dart;
+    the second by code index, true if the code can finish a leg.
+    """
+    finishes = np.zeros((len(rules_names), _MAX_DART + 2), dtype=bool)
+    finishing = np.zeros((len(rules_names), len(CODES)), dtype=bool)
+    for i, name in enumerate(rules_names):
+        rules = game_rules.get(name)
+        finishes[i, list(rules.finishes)] = True
+        finishing[i, [ _CODES_INDEX[c] for c in rules.finishing ]] = True
+    return finishes, finishing
+
+def _archived_rows(legs):
+    """Generate the rows of the throws of the archived legs, as `_FIELDS`.
+
+    The replayed rounds have no id: they get negative keys instead.
+    """
+    key = 0
+    for mid, leg_id, rules, rounds in archive.archived_legs(legs):
+        for number, pid, score_start, score_end, throws in rounds:
+            key -= 1
+            for i, (code, score) in enumerate(throws):
+                yield (pid, leg_id, key, number, score_start, score_end,
+                    i + 1, code, score, rules.name)
+
+def empty_stats():
+    """Return the statistics of a player who hasn't thrown yet."""
+    rv = dict.fromkeys(aggregates.COUNTERS, 0)
+    rv['highest_finish'] = None
+    rv['heatmap'] = dict((c.code, 0) for c in CODES)
+    return _derive(rv)
+
+def _derive(stats):
+    """Add the averages and percentages to a dict of counters."""
+    stats['average'] = _ratio(stats['points'] * 3, stats['darts'])
+    stats['first9_average'] = _ratio(
+        stats['first9_points'] * 3, stats['first9_darts'])
+    stats['checkout_pct'] = _ratio(
+        stats['checkouts'] * 100, stats['checkout_attempts'])
+    stats['doubles_pct'] = _ratio(
+        stats['doubles'] * 100, stats['checkout_attempts'])
+    return stats
+
+def _ratio(num, den):
+    if not den:
+        return None
+    return float(num) / den
+
+
+def heatmap_rows(heatmap):
+    """Arrange a heatmap in a table of segments by single, double, treble.
+
+    Every cell is a pair (count, heat) with heat between 0 and 1 relative to
+    the segment hit the most.
+    """
+    top = max(heatmap.values()) or 1
+    def cell(code):
+        if code is None:
+            return None
+        n = heatmap[code]
+        return (n, round(float(n) / top, 2))
+
+    rv = []
+    for n in range(20, 0, -1):
+        codes = (str(n), 'D%d' % n, 'T%d' % n)
+        rv.append((str(n), [ cell(c) for c in codes ]))
+    rv.append(('Bull', [ cell('RING'), cell('BULL'), None ]))
+    return rv
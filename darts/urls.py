@@ -5,7 +5,21 @@ urlpatterns = patterns('darts.views',
     url(r'^$', redirect_to, {'url': 'match/create/', 'permanent': False}),
     url(r'^match/^$', redirect_to, {'url': 'match/create/', 'permanent': False}),
     url(r'^match/create/$', 'match_create', name='darts_match_create'),
+    url(r'^match/create/bulk/$', 'matches_create',
+        name='darts_matches_create'),
     url(r'^match/(\d+)/play/$', 'match_play', name='darts_match_play'),
+    url(r'^match/(\d+)/scoreboard/$', 'match_scoreboard',
+        name='darts_match_scoreboard'),
+    url(r'^match/(\d+)/chances/$', 'match_chances',
+        name='darts_match_chances'),
     url(r'^match/(\d+)/throw/$', 'match_throw', name='darts_match_throw'),
+    url(r'^match/(\d+)/throws/$', 'match_throws', name='darts_match_throws'),
     url(r'^match/(\d+)/undo/$', 'match_undo', name='darts_match_undo'),
+    url(r'^match/(\d+)/redo/$', 'match_redo', name='darts_match_redo'),
+    url(r'^match/(\d+)/events/$', 'match_events', name='darts_match_events'),
+    url(r'^match/(\d+)/stats/$', 'match_stats', name='darts_match_stats'),
+    url(r'^player/(\d+)/stats/$', 'player_stats', name='darts_player_stats'),
+    url(r'^checkout/$', 'checkout_table', name='darts_checkout'),
+    url(r'^dartboard.svg$', 'dartboard_svg', name='darts_dartboard'),
+    url(r'^metrics/$', 'show_metrics', name='darts_metrics'),
 )
@@ -0,0 +1,9 @@
+"""Small helpers shared by the modules of the app."""
+
+# The numbers of the board, clockwise from the top
+BOARD = [20, 1, 18, 4, 13, 6, 10, 15, 2, 17, 3, 19, 7, 16, 8, 11, 14, 9, 12, 5]
+
+def bulk_insert(model, objs, batch_size=100):
+    """Insert objects in batches, not to exceed the SQLite parameters limit."""
+    for i in range(0, len(objs), batch_size):
+        model.objects.bulk_create(objs[i:i + batch_size])
@@ -1,138 +1,319 @@
-from django.db import transaction
+from django.db import connection, transaction
 from django.http import HttpResponse, Http404
 from django.utils import simplejson
-from django.shortcuts import render
+from django.shortcuts import render, get_object_or_404
 from django.core.urlresolvers import reverse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import etag
 
 from darts import models
-from game import Game, GameError
+from darts import events
+from darts import rules
+from darts import checkout
+from darts import dartboard
+from darts import stats
+from darts import winprob
+from darts import metrics
+from darts import writer
+from darts import matches
+from darts import state as match_state
+from game import Game, GameError, ConflictError
+from game import CONFLICT_RETRIES, conflict_backoff
 
+@metrics.instrumented
 def match_create(request):
     if request.method == 'POST':
         return match_create_post(request)
 
     players = models.Player.objects.order_by('username')
     return render(request, 'darts/match_create.tmpl',
-        {'players': players})
+        {'players': players, 'rules': rules.RULES, 'default': rules.DEFAULT})
 
-@transaction.commit_manually
+@metrics.instrumented
 def match_create_post(request):
-    score = request.POST.get('score')
-    try:
-        try:
-            score = int(score)
-            if score <= 0:
-                raise Exception()
-        except:
-            raise ValueError("bad target score: '%s'" % score)
-
-        nlegs = request.POST.get('legs')
-        try:
-            nlegs = int(nlegs)
-            if nlegs <= 0:
-                raise Exception()
-        except:
-            raise ValueError("bad legs number: '%s'" % nlegs)
+    res = matches.create_matches([request.POST])[0]
+    if 'error' in res:
+        return HttpResponse(res['error'],
+            status=400, mimetype='plain/text')
 
-        eids = request.POST.get('entrants')
-        if not eids:
-            raise ValueError("no player selected")
+    resp = {'redirect': reverse('darts_match_play', args=[res['id']])}
 
-        try:
-            eids = map(int, eids.split(','))
-        except:
-            raise ValueError("bad entrants: '%s'" % eids)
+    return HttpResponse(simplejson.dumps(resp),
+        mimetype='application/json')
 
-        if len(eids) != len(set(eids)):
-            raise ValueError("duplicate entrants")
 
-        players = []
-        for eid in eids:
-            try:
-                players.append(models.Player.objects.get(id=eid))
-            except models.Player.DoesNotExist:
-                raise ValueError('player not found: %s' % eid)
+@metrics.instrumented
+def matches_create(request):
+    """Create many matches at once.
 
-        assert players
+    The body is a JSON list of matches, each one with the fields of the
+    creation form; return a JSON list with the id or the error of every one.
+    As for the form, the request must have the CSRF token: the value of the
+    "csrftoken" cookie, set by the creation page, in the X-CSRFToken header.
+    """
+    if request.method != 'POST':
+        return HttpResponse("POST a list of matches",
+            status=405, mimetype='plain/text')
 
-    except Exception, e:
-        return HttpResponse(str(e),
+    try:
+        data = simplejson.loads(request.body)
+        if not isinstance(data, list) \
+                or not all(isinstance(m, dict) for m in data):
+            raise ValueError("not a list of matches")
+    except ValueError, e:
+        return HttpResponse("bad request: %s" % e,
             status=400, mimetype='plain/text')
 
+    return HttpResponse(simplejson.dumps(matches.create_matches(data)),
+        mimetype='application/json')
+
+
+@metrics.instrumented
+def match_play(request, id):
+    game = fetch_game(id)
     try:
-        match = models.Match(
-            target_score=score,
-            legs_number=nlegs)
-        match.save()
+        game.state
+    except models.Match.DoesNotExist:
+        raise Http404("match %s" % id)
 
-        for i, player in enumerate(players):
-            e = models.Entrant(
-                match=match,
-                player=player,
-                order=i + 1)
-            e.save()
+    return render(request, 'darts/match_play.tmpl', {'game': game,
+        'dartboard_version': dartboard.VERSION, })
 
-        transaction.commit()
-    except Exception, e:
-        transaction.rollback()
-        raise
 
-    resp = {'redirect': reverse('darts_match_play', args=[match.id])}
+def state_etag(request, id):
+    # the version of the match state changes at every throw and undo: a
+    # conditional request costs only its lookup in the cache
+    return str(match_state.get_version(int(id)))
 
-    return HttpResponse(simplejson.dumps(resp),
+@metrics.instrumented
+@cache_control(no_cache=True)
+@etag(state_etag)
+def match_scoreboard(request, id):
+    game = fetch_game(id)
+    try:
+        rv = game.get_scoreboard()
+    except models.Match.DoesNotExist:
+        raise Http404("match %s" % id)
+
+    return HttpResponse(simplejson.dumps(rv),
         mimetype='application/json')
 
 
-def match_play(request, id):
+@metrics.instrumented
+@cache_control(no_cache=True)
+@etag(state_etag)
+def match_chances(request, id):
     game = fetch_game(id)
-    return render(request, 'darts/match_play.tmpl', {'game': game, })
+    try:
+        rv = winprob.win_chances(game.state)
+    except models.Match.DoesNotExist:
+        raise Http404("match %s" % id)
 
+    return HttpResponse(simplejson.dumps(rv),
+        mimetype='application/json')
 
-@transaction.commit_manually
-def match_throw(request, id):
-    game = fetch_game(id)
 
+@metrics.instrumented
+def match_throw(request, id):
     try:
         throw_code = request.POST['throw_code']
     except KeyError, e:
-        transaction.rollback()
         return HttpResponse("missing throw code",
             status=400, mimetype='plain/text')
 
     try:
-        rv = game.throw(throw_code)
+        game, rv = change_game(id, 'throw', throw_code)
     except GameError, e:
-        transaction.rollback()
         return HttpResponse(str(e),
             status=400, mimetype='plain/text')
-    except Exception, e:
-        transaction.rollback()
-        raise
-    else:
-        transaction.commit()
+    except ConflictError, e:
+        return HttpResponse(str(e),
+            status=409, mimetype='plain/text')
+
+    publish_event(request, game, 'throw', rv)
 
     return HttpResponse(simplejson.dumps(rv),
         mimetype='application/json')
 
-@transaction.commit_manually
+@metrics.instrumented
+def match_throws(request, id):
+    try:
+        throw_codes = request.POST['throw_codes'].split(',')
+    except KeyError, e:
+        return HttpResponse("missing throw codes",
+            status=400, mimetype='plain/text')
+
+    try:
+        game, rv = change_game(id, 'throw_round', throw_codes)
+    except GameError, e:
+        return HttpResponse(str(e),
+            status=400, mimetype='plain/text')
+    except ConflictError, e:
+        return HttpResponse(str(e),
+            status=409, mimetype='plain/text')
+
+    for res in rv:
+        publish_event(request, game, 'throw', res)
+
+    return HttpResponse(simplejson.dumps(rv),
+        mimetype='application/json')
+
+@metrics.instrumented
 def match_undo(request, id):
     if request.method != 'POST':
-        transaction.rollback()
         return HttpResponse("only POST accepted",
             status=405, mimetype='plain/text')
 
-    game = fetch_game(id)
     try:
-        game.undo_throw()
-    except Exception:
-        transaction.rollback()
-        raise
-    else:
-        transaction.commit()
+        game, rv = change_game(id, 'undo_throw')
+    except GameError, e:
+        return HttpResponse(str(e),
+            status=400, mimetype='plain/text')
+    except ConflictError, e:
+        return HttpResponse(str(e),
+            status=409, mimetype='plain/text')
+
+    publish_event(request, game, 'undo', rv)
 
     return HttpResponse(simplejson.dumps('ok'),
         mimetype='application/json')
 
+@metrics.instrumented
+def match_redo(request, id):
+    if request.method != 'POST':
+        return HttpResponse("only POST accepted",
+            status=405, mimetype='plain/text')
+
+    try:
+        game, rv = change_game(id, 'redo_throw')
+    except GameError, e:
+        return HttpResponse(str(e),
+            status=400, mimetype='plain/text')
+    except ConflictError, e:
+        return HttpResponse(str(e),
+            status=409, mimetype='plain/text')
+
+    # the spectators see it as any throw
+    publish_event(request, game, 'throw', rv)
+
+    return HttpResponse(simplejson.dumps(rv),
+        mimetype='application/json')
+
+@transaction.commit_manually
+def change_game(id, method, *args):
+    """Call a method of a game changing it and commit the change.
+
+    Return the game and the result of the method. If the match is changed
+    concurrently by another request the change is played again on the new
+    state, up to `CONFLICT_RETRIES` times, then `ConflictError` is raised.
+    With DARTS_GROUP_COMMIT the change is made by the writer thread,
+    committed with the ones of the other requests.
+    """
+    if writer.ENABLED:
+        return writer.submit(int(id), method, *args)
+
+    attempt = 0
+    while 1:
+        game = Game(id, for_update=True)
+        try:
+            rv = getattr(game, method)(*args)
+        except ConflictError:
+            # nothing written: the state of the game is not shared
+            transaction.rollback()
+            if attempt == CONFLICT_RETRIES:
+                raise
+            conflict_backoff(attempt)
+            attempt += 1
+            continue
+        except Exception:
+            transaction.rollback()
+            game.invalidate_state()
+            raise
+        else:
+            transaction.commit()
+            game.save_state()
+
+        return game, rv
+
+
+@metrics.instrumented
+def match_events(request, id):
+    game = fetch_game(id)
+    try:
+        match_id = game.state.match_id
+    except models.Match.DoesNotExist:
+        raise Http404("match %s" % id)
+
+    try:
+        last_id = int(request.META['HTTP_LAST_EVENT_ID'])
+    except (KeyError, ValueError):
+        last_id = None
+
+    # don't keep a database connection busy for the time of the stream
+    connection.close()
+
+    resp = HttpResponse(events.stream(match_id, last_id),
+        mimetype='text/event-stream')
+    resp['Cache-Control'] = 'no-cache'
+    return resp
+
+def publish_event(request, game, type, data):
+    """Push an event to the spectators of a game.
+
+    The event carries the "client" parameter of the request, so the page
+    that made the change can skip it.
+    """
+    data = dict(data, client=request.POST.get('client'))
+    events.publish(game.state.match_id, type, data)
+
+
+@metrics.instrumented
+@cache_control(public=True, max_age=24 * 60 * 60)
+def checkout_table(request):
+    try:
+        out = rules.get(request.GET.get('rules', rules.DEFAULT)).out
+    except GameError, e:
+        return HttpResponse(str(e),
+            status=400, mimetype='plain/text')
+
+    return HttpResponse(checkout.TABLES_JSON[out],
+        mimetype='application/json')
+
+
+# the url changes with the board: it can be cached forever
+@cache_control(public=True, max_age=365 * 24 * 60 * 60)
+def dartboard_svg(request):
+    return HttpResponse(dartboard.SVG, mimetype='image/svg+xml')
+
+
+@metrics.instrumented
+def player_stats(request, id):
+    player = get_object_or_404(models.Player, id=id)
+    player.stats = stats.player_stats(player.id)
+    player.heatmap = stats.heatmap_rows(player.stats['heatmap'])
+    return render(request, 'darts/player_stats.tmpl', {
+        'title': u'%s stats' % player, 'players': [player], })
+
+@metrics.instrumented
+def match_stats(request, id):
+    match = get_object_or_404(models.Match, id=id)
+    players_stats = stats.match_stats(match.id)
+    players = [ e.player for e in models.Entrant.objects
+        .select_related('player').filter(match=match).order_by('order') ]
+    for p in players:
+        p.stats = players_stats[p.id]
+        p.heatmap = stats.heatmap_rows(p.stats['heatmap'])
+    return render(request, 'darts/match_stats.tmpl', {
+        'match': match, 'rules': rules.get(match.rules),
+        'players': players, })
+
+
+def show_metrics(request):
+    if not metrics.ENABLED:
+        raise Http404("metrics not enabled")
+    return HttpResponse(metrics.exposition(),
+        mimetype='text/plain; version=0.0.4')
+
 
 def fetch_game(id):
     try:
@@ -0,0 +1,429 @@
+"""Chances of the players to win the current leg and the match.
+
+The rest of the match is simulated many times from its current state. Every
+player aims at the segment suggested by `checkout.target()` for the out rule
+of the match (at D20 before being in, in double-in) and hits, for each kind
+of target (single, double, treble, bull), the target itself or a segment
+around it as often as in his recent throws. The targets aimed in the history
+are not recorded: they are assumed to be the double-out suggested ones.
+
+The trials are run together on NumPy arrays, a round at time. The legs are
+independent: only the current leg is simulated from the state; the chances
+to win a leg from the start, which only depend on the players and on who
+starts, are cached, and the rest of the match is played drawing the legs
+winners. The chances are cached by state version, so they are computed once
+per throw.
+"""
+
+import numpy as np
+
+from django.conf import settings
+
+from darts import models
+from darts import archive
+from darts import rules as game_rules
+from darts import checkout
+from darts.cache import LRUCache, cached_lru_in
+from darts.codes import CODES
+from darts.utils import BOARD
+
+# Number of simulations of the match
+TRIALS = getattr(settings, 'DARTS_WINPROB_TRIALS', 2000)
+
+# Number of the most recent throws of a player used to model him
+MAX_HISTORY = 2000
+
+# Rounds after which a simulated leg is abandoned (the players can't finish)
+MAX_ROUNDS = 200
+
+# The kinds of target
+SINGLE, DOUBLE, TREBLE, BULL = range(4)
+NTARGETS = 4
+
+# The outcomes of a dart, relatively to the target. For the bull NEAR is the
+# other bull ring and the neighbours are any single.
+HIT, NEAR, NEIGHBOUR, NEIGHBOUR_SINGLE, MISS, OTHER = range(6)
+NOUTCOMES = 6
+
+# The outcomes of a player with no history: as `bench.Player` with accuracy
+# 0.4. It is also the prior of the players with a short history, weighted as
+# `PRIOR_WEIGHT` throws for every kind of target.
+DEFAULT_OUTCOMES = np.array([
+    # HIT NEAR  NEIGH NSINGLE MISS OTHER
+    [0.55, 0.0, 0.15, 0.15, 0.05, 0.10],    # single
+    [0.40, 0.15, 0.15, 0.0, 0.30, 0.0],     # double
+    [0.40, 0.30, 0.15, 0.15, 0.0, 0.0],     # treble
+    [0.40, 0.40, 0.0, 0.20, 0.0, 0.0],      # bull
+])
+PRIOR_WEIGHT = 30
+
+_CODES_INDEX = dict((c.code, i) for i, c in enumerate(CODES))
+
+
+def _target_kind(tc):
+    if tc.code in ('BULL', 'RING'):
+        return BULL
+    # the codes not scoring are never aimed at
+    return {0: SINGLE, 1: SINGLE, 2: DOUBLE, 3: TREBLE}[tc.multiplier]
+
+def _neighbours(number):
+    i = BOARD.index(number)
+    return BOARD[i - 1], BOARD[(i + 1) % len(BOARD)]
+
+def _outcome(aim, hit):
+    """Return the outcome of a dart aimed at a code and hitting another."""
+    if hit.value == 0:
+        return MISS
+    if hit.code == aim.code:
+        return HIT
+    if _target_kind(aim) == BULL:
+        if hit.code in ('BULL', 'RING'):
+            return NEAR
+        return hit.multiplier == 1 and NEIGHBOUR_SINGLE or OTHER
+    if hit.code in ('BULL', 'RING'):
+        return OTHER
+
+    number = aim.value // aim.multiplier
+    hit_number = hit.value // hit.multiplier
+    if hit_number == number:
+        return hit.multiplier == 1 and NEAR or OTHER
+    if hit_number in _neighbours(number):
+        if hit.multiplier == aim.multiplier:
+            return NEIGHBOUR
+        if hit.multiplier == 1:
+            return NEIGHBOUR_SINGLE
+    return OTHER
+
+def _hit_code(aim, outcome, side):
+    """Return the code hit aiming at a code, `None` for a random single."""
+    if outcome == HIT:
+        return aim.code
+    if outcome == MISS:
+        return 'MISS'
+    if outcome == OTHER:
+        return None
+    if _target_kind(aim) == BULL:
+        if outcome == NEAR:
+            return aim.code == 'BULL' and 'RING' or 'BULL'
+        return None
+
+    number = aim.value // aim.multiplier
+    if outcome == NEAR:
+        return str(number)
+    neighbour = _neighbours(number)[side]
+    if outcome == NEIGHBOUR:
+        return {1: '', 2: 'D', 3: 'T'}[aim.multiplier] + str(neighbour)
+    return str(neighbour)
+
+def _aims(out):
+    # the code to aim at by score and darts left; over 180 there is no finish
+    aims = np.zeros((182, 4), dtype=np.intp)
+    for score in range(182):
+        for darts in range(1, 4):
+            aims[score, darts] = _CODES_INDEX[
+                checkout.target(score, darts, out)]
+    return aims
+
+# The results of the darts in the tables, as integers
+_PLAY, _WIN, _BUST = range(3)
+_RESULTS_INDEX = {
+    game_rules.PLAY: _PLAY, game_rules.WIN: _WIN, game_rules.BUST: _BUST}
+
+def _rules_tables(rules):
+    """Return the tables of the darts of a `Rules`, by code hit.
+
+    Return the values and results of the darts when the player is in and
+    when he is not, the results indexed as in `Rules.dart()`.
+    """
+    rv = []
+    for opened in (True, False):
+        values = np.zeros(len(CODES), dtype=np.intp)
+        results = np.zeros((len(CODES), rules.min_left + 2), dtype=np.intp)
+        for i, c in enumerate(CODES):
+            value, res = rules.dart(c.code, opened)
+            values[i] = value
+            results[i] = [ _RESULTS_INDEX[r] for r in res ]
+        rv.extend((values, results))
+    return tuple(rv)
+
+def _build_tables():
+    # kind of every target; outcome by (code aimed, code hit)
+    kinds = np.zeros(len(CODES), dtype=np.intp)
+    outcomes = np.zeros((len(CODES), len(CODES)), dtype=np.intp)
+    for i, aim in enumerate(CODES):
+        kinds[i] = _target_kind(aim)
+        if not aim.value:
+            continue
+        for j, hit in enumerate(CODES):
+            outcomes[i, j] = _outcome(aim, hit)
+
+    # index of the code hit (-1 for a random single) by (code aimed,
+    # outcome, side)
+    hits = np.zeros((len(CODES), NOUTCOMES, 2), dtype=np.intp)
+    for i, aim in enumerate(CODES):
+        if not aim.value:
+            continue
+        for outcome in range(NOUTCOMES):
+            for side in range(2):
+                code = _hit_code(aim, outcome, side)
+                if code is None:
+                    hits[i, outcome, side] = -1
+                else:
+                    hits[i, outcome, side] = _CODES_INDEX[code]
+
+    return kinds, outcomes, hits
+
+_KINDS, _OUTCOMES, _HITS = _build_tables()
+
+# The codes of the singles from 1 to 20, drawn for a random single
+_SINGLES = np.array([ _CODES_INDEX[str(n)] for n in range(1, 21) ])
+
+# The aims by out rule, the darts tables by rules name
+_AIMS_BY_OUT = dict((out, _aims(out)) for out in game_rules.OUTS)
+_AIMS = _AIMS_BY_OUT['double']
+_TABLES = dict((r.name, _rules_tables(r)) for r in game_rules.RULES)
+
+# Aimed before being in, in double-in
+_OPENING_AIM = _CODES_INDEX['D20']
+
+
+@cached_lru_in(LRUCache(maxsize=1000, ttl=600, name='darts.winprob.players'))
+def player_outcomes(player_id):
+    """Return the probabilities of the outcomes of a player's darts.
+
+    Return an array (kind of target, outcome) estimated from the player's
+    recent throws and smoothed towards `DEFAULT_OUTCOMES`.
+    """
+    rows = list(models.Throw.objects
+        .filter(round__player=player_id).order_by('-id')
+        .values_list('round', 'number', 'round__score_start', 'code',
+            'score')[:MAX_HISTORY])
+    if len(rows) < MAX_HISTORY:
+        rows.extend(_archived_rows(player_id, MAX_HISTORY - len(rows)))
+
+    counts = np.zeros((NTARGETS, NOUTCOMES))
+    if rows:
+        round, number, score_start, code, score = map(np.array, zip(*rows))
+        order = np.lexsort((number, round))
+        round, number, score_start, code, score = (round[order],
+            number[order], score_start[order], code[order], score[order])
+        if len(rows) == MAX_HISTORY:
+            # the oldest round may miss its first darts
+            keep = round != round[0]
+            round, number, score_start, code, score = (round[keep],
+                number[keep], score_start[keep], code[keep], score[keep])
+
+        # the score before every dart: start of the round minus the darts
+        # thrown before in the round
+        done = np.cumsum(score) - score
+        first = np.r_[True, round[1:] != round[:-1]]
+        done -= np.maximum.accumulate(np.where(first, done, 0))
+        before = np.clip(score_start - done, 0, 181)
+
+        aim = _AIMS[before, np.clip(4 - number, 1, 3)]
+        hit = np.array([ _CODES_INDEX.get(c, _CODES_INDEX['MISS'])
+            for c in code ], dtype=np.intp)
+        np.add.at(counts, (_KINDS[aim], _OUTCOMES[aim, hit]), 1)
+
+    counts += DEFAULT_OUTCOMES * PRIOR_WEIGHT
+    return counts / counts.sum(axis=1)[:, None]
+
+def _archived_rows(player_id, limit):
+    """Return the rows of the most recent archived throws of a player.
+
+    The rows are as in `player_outcomes()`, the rounds with negative keys
+    decreasing with the age. The oldest round may be cut by the `limit`.
+    """
+    rv = []
+    key = 0
+    for mid, leg_id, rules, rounds in archive.archived_legs(models.Leg.objects
+            .filter(match__entrant__player=player_id).order_by('-id')):
+        for number, pid, score_start, score_end, throws in reversed(rounds):
+            if pid != player_id:
+                continue
+            key -= 1
+            for i, (code, score) in enumerate(throws):
+                rv.append((key, i + 1, score_start, code, score))
+            if len(rv) >= limit:
+                return rv[:limit]
+
+    return rv
+
+
+def simulate_legs(rules, target_score, outcomes, scores, starter,
+        round_number, darts_thrown, round_start, rng):
+    """Play legs until someone wins, many at once.
+
+    `rules` is the `Rules` of the match, played to `target_score`.
+    `outcomes` is an array (player, kind of target, outcome) of the players
+    in the order of the match; `scores` (trial, player) are the scores left
+    in every trial, `starter` (trial) the index of the player starting the
+    leg. The first round played is `round_number`, whose player has already
+    thrown `darts_thrown` darts starting from `round_start`.
+
+    Return the index of the winner of every trial, -1 if the leg has not
+    ended within `MAX_ROUNDS`.
+    """
+    ntrials, nplayers = scores.shape
+    scores = scores.copy()
+    aims = _AIMS_BY_OUT[rules.out]
+    values, results, open_values, open_results = _TABLES[rules.name]
+    min_left = rules.min_left
+    cumulative = np.cumsum(outcomes, axis=2)[:, :, :-1]
+    trials = np.arange(ntrials)
+    winner = np.empty(ntrials, dtype=np.intp)
+    winner.fill(-1)
+    alive = trials
+
+    for r in range(MAX_ROUNDS):
+        player = (starter[alive] + round_number + r - 1) % nplayers
+        score = scores[alive, player]
+        if r == 0:
+            first_dart = darts_thrown
+            start = np.empty(len(alive), dtype=np.intp)
+            start.fill(round_start)
+        else:
+            first_dart = 0
+            start = score.copy()
+
+        playing = np.ones(len(alive), dtype=bool)
+        for dart in range(first_dart, 3):
+            opened = score < target_score
+            aim = aims[np.minimum(score, 181), 3 - dart]
+            if rules.double_in:
+                aim = np.where(opened, aim, _OPENING_AIM)
+            u = rng.random_sample(len(alive))
+            outcome = (u[:, None] >= cumulative[player, _KINDS[aim]]).sum(1)
+            side = rng.randint(0, 2, len(alive))
+            hit = _HITS[aim, outcome, side]
+            single = hit < 0
+            if single.any():
+                hit[single] = _SINGLES[rng.randint(0, 20, single.sum())]
+
+            value = np.where(opened, values[hit], open_values[hit])
+            new_score = score - value
+            left = np.clip(new_score, -1, min_left) + 1
+            result = np.where(opened, results[hit, left],
+                open_results[hit, left])
+            win = playing & (result == _WIN)
+            bust = playing & (result == _BUST)
+            score = np.where(playing & ~bust, new_score, score)
+            score[bust] = start[bust]
+            winner[alive[win]] = player[win]
+            playing &= ~(win | bust)
+
+        scores[alive, player] = score
+        alive = alive[winner[alive] < 0]
+        if not len(alive):
+            break
+
+    return winner
+
+@cached_lru_in(LRUCache(maxsize=100, ttl=600, name='darts.winprob.legs'))
+def leg_chances(player_ids, target_score, rules=game_rules.DEFAULT,
+        trials=TRIALS):
+    """Return the chances to win a leg from the start for every starter.
+
+    `rules` is the name of the rules of the match. Return an array
+    (starter, player) for the players in the match order.
+    """
+    outcomes = np.array([ player_outcomes(pid) for pid in player_ids ])
+    nplayers = len(player_ids)
+    rng = np.random.RandomState()
+    starter = np.repeat(np.arange(nplayers), trials)
+    scores = np.empty((len(starter), nplayers), dtype=np.intp)
+    scores.fill(target_score)
+    winner = simulate_legs(game_rules.get(rules), target_score, outcomes,
+        scores, starter, 1, 0, target_score, rng)
+
+    rv = np.zeros((nplayers, nplayers))
+    for s in range(nplayers):
+        rv[s] = _frequencies(winner[s * trials:(s + 1) * trials], nplayers)
+    return rv
+
+def _frequencies(winner, nplayers):
+    counts = np.bincount(winner[winner >= 0], minlength=nplayers)
+    if not counts.sum():
+        return np.ones(nplayers) / nplayers
+    return counts / float(counts.sum())
+
+
+_chances = LRUCache(maxsize=100, name='darts.winprob')
+
+def win_chances(state, trials=TRIALS):
+    """Return the chances of the players to win the current leg and the match.
+
+    Return a dict player id -> {'leg': p, 'match': p}. The result is cached
+    by the match state version.
+    """
+    key = (state.match_id, state.version, trials)
+    rv = _chances.get(key)
+    if rv is None:
+        rv = compute_chances(state, trials)
+        _chances.put(key, rv)
+    return rv
+
+def compute_chances(state, trials=TRIALS, rng=None):
+    """Simulate the rest of a match from its state, uncached."""
+    if rng is None:
+        rng = np.random.RandomState()
+    pids = state.player_ids
+    nplayers = len(pids)
+
+    if state.winner_id is not None:
+        return dict((pid, {'leg': float(pid == state.current_leg.winner_id),
+                'match': float(pid == state.winner_id)})
+            for pid in pids)
+
+    # the current leg, from its state
+    leg = state.current_leg
+    round = state.current_round
+    leg_score = state.leg_score()
+    scores = np.empty((trials, nplayers), dtype=np.intp)
+    scores[:] = [ leg_score[pid] for pid in pids ]
+    starter = np.empty(trials, dtype=np.intp)
+    starter.fill((leg.number - 1) % nplayers)
+    outcomes = np.array([ player_outcomes(pid) for pid in pids ])
+    leg_winner = simulate_legs(state.rules, state.target_score, outcomes,
+        scores, starter, round.number, len(round.throws), round.score_start,
+        rng)
+    leg_p = _frequencies(leg_winner, nplayers)
+
+    # the following legs, drawing the winners
+    fresh = leg_chances(tuple(pids), state.target_score, state.rules.name,
+        trials)
+    cumulative = np.cumsum(fresh, axis=1)
+    won = np.empty((trials, nplayers), dtype=np.intp)
+    won[:] = [ state.legs_won[pid] for pid in pids ]
+    played = state.legs_played
+    number = leg.number
+    match_winner = np.empty(trials, dtype=np.intp)
+    match_winner.fill(-1)
+    alive = np.arange(trials)
+    while len(alive):
+        if number == leg.number:
+            # a leg not ended in the simulation goes to anyone
+            winner = np.where(leg_winner >= 0, leg_winner,
+                rng.randint(0, nplayers, trials))
+        else:
+            s = (number - 1) % nplayers
+            u = rng.random_sample(len(alive))
+            winner = (u[:, None] >= cumulative[s, :-1]).sum(1)
+        won[alive, winner] += 1
+        played += 1
+        number += 1
+
+        if nplayers == 1:
+            decided = np.ones(len(alive), dtype=bool) \
+                if played >= state.legs_number \
+                else np.zeros(len(alive), dtype=bool)
+        else:
+            ranked = np.sort(won[alive], axis=1)
+            decided = (ranked[:, -2] + (state.legs_number - played)
+                < ranked[:, -1])
+        match_winner[alive[decided]] = won[alive[decided]].argmax(axis=1)
+        alive = alive[~decided]
+
+    match_p = _frequencies(match_winner, nplayers)
+    return dict((pid, {'leg': float(leg_p[i]), 'match': float(match_p[i])})
+        for i, pid in enumerate(pids))
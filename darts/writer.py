@@ -0,0 +1,240 @@
+"""Serialized writes of the games, committed in groups.
+
+SQLite locks the whole database to write: concurrent throws on different
+matches wait for each other and may fail with "database is locked". With
+DARTS_GROUP_COMMIT = True the views don't change the games in the threads
+serving the requests: they pass the changes to a single writer thread per
+process, which plays the changes arriving within DARTS_GROUP_COMMIT_WINDOW
+seconds, on any match, in a single transaction and returns its result to
+every caller. Only one thread takes the lock and a commit (a disk sync)
+serves many throws.
+
+The changes of a batch can't be rolled back one by one: the methods called
+must raise `GameError` only before writing anything. If the batch fails for
+any other reason it is rolled back and its changes are played again, each
+one in its own transaction, so that only the faulty one fails. A change
+conflicting with another process (see `ConflictError`) is played again.
+"""
+
+import sys
+import logging
+import threading
+from time import time, sleep
+from Queue import Queue, Empty
+
+from django.conf import settings
+from django.db import transaction, reset_queries
+
+from darts.game import Game, GameError, ConflictError
+from darts.game import CONFLICT_RETRIES, conflict_backoff
+
+ENABLED = getattr(settings, 'DARTS_GROUP_COMMIT', False)
+WINDOW = getattr(settings, 'DARTS_GROUP_COMMIT_WINDOW', 0.002)
+TIMEOUT = getattr(settings, 'DARTS_GROUP_COMMIT_TIMEOUT', 30)
+
+# Changes played at most in a transaction
+MAX_BATCH = 100
+
+logger = logging.getLogger(__name__)
+
+class WriterError(Exception):
+    """The writer thread hasn't written a change in time."""
+
+
+def submit(match_id, method, *args):
+    """Call a method of the game of a match in the writer thread.
+
+    Wait for the change to be committed, then return the game and the
+    result of the method, or raise its exception. Raise `WriterError` if the
+    change is not written within DARTS_GROUP_COMMIT_TIMEOUT seconds: it may
+    still be written later.
+    """
+    job = _Job(match_id, method, args)
+    writer = _get_writer()
+    with _pending_lock:
+        _pending.add(job)
+    writer.queue.put(job)
+    return job.wait()
+
+def stats():
+    """Return the number of batches written by the writer and their changes.
+    """
+    w = _writer
+    if w is None:
+        return {'batches': 0, 'changes': 0}
+    return {'batches': w.batches, 'changes': w.changes}
+
+_writer = None
+_writer_lock = threading.Lock()
+
+# The changes submitted and not written yet, watched for the timeout
+_pending = set()
+_pending_lock = threading.Lock()
+
+def _get_writer():
+    global _writer
+    if _writer is None or not _writer.is_alive():
+        with _writer_lock:
+            if _writer is None:
+                t = threading.Thread(target=_watch, name='darts-writer-watch')
+                t.daemon = True
+                t.start()
+            if _writer is None or not _writer.is_alive():
+                w = _Writer()
+                w.start()
+                _writer = w
+
+    return _writer
+
+def _watch(sleep=sleep, time=time):
+    """Wake up the callers whose change is not written within the timeout.
+
+    A timeout in `Event.wait()` would make every caller poll: the changes
+    are checked once per second here instead.
+    """
+    # bound here: the module globals are cleared at the interpreter exit
+    pending, lock = _pending, _pending_lock
+    while 1:
+        sleep(1)
+        now = time()
+        with lock:
+            for job in [ j for j in pending if j.deadline < now ]:
+                pending.discard(job)
+                job.expired = True
+                job.done.set()
+
+
+class _Job(object):
+    """A change to a game waiting for the writer."""
+    def __init__(self, match_id, method, args):
+        self.match_id = match_id
+        self.method = method
+        self.args = args
+        self.game = None
+        self.result = None
+        self.exc_info = None
+        self.committed = False
+        self.deadline = time() + TIMEOUT
+        self.expired = False
+        self.done = threading.Event()
+
+    def play(self):
+        self.game = Game(self.match_id, for_update=True)
+        self.result = getattr(self.game, self.method)(*self.args)
+
+    def reset(self):
+        if self.game is not None:
+            self.game.invalidate_state()
+        self.game = self.result = self.exc_info = None
+        self.committed = False
+
+    def finish(self):
+        """Wake up the caller, unless it has already given up."""
+        with _pending_lock:
+            _pending.discard(self)
+            self.done.set()
+
+    def wait(self):
+        self.done.wait()
+        if self.expired:
+            raise WriterError("change to match %s not written in %s s"
+                % (self.match_id, TIMEOUT))
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.game, self.result
+
+
+class _Writer(threading.Thread):
+    def __init__(self):
+        super(_Writer, self).__init__(name='darts-writer')
+        self.daemon = True
+        self.queue = Queue()
+        self.batches = self.changes = 0
+
+    def run(self):
+        while 1:
+            jobs = self.collect()
+            try:
+                self.write_batch(jobs)
+            except Exception:
+                # don't let the thread die: fail the changes not written
+                logger.exception("writing a batch of %d changes", len(jobs))
+                exc_info = sys.exc_info()
+                for job in jobs:
+                    if not job.committed and job.exc_info is None:
+                        job.exc_info = exc_info
+            finally:
+                for job in jobs:
+                    job.finish()
+
+    def write_batch(self, jobs):
+        reset_queries()
+        try:
+            self.write(jobs)
+        except Exception:
+            for job in jobs:
+                job.reset()
+            for job in jobs:
+                self.write_alone(job)
+
+        # out of the block played again: the changes are committed now
+        # and a failure sharing their state must not write them again.
+        # In order: the last change to a match stores its final state
+        for job in jobs:
+            if job.committed:
+                job.game.save_state()
+
+        self.batches += 1
+        self.changes += len(jobs)
+
+    def collect(self):
+        """Wait for a change, return it with the ones following in the window.
+        """
+        jobs = [self.queue.get()]
+        deadline = time() + WINDOW
+        while len(jobs) < MAX_BATCH:
+            try:
+                timeout = deadline - time()
+                if timeout > 0:
+                    jobs.append(self.queue.get(timeout=timeout))
+                else:
+                    jobs.append(self.queue.get_nowait())
+            except Empty:
+                break
+
+        return jobs
+
+    def write_alone(self, job):
+        """Write a change in its own transaction, playing it again on conflict.
+        """
+        attempt = 0
+        while 1:
+            try:
+                self.write([job])
+            except Exception, e:
+                exc_info = sys.exc_info()
+                job.reset()
+                if isinstance(e, ConflictError) and attempt < CONFLICT_RETRIES:
+                    conflict_backoff(attempt)
+                    attempt += 1
+                    continue
+                job.exc_info = exc_info
+            return
+
+    @transaction.commit_manually
+    def write(self, jobs):
+        try:
+            for job in jobs:
+                try:
+                    job.play()
+                except GameError:
+                    # nothing written: only drop the state it has changed
+                    job.game.invalidate_state()
+                    job.exc_info = sys.exc_info()
+            transaction.commit()
+        except Exception:
+            transaction.rollback()
+            raise
+
+        for job in jobs:
+            job.committed = job.exc_info is None
@@ -83,6 +83,11 @@ STATICFILES_FINDERS = (
 #    'django.contrib.staticfiles.finders.DefaultStorageFinder',
 )
 
+# Collect the static files with their hash in the name, so that they can be
+# served with a far future expiry: run "collectstatic" after changing them.
+STATICFILES_STORAGE = \
+    'django.contrib.staticfiles.storage.CachedStaticFilesStorage'
+
 # Override this string in your settings.local.py
 SECRET_KEY = 'TODO:ChangeMe'
 
@@ -132,6 +137,49 @@ INSTALLED_APPS = (
     # 'django.contrib.admindocs',
 )
 
+# The cache used to share the state of the matches among the processes. If
+# running several processes use a shared backend, for instance:
+#
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+#     },
+#     'darts': {
+#         'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+#         'LOCATION': '127.0.0.1:11211',
+#     },
+# }
+# DARTS_STATE_CACHE_BACKEND = 'darts'
+DARTS_STATE_CACHE_BACKEND = 'default'
+
+# Number of matches whose state is kept in memory by each process, and for
+# how many seconds the states are cached.
+DARTS_STATE_CACHE_SIZE = 100
+DARTS_STATE_CACHE_TTL = 3600
+
+# How often the spectators streams look for the events published by the
+# other processes, and after how many seconds they are closed (the browsers
+# reconnect). Every stream keeps busy a thread: to serve many spectators run
+# a server with green threads, e.g. "gunicorn -k gevent".
+DARTS_EVENTS_POLL_INTERVAL = 1.0
+DARTS_EVENTS_STREAM_DURATION = 300
+
+# Record the time and the queries of the game and of the views, exposed
+# at /darts/metrics/. Leave it off if not needed: it has a cost.
+DARTS_METRICS = False
+
+# Number of simulations of the rest of a match to estimate the chances of
+# the players to win, computed at every throw: 2000 trials take about 10 ms.
+DARTS_WINPROB_TRIALS = 2000
+
+# Make the changes to the games in a single thread per process, committing
+# together the ones arriving within the window (in seconds). It avoids the
+# "database is locked" errors of SQLite with many matches played at once.
+# The requests give up waiting for the writer after the timeout (in seconds).
+DARTS_GROUP_COMMIT = False
+DARTS_GROUP_COMMIT_WINDOW = 0.002
+DARTS_GROUP_COMMIT_TIMEOUT = 30
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -146,6 +194,10 @@ LOGGING = {
             'filters': ['require_debug_false'],
             'class': 'django.utils.log.AdminEmailHandler'
         },
+        'console': {
+            'level': 'ERROR',
+            'class': 'logging.StreamHandler',
+        },
     },
     'loggers': {
         'django.request': {
@@ -153,6 +205,11 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        # errors of the game not reaching the user, e.g. a failed cache
+        'darts': {
+            'handlers': ['console'],
+            'level': 'ERROR',
+        },
     }
 }
 